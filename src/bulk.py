@@ -0,0 +1,250 @@
+# bulk.py
+"""Bulk tenant import and export.
+
+    python src/bulk.py import tenants.yaml --namespace default --concurrency 16 --wait
+    python src/bulk.py export --namespace default --format csv
+
+A manifest is either YAML (a list of tenants, a `tenants:` list, or Tenant
+resources) or CSV with `name`, `namespace`, `revoked` and optional `group` columns.
+"""
+import argparse
+import csv
+import json
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import yaml
+from kubernetes import watch
+from kubernetes.client.rest import ApiException
+from config import Config
+from utils.tenant_index import BATCH_ANNOTATION, BATCH_SIZE_ANNOTATION
+
+# Field manager owning the Tenant fields written by bulk imports
+FIELD_MANAGER = 'mtls-bulk-import'
+
+SETTLED_PHASE = 'InChain'
+
+def _as_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('true', 'yes', '1')
+
+def load_manifest(path):
+    """Read tenants from a YAML or CSV manifest as dicts with name, namespace, revoked and group."""
+    with open(path) as f:
+        if path.endswith('.csv'):
+            rows = list(csv.DictReader(f))
+        else:
+            documents = [d for d in yaml.safe_load_all(f) if d]
+            rows = []
+            for document in documents:
+                if isinstance(document, dict) and 'tenants' in document:
+                    rows.extend(document['tenants'])
+                elif isinstance(document, list):
+                    rows.extend(document)
+                else:
+                    rows.append(document)
+
+    tenants = []
+    for row in rows:
+        if row.get('kind') == 'Tenant':
+            spec = row.get('spec', {})
+            row = {
+                'name': spec.get('name') or row['metadata']['name'],
+                'namespace': row.get('metadata', {}).get('namespace'),
+                'revoked': spec.get('revoked', False),
+                'group': spec.get('group')
+            }
+        tenants.append({
+            'name': row['name'],
+            'namespace': row.get('namespace') or None,
+            'revoked': _as_bool(row.get('revoked') or False),
+            'group': row.get('group') or None
+        })
+    return tenants
+
+def apply_tenant(custom_objects_api, tenant, namespace, batch_id, batch_size):
+    """Create or update one Tenant with a single server-side apply."""
+    body = {
+        'apiVersion': f'{Config.TENANT_GROUP}/{Config.TENANT_VERSION}',
+        'kind': 'Tenant',
+        'metadata': {
+            'name': tenant['name'],
+            'namespace': namespace,
+            'annotations': {
+                BATCH_ANNOTATION: batch_id,
+                BATCH_SIZE_ANNOTATION: str(batch_size)
+            }
+        },
+        'spec': {
+            'name': tenant['name'],
+            'revoked': tenant['revoked']
+        }
+    }
+    if tenant.get('group'):
+        body['spec']['group'] = tenant['group']
+    return custom_objects_api.patch_namespaced_custom_object(
+        Config.TENANT_GROUP, Config.TENANT_VERSION,
+        namespace, 'tenants', tenant['name'], body,
+        field_manager=FIELD_MANAGER,
+        force=True,
+        _content_type='application/apply-patch+yaml'
+    )
+
+def import_tenants(custom_objects_api, tenants, default_namespace, concurrency=16, out=sys.stdout):
+    """Apply tenants with bounded concurrency, streaming one progress line per tenant.
+
+    All tenants share a batch annotation, so the operator publishes each
+    namespace's CA chain once the whole batch is provisioned.
+    """
+    batch_id = uuid.uuid4().hex[:12]
+    sizes = {}
+    for tenant in tenants:
+        namespace = tenant['namespace'] or default_namespace
+        sizes[namespace] = sizes.get(namespace, 0) + 1
+
+    results = {'applied': [], 'failed': []}
+    lock = threading.Lock()
+    start = time.monotonic()
+
+    def apply(tenant):
+        namespace = tenant['namespace'] or default_namespace
+        apply_tenant(custom_objects_api, tenant, namespace, batch_id, sizes[namespace])
+        return namespace
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {pool.submit(apply, tenant): tenant for tenant in tenants}
+        for done, future in enumerate(as_completed(futures), 1):
+            tenant = futures[future]
+            try:
+                namespace = future.result()
+                outcome = 'applied'
+                with lock:
+                    results['applied'].append((namespace, tenant['name']))
+            except ApiException as e:
+                outcome = f'failed: {e.status} {e.reason}'
+                with lock:
+                    results['failed'].append((tenant['name'], str(e)))
+            except Exception as e:
+                # Connection errors and invalid entries fail only their tenant
+                outcome = f'failed: {e}'
+                with lock:
+                    results['failed'].append((tenant['name'], str(e)))
+            rate = done / max(time.monotonic() - start, 1e-9)
+            print(f"[{done}/{len(tenants)}] {tenant['name']} {outcome} ({rate:.1f}/s)", file=out, flush=True)
+
+    results['batch'] = batch_id
+    results['elapsed'] = time.monotonic() - start
+    return results
+
+def wait_for_phases(custom_objects_api, applied, timeout=600, out=sys.stdout):
+    """Follow the imported tenants' provisioning phases until all are settled or the timeout expires."""
+    remaining = {}
+    for namespace, name in applied:
+        remaining.setdefault(namespace, set()).add(name)
+    phases = {}
+    deadline = time.monotonic() + timeout
+
+    for namespace, names in remaining.items():
+        stream = watch.Watch()
+        for event in stream.stream(custom_objects_api.list_namespaced_custom_object,
+                                   Config.TENANT_GROUP, Config.TENANT_VERSION, namespace, 'tenants',
+                                   timeout_seconds=max(1, int(deadline - time.monotonic()))):
+            tenant = event['object']
+            name = tenant['metadata']['name']
+            if name not in names:
+                continue
+            status = tenant.get('status') or {}
+            phase = status.get('phase') or 'Pending'
+            if status.get('state') == 'Failed':
+                phase = 'Failed'
+            if phases.get((namespace, name)) != phase:
+                phases[(namespace, name)] = phase
+                print(f"{namespace}/{name}: {phase}", file=out, flush=True)
+            if phase in (SETTLED_PHASE, 'Failed'):
+                names.discard(name)
+            if not names or time.monotonic() >= deadline:
+                stream.stop()
+
+    pending = [f"{ns}/{name}" for ns, names in remaining.items() for name in names]
+    return phases, pending
+
+def export_tenants(custom_objects_api, namespace=None):
+    """Return every tenant with its status and certificate expiry, from one LIST of Tenants.
+
+    The expiry comes from the status the operator records, so it is also
+    exported when the operator issues certificates itself.
+    """
+    if namespace:
+        tenants = custom_objects_api.list_namespaced_custom_object(
+            Config.TENANT_GROUP, Config.TENANT_VERSION, namespace, 'tenants')
+    else:
+        tenants = custom_objects_api.list_cluster_custom_object(
+            Config.TENANT_GROUP, Config.TENANT_VERSION, 'tenants')
+
+    rows = []
+    for tenant in tenants['items']:
+        status = tenant.get('status') or {}
+        rows.append({
+            'name': tenant['spec']['name'],
+            'namespace': tenant['metadata']['namespace'],
+            'revoked': tenant['spec'].get('revoked', False),
+            'group': tenant['spec'].get('group'),
+            'state': status.get('state'),
+            'phase': status.get('phase'),
+            'intermediateNotAfter': status.get('intermediateNotAfter'),
+            'clientCertNotAfter': status.get('clientCertNotAfter')
+        })
+    return rows
+
+def write_rows(rows, fmt, out=sys.stdout):
+    if fmt == 'csv':
+        writer = csv.DictWriter(out, fieldnames=list(rows[0]) if rows else ['name'])
+        writer.writeheader()
+        writer.writerows(rows)
+    elif fmt == 'json':
+        json.dump(rows, out, indent=2)
+        out.write('\n')
+    else:
+        yaml.safe_dump({'tenants': rows}, out, sort_keys=False)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk tenant import and export')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    import_cmd = commands.add_parser('import', help='Create or update tenants from a manifest')
+    import_cmd.add_argument('manifest', help='YAML or CSV manifest')
+    import_cmd.add_argument('--namespace', default='default', help='Namespace for entries without one')
+    import_cmd.add_argument('--concurrency', type=int, default=16, help='Maximum requests in flight')
+    import_cmd.add_argument('--wait', action='store_true', help='Follow provisioning until every tenant is settled')
+    import_cmd.add_argument('--timeout', type=int, default=600, help='Seconds to wait with --wait')
+
+    export_cmd = commands.add_parser('export', help='Dump tenants with status and certificate expiry')
+    export_cmd.add_argument('--namespace', help='Namespace to export (default: all namespaces)')
+    export_cmd.add_argument('--format', choices=['yaml', 'csv', 'json'], default='yaml')
+
+    args = parser.parse_args(argv)
+    custom_objects_api = Config.initialize_kubernetes()['custom_objects_api']
+
+    if args.command == 'export':
+        write_rows(export_tenants(custom_objects_api, args.namespace), args.format)
+        return 0
+
+    tenants = load_manifest(args.manifest)
+    results = import_tenants(custom_objects_api, tenants, args.namespace, args.concurrency)
+    print(f"Applied {len(results['applied'])} tenants, {len(results['failed'])} failed "
+          f"in {results['elapsed']:.1f}s (batch {results['batch']})", flush=True)
+    if args.wait and results['applied']:
+        phases, pending = wait_for_phases(custom_objects_api, results['applied'], args.timeout)
+        provisioned = [key for key, phase in phases.items() if phase == SETTLED_PHASE]
+        failed = [key for key, phase in phases.items() if phase == 'Failed']
+        print(f"{len(provisioned)} provisioned, {len(failed)} failed, "
+              f"{len(pending)} still pending", flush=True)
+        if failed or pending:
+            return 1
+    return 1 if results['failed'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,8 @@
 from kubernetes import client, config
 import kubernetes
+import json
+import os
+import socket
 
 class Config:
     TENANT_GROUP = "mtls.invoisight.com"
@@ -7,6 +10,42 @@ class Config:
     CERT_MANAGER_GROUP = "cert-manager.io"
     CERT_MANAGER_VERSION = "v1"
     
+    # Operator settings, exposed through the chart's `operator` values
+    METRICS_PORT = int(os.getenv('METRICS_PORT', '8080'))
+    CHAIN_QUIET_WINDOW = float(os.getenv('CHAIN_QUIET_WINDOW', '1.0'))  # seconds without changes before a rebuild
+    CHAIN_MAX_DELAY = float(os.getenv('CHAIN_MAX_DELAY', '5.0'))  # upper bound on how long a rebuild is deferred
+    BATCH_MAX_HOLD = float(os.getenv('BATCH_MAX_HOLD', '600.0'))  # longest a bulk import may hold back chain writes
+    RETRY_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', '5.0'))  # first retry delay for a failed tenant
+    RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', '300.0'))  # cap on the exponential backoff
+    CHAIN_SHARDS = int(os.getenv('CHAIN_SHARDS', '0'))  # chain secrets per namespace by name hash; 0 disables sharding
+    RENEWAL_FRACTION = float(os.getenv('RENEWAL_FRACTION', '0.6'))  # share of a certificate's lifetime before renewal
+    
+    # Issuance: 'cert-manager' requests Certificates, 'operator' signs them in a process pool and writes the Secrets
+    ISSUANCE_MODE = os.getenv('ISSUANCE_MODE', 'cert-manager')
+    ISSUANCE_WORKERS = int(os.getenv('ISSUANCE_WORKERS', '0'))  # signing processes; 0 runs one per CPU
+    SPARE_KEYS = int(os.getenv('SPARE_KEYS', '16'))  # pre-generated keys kept per key type
+    # Proactive renewals per minute; 0 leaves renewal to cert-manager, so by default only the operator's own
+    # certificates are renewed by it
+    RENEWAL_RATE = float(os.getenv('RENEWAL_RATE') or (10 if ISSUANCE_MODE == 'operator' else 0))
+    
+    # Certificate profiles: named key algorithms, durations and renewBefore, added to the built-in ones
+    DEFAULT_PROFILE = os.getenv('DEFAULT_PROFILE', 'rsa')
+    CERTIFICATE_PROFILES = json.loads(os.getenv('CERTIFICATE_PROFILES') or '{}')
+    
+    # Replicas: 'standby' runs one active replica through kopf peering,
+    # 'sharded' makes every replica active on its share of the namespaces
+    SCALING_MODE = os.getenv('SCALING_MODE', 'standby')
+    PEERING_NAME = os.getenv('PEERING_NAME', 'mtls-cert-operator')
+    LEASE_DURATION = int(os.getenv('LEASE_DURATION', '30'))  # seconds before a silent replica is considered gone
+    POD_NAME = os.getenv('POD_NAME') or socket.gethostname()
+    POD_NAMESPACE = os.getenv('POD_NAMESPACE', 'default')
+    LIST_PAGE_SIZE = int(os.getenv('LIST_PAGE_SIZE', '500'))  # objects per page of the startup LISTs
+    
+    # Kubernetes API client: kept-alive connections shared by all API objects, and the client-side rate limit
+    API_POOL_SIZE = int(os.getenv('API_POOL_SIZE', '64'))  # connections, and threads making blocking API calls
+    API_QPS = float(os.getenv('API_QPS', '50'))  # sustained requests per second; 0 disables the limit
+    API_BURST = int(os.getenv('API_BURST', '100'))  # requests allowed at once above the sustained rate
+    
     @staticmethod
     def initialize_kubernetes():
         try:
@@ -14,7 +53,12 @@ class Config:
         except kubernetes.config.config_exception.ConfigException:
             config.load_kube_config()
         
+        # One pool for every API object; the default of 5 connections serialises concurrent handlers
+        configuration = client.Configuration.get_default_copy()
+        configuration.connection_pool_maxsize = Config.API_POOL_SIZE
+        api_client = client.ApiClient(configuration)
         return {
-            'core_v1_api': client.CoreV1Api(),
-            'custom_objects_api': client.CustomObjectsApi()
+            'core_v1_api': client.CoreV1Api(api_client),
+            'custom_objects_api': client.CustomObjectsApi(api_client),
+            'coordination_v1_api': client.CoordinationV1Api(api_client)
         }
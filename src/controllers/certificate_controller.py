@@ -0,0 +1,27 @@
+# controllers/certificate_controller.py
+import kopf
+from utils import metrics
+
+# Global service instances to be set by initialization
+provisioning_service = None
+membership = None
+
+def init_controller(provisioning_svc, membership_svc=None):
+    """Initialize the controller with the provisioning service."""
+    global provisioning_service, membership
+    provisioning_service = provisioning_svc
+    membership = membership_svc
+
+def _is_tenant_certificate(name, **_):
+    return name.endswith(('-intermediate-ca', '-client-cert'))
+
+@kopf.on.event('cert-manager.io', 'v1', 'certificates', when=_is_tenant_certificate)
+@metrics.handler
+async def track_certificate(event, meta, **kwargs):
+    """Retry failed tenants as soon as one of their Certificates changes."""
+    if provisioning_service is None or (membership is not None and not membership.owns(meta['namespace'])):
+        return
+    if event['type'] == 'DELETED':
+        provisioning_service.on_certificate_deleted(meta['namespace'], meta['name'])
+    else:
+        provisioning_service.on_certificate_changed(meta['namespace'], meta['name'])
@@ -0,0 +1,34 @@
+# controllers/revocation_controller.py
+import kopf
+from utils.logging import setup_logger
+from utils import metrics
+
+logger = setup_logger('revocation-controller')
+
+# Global service instances to be set by initialization
+revocation_service = None
+membership = None
+
+def init_controller(revocation_svc, membership_svc=None):
+    """Initialize the controller with required services."""
+    global revocation_service, membership
+    revocation_service = revocation_svc
+    membership = membership_svc
+
+def _owned(namespace, **_):
+    return membership is None or membership.owns(namespace)
+
+@kopf.on.create('mtls.invoisight.com', 'v1', 'revocationlists', when=_owned)
+@kopf.on.update('mtls.invoisight.com', 'v1', 'revocationlists', field='spec', when=_owned)
+@metrics.handler
+async def apply_revocation_list(spec, meta, body, patch, **kwargs):
+    """Revoke every tenant a RevocationList names or selects, publishing the CA chain once."""
+    kopf.info(body, reason='Revoking', message='Revoking the selected tenants')
+    status = await revocation_service.apply(meta['namespace'], spec)
+    patch.status.update(status)
+    if 'propagationSeconds' in status:
+        message = (f"Revoked {status['revoked']} tenants with {status['chainWrites']} CA chain writes, "
+                   f"seen on the secret watch after {status['propagationSeconds']}s")
+    else:
+        message = f"Revoked {status['revoked']} tenants with {status['chainWrites']} CA chain writes"
+    kopf.info(body, reason='Revoked', message=message)
@@ -0,0 +1,46 @@
+# controllers/secret_controller.py
+import kopf
+from utils.logging import setup_logger
+from utils.secret_cache import is_managed_secret
+from utils import metrics
+
+logger = setup_logger('secret-controller')
+
+# Global instances to be set by initialization
+secret_cache = None
+provisioning_service = None
+ca_chain_service = None
+membership = None
+
+def init_controller(cache, provisioning_svc, ca_chain_svc, membership_svc=None):
+    """Initialize the controller with the shared secret cache and the services it drives."""
+    global secret_cache, provisioning_service, ca_chain_service, membership
+    secret_cache = cache
+    provisioning_service = provisioning_svc
+    ca_chain_service = ca_chain_svc
+    membership = membership_svc
+
+def _owned(namespace):
+    return membership is None or membership.owns(namespace)
+
+def _is_managed(name, labels, **_):
+    return is_managed_secret(name, labels)
+
+@kopf.on.event('', 'v1', 'secrets', when=_is_managed)
+@metrics.handler
+async def track_secret(event, body, meta, **kwargs):
+    """Mirror operator-managed Secrets into the local cache and react to changes."""
+    if secret_cache is None:
+        return
+    # Every replica keeps its cache warm; only the namespace's replica reacts
+    secret_cache.apply_event(event['type'], body)
+    namespace = meta['namespace']
+    if not _owned(namespace):
+        return
+    if event['type'] == 'DELETED':
+        if ca_chain_service.is_chain_secret(meta['name']):
+            # One rebuild per chain secret, whatever the number of tenants
+            logger.info("%s deleted in namespace %s, recreating...", meta['name'], namespace)
+            ca_chain_service.mark_dirty(namespace, ca_chain_service.shard_of_secret(meta['name']))
+    elif 'tls.crt' in (body.get('data') or {}):
+        await provisioning_service.on_secret_ready(namespace, meta['name'])
@@ -1,8 +1,10 @@
 # controllers/tenant_controller.py
+import asyncio
 import kopf
 from kubernetes.client.rest import ApiException
 from utils.logging import setup_logger
-from utils.kubernetes import wait_for_secret
+from utils import metrics
+from services.provisioning_service import PHASE_IN_CHAIN, is_provisioned
 from config import Config
 
 logger = setup_logger('tenant-controller')
@@ -10,117 +12,106 @@ logger = setup_logger('tenant-controller')
 # Global service instances to be set by initialization
 core_v1_api = None
 custom_objects_api = None
-cert_service = None
 ca_chain_service = None
+provisioning_service = None
+tenant_index = None
+membership = None
 
-def init_controller(core_v1, custom_objects, cert_svc, ca_chain_svc):
+# Sharded replicas clean up after deleted tenants from the watch instead of a finalizer:
+# kopf removes the finalizer from objects a replica's handlers are filtered away from
+SHARDED = Config.SCALING_MODE == 'sharded'
+
+def init_controller(core_v1, custom_objects, ca_chain_svc, provisioning_svc, index, membership_svc=None):
     """Initialize the controller with required services."""
-    global core_v1_api, custom_objects_api, cert_service, ca_chain_service
+    global core_v1_api, custom_objects_api, ca_chain_service, provisioning_service, tenant_index, membership
     core_v1_api = core_v1
     custom_objects_api = custom_objects
-    cert_service = cert_svc
     ca_chain_service = ca_chain_svc
+    provisioning_service = provisioning_svc
+    tenant_index = index
+    membership = membership_svc
 
-@kopf.on.create('mtls.invoisight.com', 'v1', 'tenants')
-def create_tenant(spec, meta, patch, body, **kwargs):
-    """Handle tenant creation."""
-    try:
-        tenant_name = spec['name']
-        namespace = meta['namespace']
-        logger.info(f"Creating tenant {tenant_name}")
-        
-        # Post event for tenant creation start
-        kopf.info(body, reason='Creating',
-                  message=f'Creating tenant {tenant_name}')
-        
-        # Set initial state
-        patch.status['state'] = 'Creating'
-        initially_revoked = spec.get('revoked', False)
-        
-        # Create intermediate CA certificate
-        intermediate_ca_name = f"{tenant_name}-intermediate-ca"
-        cert_service.create_certificate(
-            name=intermediate_ca_name,
-            namespace=namespace,
-            isCA=True,
-            commonName=f"{tenant_name}-intermediate-ca",
-            secretName=f"{intermediate_ca_name}-secret",
-            privateKey={'algorithm': 'RSA', 'size': 4096},
-            issuerRef={
-                'name': 'root-ca-issuer',
-                'kind': 'ClusterIssuer',
-                'group': 'cert-manager.io'
-            },
-            usages=['digital signature', 'key encipherment', 'cert sign']
-        )
-        
-        wait_for_secret(core_v1_api, f"{intermediate_ca_name}-secret", namespace)
-        
-        # Create issuer
-        cert_service.create_issuer(
-            name=intermediate_ca_name,
-            namespace=namespace,
-            secret_name=f"{intermediate_ca_name}-secret"
-        )
-        
-        # Create client certificate
-        client_cert_name = f"{tenant_name}-client-cert"
-        cert_service.create_certificate(
-            name=client_cert_name,
-            namespace=namespace,
-            commonName=tenant_name,
-            secretName=f"{client_cert_name}-secret",
-            privateKey={'algorithm': 'RSA', 'size': 2048},
-            issuerRef={
-                'name': intermediate_ca_name,
-                'kind': 'Issuer',
-                'group': 'cert-manager.io'
-            },
-            usages=['digital signature', 'key encipherment', 'client auth']
-        )
-        
-        wait_for_secret(core_v1_api, f"{client_cert_name}-secret", namespace)
-        
-        # Update status
-        patch.status.update({
-            'intermediateCA': intermediate_ca_name,
-            'clientCert': client_cert_name,
-            'isRevoked': initially_revoked,
-            'state': 'Revoked' if initially_revoked else 'Active'
-        })
-        
-        # Ensure we wait for the intermediate CA secret before updating the chain
-        wait_for_secret(core_v1_api, f"{intermediate_ca_name}-secret", namespace)
-        
-        # Update CA chain
-        ca_chain_service.create_or_update_ca_chain(
-            namespace=namespace,
-            excluded_tenant=tenant_name if initially_revoked else None
-        )
-        
-        # Post event for successful creation
-        kopf.info(body, reason='Created',
-                  message=f'Successfully created tenant {tenant_name}')
-        
-    except Exception as e:
-        patch.status['state'] = 'Failed'
-        patch.status['message'] = str(e)
-        # Post event for failed creation
-        kopf.warn(body, reason='Failed',
-                  message=f'Failed to create tenant: {str(e)}')
-        raise kopf.PermanentError(str(e))
+def _owned(namespace, **_):
+    return membership is None or membership.owns(namespace)
 
-@kopf.on.delete('mtls.invoisight.com', 'v1', 'tenants')
-def delete_tenant(spec, meta, **kwargs):
-    """Handle tenant deletion."""
+@kopf.on.event('mtls.invoisight.com', 'v1', 'tenants')
+@metrics.handler
+async def track_tenant(event, body, **kwargs):
+    """Mirror Tenants into the local index."""
+    tenant_index.apply_event(event['type'], body)
+    if event['type'] == 'DELETED' and membership is not None:
+        tenant_name = (body.get('spec') or {}).get('name')
+        namespace = body['metadata']['namespace']
+        if tenant_name and membership.owns(namespace):
+            await _remove_tenant(tenant_name, namespace)
+
+@kopf.on.create('mtls.invoisight.com', 'v1', 'tenants', when=_owned)
+@metrics.handler
+async def create_tenant(spec, meta, body, **kwargs):
+    """Handle tenant creation by starting its provisioning."""
     tenant_name = spec['name']
     namespace = meta['namespace']
-    logger.info(f"Deleting tenant {tenant_name}")
+    logger.info("Creating tenant %s", tenant_name)
     
-    # Update CA chain
-    ca_chain_service.create_or_update_ca_chain(namespace=namespace, excluded_tenant=tenant_name)
+    # Post event for tenant creation start
+    kopf.info(body, reason='Creating',
+              message=f'Creating tenant {tenant_name}')
     
-    # Delete resources
+    # Later phases are advanced by the secret watch as cert-manager issues each certificate
+    await provisioning_service.advance(namespace, tenant_name, body=body)
+
+@kopf.on.resume('mtls.invoisight.com', 'v1', 'tenants', when=_owned)
+@metrics.handler
+async def resume_tenant(spec, meta, status, body, **kwargs):
+    """Resume provisioning from the last persisted phase after an operator restart."""
+    tenant_name = spec['name']
+    # Check the tenant's chain secret; the check is coalesced per shard and only writes a stale or missing chain
+    ca_chain_service.mark_dirty(meta['namespace'], ca_chain_service.shard_of(tenant_name, spec.get('group')))
+    if status.get('state') == 'Failed':
+        # Spread retries of failed tenants over the backoff window instead of all at once
+        provisioning_service.retry_later(meta['namespace'], tenant_name)
+        return None  # Return None to prevent success logging
+    if is_provisioned(status) and status.get('phase') is None:
+        # Provisioned before phases were recorded: record it, so renewals and spec changes are followed
+        await provisioning_service.backfill(meta['namespace'], tenant_name, body)
+        return None  # Return None to prevent success logging
+    if status.get('phase') in (None, PHASE_IN_CHAIN):
+        return None  # Return None to prevent success logging
+    
+    logger.info("Resuming tenant %s at phase %s", tenant_name, status.get('phase'))
+    await provisioning_service.advance(meta['namespace'], tenant_name, body=body)
+
+def _delete_resource(resource_type, name, namespace):
+    """Delete one dependent resource, ignoring it if it is already gone."""
+    try:
+        if resource_type == 'secrets':
+            core_v1_api.delete_namespaced_secret(name, namespace)
+        else:
+            # Background propagation lets the garbage collector remove anything the object owns
+            custom_objects_api.delete_namespaced_custom_object(
+                Config.CERT_MANAGER_GROUP, Config.CERT_MANAGER_VERSION,
+                namespace, resource_type, name,
+                propagation_policy='Background'
+            )
+    except ApiException as e:
+        if e.status != 404:  # Ignore if already deleted
+            logger.error("Failed to delete %s %s: %s", resource_type, name, e)
+
+@kopf.on.delete('mtls.invoisight.com', 'v1', 'tenants', when=_owned, optional=SHARDED)
+@metrics.handler
+async def delete_tenant(spec, meta, **kwargs):
+    """Handle tenant deletion."""
+    await _remove_tenant(spec['name'], meta['namespace'])
+
+async def _remove_tenant(tenant_name, namespace):
+    """Drop a deleted tenant from the CA chain and delete what it leaves behind."""
+    logger.info("Deleting tenant %s", tenant_name)
+    
+    # Update CA chain; the write itself is coalesced and happens after the finalizer is released
+    await asyncio.to_thread(ca_chain_service.remove_tenant, namespace=namespace, tenant_name=tenant_name)
+    
+    # Delete resources concurrently. Certificates and the Issuer are also owned by the
+    # Tenant, so the garbage collector removes them should a delete here fail.
     resources = [
         ('certificates', f"{tenant_name}-intermediate-ca"),
         ('certificates', f"{tenant_name}-client-cert"),
@@ -128,30 +119,23 @@ def delete_tenant(spec, meta, **kwargs):
         ('secrets', f"{tenant_name}-intermediate-ca-secret"),
         ('secrets', f"{tenant_name}-client-cert-secret")
     ]
-    
-    for resource_type, name in resources:
-        try:
-            if resource_type == 'secrets':
-                core_v1_api.delete_namespaced_secret(name, namespace)
-            else:
-                custom_objects_api.delete_namespaced_custom_object(
-                    Config.CERT_MANAGER_GROUP, Config.CERT_MANAGER_VERSION,
-                    namespace, resource_type, name
-                )
-        except ApiException as e:
-            if e.status != 404:  # Ignore if already deleted
-                logger.error(f"Failed to delete {resource_type} {name}: {e}")
+    await asyncio.gather(*(
+        asyncio.to_thread(_delete_resource, resource_type, name, namespace)
+        for resource_type, name in resources
+    ))
+    provisioning_service.forget_tenant(tenant_name, namespace)
 
-@kopf.on.field('mtls.invoisight.com', 'v1', 'tenants', field='spec.revoked')
-def handle_revocation_request(spec, status, old, new, patch, meta, body, **kwargs):
+@kopf.on.field('mtls.invoisight.com', 'v1', 'tenants', field='spec.revoked', when=_owned)
+@metrics.handler
+async def handle_revocation_request(spec, status, old, new, patch, meta, body, **kwargs):
     """Handle tenant revocation requests."""
     tenant_name = spec['name']
     namespace = meta['namespace']
     if new and not old:  # Revoking
-        logger.info(f"Revoking tenant {tenant_name}")
+        logger.info("Revoking tenant %s", tenant_name)
         kopf.info(body, reason='Revoking',
                   message=f'Revoking tenant {tenant_name}')
-        ca_chain_service.create_or_update_ca_chain(namespace=namespace, excluded_tenant=tenant_name)
+        await asyncio.to_thread(ca_chain_service.revoke_tenant, namespace=namespace, tenant_name=tenant_name)
         patch.status.update({
             'isRevoked': True,
             'state': 'Revoked'
@@ -160,10 +144,10 @@ def handle_revocation_request(spec, status, old, new, patch, meta, body, **kwarg
                   message=f'Successfully revoked tenant {tenant_name}')
     elif old and not new:  # Unrevoking
         if status.get('isRevoked', False):
-            logger.info(f"Unrevoking tenant {tenant_name}")
+            logger.info("Unrevoking tenant %s", tenant_name)
             kopf.info(body, reason='Unrevoking',
                       message=f'Unrevoking tenant {tenant_name}')
-            ca_chain_service.create_or_update_ca_chain(namespace=namespace, force_include=tenant_name)
+            await asyncio.to_thread(ca_chain_service.unrevoke_tenant, namespace=namespace, tenant_name=tenant_name)
             patch.status.update({
                 'isRevoked': False,
                 'state': 'Active'
@@ -171,114 +155,24 @@ def handle_revocation_request(spec, status, old, new, patch, meta, body, **kwarg
             kopf.info(body, reason='Unrevoked',
                       message=f'Successfully unrevoked tenant {tenant_name}')
 
-@kopf.on.timer('mtls.invoisight.com', 'v1', 'tenants', interval=60.0)
-def reconcile_tenant(spec, meta, status, patch, **kwargs):
-    """Reconcile failed tenants."""
-    if status.get('state') != 'Failed':
-        return None  # Return None to prevent success logging
-    
+@kopf.on.field('mtls.invoisight.com', 'v1', 'tenants', field='spec.group', when=_owned)
+@metrics.handler
+async def handle_group_change(spec, status, old, new, patch, meta, **kwargs):
+    """Move a provisioned tenant to the chain shard of its new group."""
+    if not is_provisioned(status) or old == new:
+        return  # Not in a chain yet; provisioning picks up the group
     tenant_name = spec['name']
-    logger.info(f"Reconciling failed tenant {tenant_name}")
-    
-    try:
-        # Check if resources already exist
-        namespace = meta['namespace']
-        intermediate_ca_name = f"{tenant_name}-intermediate-ca"
-        client_cert_name = f"{tenant_name}-client-cert"
-        
-        # Create or update intermediate CA certificate
-        cert_service.create_certificate(
-            name=intermediate_ca_name,
-            namespace=namespace,
-            isCA=True,
-            commonName=f"{tenant_name}-intermediate-ca",
-            secretName=f"{intermediate_ca_name}-secret",
-            privateKey={'algorithm': 'RSA', 'size': 4096},
-            issuerRef={
-                'name': 'root-ca-issuer',
-                'kind': 'ClusterIssuer',
-                'group': 'cert-manager.io'
-            },
-            usages=['digital signature', 'key encipherment', 'cert sign']
-        )
-        
-        wait_for_secret(core_v1_api, f"{intermediate_ca_name}-secret", namespace)
-        
-        # Create or update issuer
-        cert_service.create_issuer(
-            name=intermediate_ca_name,
-            namespace=namespace,
-            secret_name=f"{intermediate_ca_name}-secret"
-        )
-        
-        # Create or update client certificate
-        cert_service.create_certificate(
-            name=client_cert_name,
-            namespace=namespace,
-            commonName=tenant_name,
-            secretName=f"{client_cert_name}-secret",
-            privateKey={'algorithm': 'RSA', 'size': 2048},
-            issuerRef={
-                'name': intermediate_ca_name,
-                'kind': 'Issuer',
-                'group': 'cert-manager.io'
-            },
-            usages=['digital signature', 'key encipherment', 'client auth']
-        )
-        
-        wait_for_secret(core_v1_api, f"{client_cert_name}-secret", namespace)
-        
-        # Update status
-        patch.status.update({
-            'intermediateCA': intermediate_ca_name,
-            'clientCert': client_cert_name,
-            'isRevoked': spec.get('revoked', False),
-            'state': 'Active',
-            'message': 'Reconciliation successful'
-        })
-        
-    except Exception as e:
-        logger.error(f"Reconciliation failed for {tenant_name}: {e}")
-        patch.status['message'] = f"Reconciliation failed: {str(e)}"
+    logger.info("Moving tenant %s from group %s to %s", tenant_name, old, new)
+    await asyncio.to_thread(ca_chain_service.assign_shard, meta['namespace'], tenant_name, new)
+    patch.status.update(provisioning_service.chain_status(tenant_name, new))
 
-@kopf.on.timer('mtls.invoisight.com', 'v1', 'tenants', interval=30.0, initial_delay=10.0)
-def check_ca_chain_secret(spec, meta, status, **kwargs):
-    """Periodically check and recreate ca-chain-secret if missing."""
-    try:
-        namespace = meta['namespace']
-        
-        # Try to get the ca-chain-secret
-        try:
-            core_v1_api.read_namespaced_secret('ca-chain-secret', namespace)
-            return None  # Return None to prevent success logging
-        except ApiException as e:
-            if e.status != 404:  # If error is not "Not Found", ignore it
-                return None  # Return None to prevent success logging
-            
-            logger.info(f"ca-chain-secret not found in namespace {namespace}, recreating...")
-            
-            # Get all active tenants in the namespace
-            tenants = custom_objects_api.list_namespaced_custom_object(
-                'mtls.invoisight.com', 'v1', namespace, 'tenants'
-            )
-            
-            # Find any revoked tenants
-            revoked_tenants = [
-                t['spec']['name'] for t in tenants['items']
-                if t.get('status', {}).get('isRevoked', False)
-            ]
-            
-            # Recreate the chain excluding revoked tenants
-            if revoked_tenants:
-                logger.info(f"Excluding revoked tenants from chain: {revoked_tenants}")
-                for tenant in revoked_tenants:
-                    ca_chain_service.create_or_update_ca_chain(
-                        namespace=namespace,
-                        excluded_tenant=tenant
-                    )
-            else:
-                # If no revoked tenants, just create the chain normally
-                ca_chain_service.create_or_update_ca_chain(namespace=namespace)
-                
-    except Exception as e:
-        logger.error(f"Failed to check/recreate ca-chain-secret: {e}")
\ No newline at end of file
+@kopf.on.field('mtls.invoisight.com', 'v1', 'tenants', field='spec.profile', when=_owned)
+@kopf.on.field('mtls.invoisight.com', 'v1', 'tenants', field='spec.privateKey', when=_owned)
+@metrics.handler
+async def handle_profile_change(spec, status, old, new, meta, body, **kwargs):
+    """Re-issue a provisioned tenant's certificates when its certificate profile or key changes."""
+    if not is_provisioned(status) or old == new:
+        return  # Not issued yet; provisioning picks up the profile
+    kopf.info(body, reason='Migrating',
+              message=f"Re-issuing certificates of tenant {spec['name']} with the new profile")
+    await provisioning_service.migrate(meta['namespace'], spec['name'], body)
@@ -1,21 +1,81 @@
 # main.py
 import kopf
+import asyncio
 import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
 from config import Config
-from controllers import tenant_controller
+from controllers import tenant_controller, secret_controller, certificate_controller, revocation_controller
 from services.certificate_service import CertificateService
 from services.ca_chain_service import CAChainService
+from services.provisioning_service import ProvisioningService
+from services.renewal_service import RenewalService
+from services.membership_service import MembershipService
+from services.standby_service import StandbyService
+from services.warm_start_service import WarmStartService
+from services.issuance_service import IssuanceService
+from services.revocation_service import RevocationService
+from utils.secret_cache import SecretCache
+from utils.tenant_index import TenantIndex
+from utils.profiles import CertificateProfiles
 from utils.log_config import configure_logging
+from utils.rate_limiter import RateLimitedApi, TokenBucket
+from utils import metrics
+from utils.metrics import InstrumentedApi, QUEUE_DEPTH, start_metrics_server
 
 # Configure logging
 configure_logging()
 logger = logging.getLogger('tenant-operator')
 
+# Set at startup in the sharded scaling mode
+membership = None
+# Set at startup in the standby scaling mode
+standby = None
+# Set at startup when the operator issues certificates itself
+issuance_service = None
+
+# Restart-to-ready time is measured from here
+STARTED_AT = time.monotonic()
+
 @kopf.on.startup()
-def configure(settings: kopf.OperatorSettings, **_):
+async def configure(settings: kopf.OperatorSettings, **_):
     """Configure the operator."""
-    # Initialize Kubernetes clients
-    clients = Config.initialize_kubernetes()
+    global membership, standby, issuance_service
+    # Blocking API calls run in threads: size the executor to the connection pool so neither starves the other
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=Config.API_POOL_SIZE, thread_name_prefix='kube-api'))
+    settings.execution.max_workers = Config.API_POOL_SIZE
+    
+    # Initialize Kubernetes clients, counting and timing every call and sharing one rate limit
+    clients = {name: InstrumentedApi(api) for name, api in Config.initialize_kubernetes().items()}
+    if Config.API_QPS > 0:
+        limiter = TokenBucket(Config.API_QPS, Config.API_BURST)
+        clients = {name: RateLimitedApi(api, limiter) for name, api in clients.items()}
+    
+    # Initialize the local stores, fed by the secret and tenant watches
+    secret_cache = SecretCache(clients['core_v1_api'])
+    tenant_index = TenantIndex()
+    
+    # Split the namespaces between the active replicas, or leave them all to the one kopf peering keeps running
+    if Config.SCALING_MODE == 'sharded':
+        membership = MembershipService(
+            clients['coordination_v1_api'],
+            Config.POD_NAME,
+            Config.POD_NAMESPACE,
+            lease_duration=Config.LEASE_DURATION,
+            namespaces=tenant_index.namespaces
+        )
+        settings.peering.standalone = True
+    else:
+        settings.peering.name = Config.PEERING_NAME
+        settings.peering.clusterwide = True
+        settings.peering.lifetime = Config.LEASE_DURATION
+        # Replicas need distinct priorities: the highest runs, the others stand by
+        settings.peering.priority = random.randint(0, 32767)
+        standby = StandbyService(clients['custom_objects_api'], Config.PEERING_NAME, settings.peering.priority,
+                                 interval=Config.LEASE_DURATION / 3)
+    owns = membership and membership.owns
     
     # Initialize services
     cert_service = CertificateService(
@@ -24,16 +84,95 @@ def configure(settings: kopf.OperatorSettings, **_):
     )
     ca_chain_service = CAChainService(
         clients['core_v1_api'],
-        clients['custom_objects_api']
+        clients['custom_objects_api'],
+        secret_cache,
+        quiet_window=Config.CHAIN_QUIET_WINDOW,
+        max_delay=Config.CHAIN_MAX_DELAY,
+        hold=tenant_index.batch_in_progress,
+        max_hold=Config.BATCH_MAX_HOLD,
+        shards=Config.CHAIN_SHARDS,
+        owns=owns,
+        tenants=tenant_index.list
+    )
+    ca_chain_service.writer.start()
+    renewal_service = RenewalService(
+        clients['custom_objects_api'],
+        rate=Config.RENEWAL_RATE,
+        fraction=Config.RENEWAL_FRACTION,
+        owns=owns
     )
+    renewal_service.start()
+    if Config.ISSUANCE_MODE == 'operator':
+        issuance_service = IssuanceService(
+            clients['core_v1_api'],
+            secret_cache,
+            workers=Config.ISSUANCE_WORKERS,
+            spare_keys=Config.SPARE_KEYS
+        )
+        issuance_service.start()
+    provisioning_service = ProvisioningService(
+        clients['custom_objects_api'],
+        cert_service,
+        ca_chain_service,
+        secret_cache,
+        tenant_index,
+        renewal_service,
+        retry_base_delay=Config.RETRY_BASE_DELAY,
+        retry_max_delay=Config.RETRY_MAX_DELAY,
+        issuance_service=issuance_service,
+        profiles=CertificateProfiles(Config.CERTIFICATE_PROFILES, default=Config.DEFAULT_PROFILE)
+    )
+    provisioning_service.start()
+    if issuance_service is not None:
+        # There are no Certificates for cert-manager to renew: the operator signs renewals too
+        renewal_service.reissue = provisioning_service.reissue
     
-    # Initialize controller with services
+    # Initialize controllers with services
     tenant_controller.init_controller(
         clients['core_v1_api'],
         clients['custom_objects_api'],
-        cert_service,
-        ca_chain_service
+        ca_chain_service,
+        provisioning_service,
+        tenant_index,
+        membership
     )
+    secret_controller.init_controller(secret_cache, provisioning_service, ca_chain_service, membership)
+    certificate_controller.init_controller(provisioning_service, membership)
+    revocation_controller.init_controller(
+        RevocationService(clients['custom_objects_api'], ca_chain_service, secret_cache, tenant_index),
+        membership
+    )
+    
+    # Warm the local stores before kopf starts the watches and resume handlers, which then
+    # find everything locally; chain secrets are checked as each tenant resumes
+    warm_start = WarmStartService(clients['core_v1_api'], clients['custom_objects_api'],
+                                  page_size=Config.LIST_PAGE_SIZE)
+    await asyncio.to_thread(warm_start.load, tenant_index, secret_cache, cert_service)
+    if membership is not None:
+        membership.subscribe(provisioning_service.rebalance)
+        await membership.join()
+    if standby is not None:
+        async def resync():
+            # Deletions missed while standing by would otherwise linger in the stores and chain models
+            await asyncio.to_thread(warm_start.load, tenant_index, secret_cache, cert_service, True)
+            ca_chain_service.forget_all()
+        standby.subscribe(resync)
+        standby.start()
+    
+    # Expose operator metrics
+    QUEUE_DEPTH.labels('retry').set_function(lambda: len(provisioning_service.retry_queue))
+    QUEUE_DEPTH.labels('chain_writer').set_function(lambda: ca_chain_service.writer.pending())
+    QUEUE_DEPTH.labels('renewal').set_function(lambda: len(renewal_service.queue))
+    metrics.CERTIFICATE_NEXT_EXPIRY.set_function(renewal_service.next_expiry)
+    for window, seconds in (('7d', 7 * 86400), ('30d', 30 * 86400)):
+        metrics.CERTIFICATES_EXPIRING.labels(window).set_function(
+            lambda seconds=seconds: renewal_service.expiring_within(seconds))
+    if membership is not None:
+        metrics.OPERATOR_MEMBERS.set_function(lambda: len(membership.ring.members))
+        metrics.OWNED_NAMESPACES.set_function(lambda: sum(map(membership.owns, tenant_index.namespaces())))
+    start_metrics_server(Config.METRICS_PORT)
+    metrics.STARTUP_SECONDS.set(time.monotonic() - STARTED_AT)
+    logger.info("Operator ready %.2fs after start", time.monotonic() - STARTED_AT)
     
     # Configure operator settings
     settings.watching.server_timeout = 60
@@ -54,5 +193,15 @@ def configure(settings: kopf.OperatorSettings, **_):
     logging.getLogger('kopf.activities.service').setLevel(logging.WARNING)  # Suppress service logs
     logging.getLogger('kopf.activities.authenticator').setLevel(logging.WARNING)  # Suppress auth logs
 
+@kopf.on.cleanup()
+async def leave(**_):
+    """Hand this replica's namespaces over to the others on shutdown."""
+    if membership is not None:
+        await membership.leave()
+    if standby is not None:
+        standby.stop()
+    if issuance_service is not None:
+        issuance_service.stop()
+
 if __name__ == "__main__":
     kopf.run()
\ No newline at end of file
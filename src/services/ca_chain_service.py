@@ -1,89 +1,381 @@
 from kubernetes.client import V1Secret, V1ObjectMeta
 from kubernetes.client.rest import ApiException
 import base64
+import threading
+import zlib
+import time
 import kopf
 from utils.logging import setup_logger
+from utils.secret_cache import MANAGED_LABEL, MANAGED_SECRET_SUFFIXES
+from utils.pem_index import CertificateIndex
+from utils import metrics
+from services.chain_writer import ChainWriter
 
 logger = setup_logger('ca-chain-service')
 
+CHAIN_SECRET = 'ca-chain-secret'
+
+class NamespaceChain:
+    """In-memory model of one namespace's CA chain, keyed by tenant."""
+
+    def __init__(self, root_ca, index=None):
+        # Kept across rebuilds so unchanged certificates are not parsed again
+        self.index = index if index is not None else CertificateIndex()
+        self.root_ca = self.index.add(root_ca)
+        self.intermediates = {}  # tenant name -> fingerprints of its tls.crt, own certificate first
+        self.previous = {}  # tenant name -> fingerprints of a renewed intermediate, until its clients are re-issued
+        self.revoked = set()
+        self.shards = {}  # tenant name -> chain shard, when sharding is enabled
+
+    def set_intermediate(self, tenant_name, pem):
+        """Add or replace a tenant's intermediate CA, with any issuing chain its secret carries."""
+        fingerprints = self.index.add(pem)
+        if fingerprints:
+            self.intermediates[tenant_name] = fingerprints
+        else:
+            logger.warning("No valid certificate in the intermediate CA of tenant %s", tenant_name)
+            self.intermediates.pop(tenant_name, None)
+
+    def refresh_intermediate(self, tenant_name, pem):
+        """Replace a renewed intermediate CA, keeping the one it replaces; return True if it changed."""
+        current = self.intermediates.get(tenant_name)
+        fingerprints = self.index.add(pem)
+        if current is None or not fingerprints or fingerprints == current:
+            return False
+        # Client certificates signed by the first replaced intermediate must keep verifying
+        self.previous.setdefault(tenant_name, current)
+        self.intermediates[tenant_name] = fingerprints
+        return True
+
+    def remove(self, tenant_name):
+        self.intermediates.pop(tenant_name, None)
+        self.previous.pop(tenant_name, None)
+        self.revoked.discard(tenant_name)
+        return self.shards.pop(tenant_name, None)
+
+    def counts(self, shard=None):
+        """Return how many of a shard's tenants are in the chain, revoked, and renewal-pending."""
+        tenants = [t for t in self.intermediates if self.shards.get(t) == shard]
+        return {
+            'tenants': len(tenants),
+            'revoked': sum(1 for t in tenants if t in self.revoked),
+            'previous': sum(1 for t in tenants if t in self.previous),
+        }
+
+    def bundle(self, shard=None):
+        """Return the canonical PEM bundle: root CA, then every non-revoked tenant's chain by tenant name.
+
+        Each certificate appears once, and expired ones are dropped. With
+        sharding, only the tenants of the given shard are included.
+        """
+        groups = [self.root_ca]
+        revoked = set()
+        for tenant_name in sorted(self.intermediates):
+            if self.shards.get(tenant_name) != shard:
+                continue
+            previous = self.previous.get(tenant_name, ())
+            if tenant_name in self.revoked:
+                revoked.add(self.intermediates[tenant_name][0])
+                revoked.update(previous[:1])
+            else:
+                groups.append(self.intermediates[tenant_name])
+                groups.append(previous)
+        bundle = self.index.bundle(groups, exclude=revoked)
+        live = set(self.root_ca).union(*self.intermediates.values(), *self.previous.values())
+        if len(self.index) > 2 * len(live):
+            self.index.retain(live)  # Forget certificates of replaced and removed tenants
+        return bundle
+
 class CAChainService:
-    def __init__(self, core_v1_api, custom_objects_api):
+    def __init__(self, core_v1_api, custom_objects_api, secret_cache, quiet_window=0.0, max_delay=0.0,
+                 hold=None, max_hold=600.0, shards=0, owns=None, tenants=None):
         self.core_v1_api = core_v1_api
         self.custom_objects_api = custom_objects_api
+        self.secret_cache = secret_cache
+        self.shards = shards  # 0 publishes one ca-chain-secret per namespace
+        self.hold = hold
+        self.owns = owns  # namespace -> whether this replica publishes its chains
+        self.tenants = tenants  # namespace -> Tenant bodies from a warm local index, instead of a LIST
+        # Publications are keyed by (namespace, shard)
+        self.writer = ChainWriter(self._publish_key, quiet_window, max_delay,
+                                  hold=hold and self._held, max_hold=max_hold)
+        self._chains = {}  # namespace -> NamespaceChain
+        self._lock = threading.RLock()  # Guards the chain models, never held across an API call
+        self._write_locks = {}  # (namespace, shard) -> lock keeping one chain secret's writes in order
+
+    def shard_of(self, tenant_name, group=None):
+        """Return the chain shard of a tenant: its group if set, else a stable hash of its name."""
+        if not self.shards:
+            return None
+        if group:
+            return group
+        return str(zlib.crc32(tenant_name.encode('utf-8')) % self.shards)
+
+    @staticmethod
+    def secret_name(shard=None):
+        """Return the name of the secret holding a chain shard."""
+        return CHAIN_SECRET if shard is None else f"{CHAIN_SECRET}-{shard}"
 
-    def create_or_update_ca_chain(self, namespace, excluded_tenant=None, force_include=None):
-        """Update the CA chain secret."""
+    @staticmethod
+    def is_chain_secret(secret_name):
+        """Check whether a secret holds a CA chain or chain shard."""
+        return secret_name == CHAIN_SECRET or (secret_name.startswith(f"{CHAIN_SECRET}-")
+                                               and not secret_name.endswith(MANAGED_SECRET_SUFFIXES))
+
+    @staticmethod
+    def shard_of_secret(secret_name):
+        """Return the shard a chain secret holds, the inverse of secret_name()."""
+        return None if secret_name == CHAIN_SECRET else secret_name[len(CHAIN_SECRET) + 1:]
+
+    def mark_dirty(self, namespace, shard=None, urgent=False):
+        """Schedule a publication of one chain shard."""
+        self.writer.mark_dirty((namespace, shard), urgent=urgent)
+
+    def _held(self, key):
+        return self.hold(key[0])
+
+    def _publish_key(self, key):
+        return self.publish(*key)
+
+    def _read_intermediate(self, tenant_name, namespace):
+        """Read a tenant's intermediate CA certificate, or None if it isn't issued yet."""
+        secret_name = f"{tenant_name}-intermediate-ca-secret"
+        data = self.secret_cache.get(secret_name, namespace)
+        if data is None:
+            logger.warning("Secret %s not found", secret_name)
+        elif 'tls.crt' in data:
+            return base64.b64decode(data['tls.crt'])
+        else:
+            logger.warning("Secret %s exists but has no valid certificate", secret_name)
+        return None
+
+    def _load_chain(self, namespace, index=None):
+        """Build the chain model for a namespace from the tenant list and the secret cache."""
         try:
-            logger.info(f"Updating CA chain (excluded: {excluded_tenant}, force include: {force_include})")
-            
-            # Get root CA
-            try:
-                root_ca_secret = self.core_v1_api.read_namespaced_secret('root-ca-secret', namespace)
-                if not root_ca_secret.data or 'tls.crt' not in root_ca_secret.data:
-                    raise kopf.PermanentError(f"Root CA secret is missing or invalid in namespace {namespace}")
-                root_ca = base64.b64decode(root_ca_secret.data['tls.crt'])
-                logger.info("Successfully read root CA certificate")
-            except ApiException as e:
-                logger.error(f"Failed to read root CA secret: {e}")
-                raise kopf.PermanentError(f"Failed to read root CA secret: {e}")
-            
-            # Start chain with root CA
-            chain = [root_ca]
-            
-            # List all tenants
+            root_ca_data = self.secret_cache.read('root-ca-secret', namespace)
+            if not root_ca_data or 'tls.crt' not in root_ca_data:
+                raise kopf.PermanentError(f"Root CA secret is missing or invalid in namespace {namespace}")
+            root_ca = base64.b64decode(root_ca_data['tls.crt'])
+        except ApiException as e:
+            logger.error("Failed to read root CA secret: %s", e)
+            raise kopf.PermanentError(f"Failed to read root CA secret: {e}")
+
+        if self.tenants is not None:
+            tenants = {'items': self.tenants(namespace)}
+        else:
             try:
                 tenants = self.custom_objects_api.list_namespaced_custom_object(
                     'mtls.invoisight.com', 'v1', namespace, 'tenants'
                 )
-                logger.info(f"Found {len(tenants['items'])} tenants")
             except ApiException as e:
-                logger.error(f"Failed to list tenants: {e}")
+                logger.error("Failed to list tenants: %s", e)
                 raise kopf.PermanentError(f"Failed to list tenants: {e}")
-            
-            # Add intermediate CAs
-            for tenant in tenants['items']:
-                tenant_name = tenant['spec']['name']
-                tenant_status = tenant.get('status', {})
-                
-                if excluded_tenant and tenant_name == excluded_tenant:
-                    logger.info(f"Excluding tenant {tenant_name} from CA chain")
-                    continue
-                if tenant_status.get('isRevoked', False) and tenant_name != force_include:
-                    logger.info(f"Skipping revoked tenant {tenant_name}")
-                    continue
-                    
-                secret_name = f"{tenant_name}-intermediate-ca-secret"
-                try:
-                    secret = self.core_v1_api.read_namespaced_secret(secret_name, namespace)
-                    if secret.data and 'tls.crt' in secret.data:
-                        chain.append(base64.b64decode(secret.data['tls.crt']))
-                        logger.info(f"Added {tenant_name} intermediate CA to chain")
-                    else:
-                        logger.warning(f"Secret {secret_name} exists but has no valid certificate")
-                except ApiException as e:
-                    if e.status != 404:
-                        logger.error(f"Failed to get CA for {tenant_name}: {e}")
-                    else:
-                        logger.warning(f"Secret {secret_name} not found")
-
-            # Update chain secret
-            combined_chain = b'\n'.join(filter(None, chain))
+
+        chain = NamespaceChain(root_ca, index)
+        if not chain.root_ca:
+            raise kopf.PermanentError(f"Root CA secret holds no valid certificate in namespace {namespace}")
+        for tenant in tenants['items']:
+            tenant_name = tenant['spec']['name']
+            if self.shards:
+                chain.shards[tenant_name] = self.shard_of(tenant_name, tenant['spec'].get('group'))
+            if tenant.get('status', {}).get('isRevoked', False):
+                # Revoked intermediates are only fetched if the tenant is unrevoked
+                chain.revoked.add(tenant_name)
+                continue
+            pem = self._read_intermediate(tenant_name, namespace)
+            if pem:
+                chain.set_intermediate(tenant_name, pem)
+
+        logger.info("Loaded CA chain model for namespace %s (%s intermediates, %s revoked)",
+                    namespace, len(chain.intermediates), len(chain.revoked))
+        return chain
+
+    def _get_chain(self, namespace):
+        chain = self._chains.get(namespace)
+        if chain is None:
+            chain = self._load_chain(namespace)
+            self._chains[namespace] = chain
+            for shard in self._stale_shards(namespace, chain):
+                self.mark_dirty(namespace, shard, urgent=True)
+        return chain
+
+    @metrics.timed('ca_chain_service')
+    def add_tenant(self, namespace, tenant_name, intermediate_ca, revoked=False, group=None, urgent=False):
+        """Add or replace a tenant's intermediate CA and schedule a publication of its shard.
+
+        Tenants of a bulk import are added without `urgent`, so the import's
+        publications can be held back until it completes.
+        """
+        with self._lock:
+            chain = self._get_chain(namespace)
+            chain.set_intermediate(tenant_name, intermediate_ca)
+            if revoked:
+                chain.revoked.add(tenant_name)
+            else:
+                chain.revoked.discard(tenant_name)
+        self.assign_shard(namespace, tenant_name, group, urgent=urgent)
+
+    @metrics.timed('ca_chain_service')
+    def assign_shard(self, namespace, tenant_name, group=None, urgent=False):
+        """Move a tenant to the shard of its group, publishing the shards it left and joined; return the shard."""
+        shard = self.shard_of(tenant_name, group)
+        with self._lock:
+            chain = self._get_chain(namespace)
+            previous = chain.shards.get(tenant_name)
+            if shard is not None:
+                chain.shards[tenant_name] = shard
+        if previous is not None and previous != shard:
+            self.mark_dirty(namespace, previous, urgent=True)
+        self.mark_dirty(namespace, shard, urgent=urgent)
+        return shard
+
+    @metrics.timed('ca_chain_service')
+    def remove_tenant(self, namespace, tenant_name):
+        """Drop a tenant from the chain and schedule a publication."""
+        with self._lock:
+            shard = self._get_chain(namespace).remove(tenant_name)
+        self.mark_dirty(namespace, shard, urgent=True)
+
+    @metrics.timed('ca_chain_service')
+    def revoke_tenant(self, namespace, tenant_name):
+        """Exclude a tenant's intermediate CA from the chain and schedule a publication."""
+        with self._lock:
+            chain = self._get_chain(namespace)
+            chain.revoked.add(tenant_name)
+        self.mark_dirty(namespace, chain.shards.get(tenant_name), urgent=True)
+
+    @metrics.timed('ca_chain_service')
+    def revoke_tenants(self, namespace, tenant_names):
+        """Exclude several tenants' intermediate CAs from the chain without scheduling anything; return their shards.
+
+        The caller publishes the returned shards, so a bulk revocation costs one write per shard.
+        """
+        with self._lock:
+            chain = self._get_chain(namespace)
+            chain.revoked.update(tenant_names)
+            return {chain.shards.get(tenant_name) for tenant_name in tenant_names}
+
+    @metrics.timed('ca_chain_service')
+    def unrevoke_tenant(self, namespace, tenant_name):
+        """Re-include a tenant's intermediate CA in the chain and schedule a publication."""
+        with self._lock:
+            chain = self._get_chain(namespace)
+            chain.revoked.discard(tenant_name)
+            if tenant_name not in chain.intermediates:
+                pem = self._read_intermediate(tenant_name, namespace)
+                if pem:
+                    chain.set_intermediate(tenant_name, pem)
+        self.mark_dirty(namespace, chain.shards.get(tenant_name), urgent=True)
+
+    @metrics.timed('ca_chain_service')
+    def refresh_intermediate(self, namespace, tenant_name, intermediate_ca):
+        """Publish a renewed intermediate CA alongside the one it replaces, if the chain holds the tenant."""
+        with self._lock:
+            chain = self._chains.get(namespace)
+            if chain is None or not chain.refresh_intermediate(tenant_name, intermediate_ca):
+                return  # Not loaded yet: the first load reads the renewed secret
+            logger.info("Intermediate CA of tenant %s renewed, refreshing the CA chain", tenant_name)
+        self.mark_dirty(namespace, chain.shards.get(tenant_name), urgent=True)
+
+    @metrics.timed('ca_chain_service')
+    def retire_previous(self, namespace, tenant_name):
+        """Drop a tenant's replaced intermediate CA once its client certificate has been re-issued."""
+        with self._lock:
+            chain = self._chains.get(namespace)
+            if chain is None or chain.previous.pop(tenant_name, None) is None:
+                return
+        self.mark_dirty(namespace, chain.shards.get(tenant_name))
+
+    @metrics.timed('ca_chain_service')
+    def create_or_update_ca_chain(self, namespace):
+        """Rebuild the chain model for a namespace from scratch and schedule a publication of every shard."""
+        with self._lock:
+            previous = self._chains.pop(namespace, None)
+            chain = self._chains[namespace] = self._load_chain(namespace, previous and previous.index)
+            if previous is not None:
+                chain.previous = {t: fps for t, fps in previous.previous.items() if t in chain.intermediates}
+            shards = set(chain.shards.values()) if self.shards else {None}
+        for shard in shards:
+            self.mark_dirty(namespace, shard)
+        for shard in self._stale_shards(namespace, chain):
+            self.mark_dirty(namespace, shard, urgent=True)
+
+    def _stale_shards(self, namespace, chain):
+        """Return the shards of existing chain secrets that no longer hold any tenant.
+
+        They are left over from another shard count or from enabling or disabling
+        sharding. Publishing them leaves only the root CA, so an ingress still
+        referencing one stops trusting tenants revoked since.
+        """
+        current = set(chain.shards.values()) if self.shards else {None}
+        existing = {self.shard_of_secret(name) for name in self.secret_cache.names(namespace)
+                    if self.is_chain_secret(name)}
+        return existing - current
+
+    def forget_namespace(self, namespace):
+        """Drop the chain model of a namespace another replica has taken over."""
+        with self._lock:
+            self._chains.pop(namespace, None)
+            for key in [key for key in self._write_locks if key[0] == namespace]:
+                del self._write_locks[key]
+
+    def forget_all(self):
+        """Drop every chain model, to be rebuilt from the local stores on next use."""
+        with self._lock:
+            self._chains.clear()
+            self._write_locks.clear()
+
+    @metrics.timed('ca_chain_service')
+    def publish(self, namespace, shard=None):
+        """Write a chain shard's bundle to its secret unless it is already up to date; return the written bundle."""
+        if self.owns is not None and not self.owns(namespace):
+            return  # Handed over to another replica
+        secret_name = self.secret_name(shard)
+        with self._lock:
+            write_lock = self._write_locks.setdefault((namespace, shard), threading.Lock())
+        with write_lock:
+            with self._lock:
+                chain = self._get_chain(namespace)
+                current = self.secret_cache.get(secret_name, namespace)
+                if shard is not None and current is None and shard not in chain.shards.values():
+                    return  # Don't create secrets for shards without tenants
+                start = time.perf_counter()
+                pem = chain.bundle(shard)
+                rebuild = time.perf_counter() - start
+                counts = chain.counts(shard)
+            metrics.CHAIN_REBUILD_SECONDS.observe(rebuild)
+            metrics.CHAIN_BUNDLE_BYTES.observe(len(pem))
+            bundle = base64.b64encode(pem).decode('utf-8')
+            if current is not None and current.get('ca.crt') == bundle:
+                metrics.CHAIN_WRITES_SKIPPED.inc()
+                return
+            # Other namespaces and shards are not held up by the write
+            self._write_chain(namespace, bundle, secret_name)
+        # One line per publication, however many tenant changes it coalesced
+        logger.info("Published %s in namespace %s: %s tenants, %s revoked, %s pending renewal, %s bytes",
+                    secret_name, namespace, counts['tenants'], counts['revoked'], counts['previous'], len(pem),
+                    extra={'namespace': namespace, 'secret': secret_name, **counts, 'bytes': len(pem),
+                           'rebuild_ms': round(rebuild * 1000, 2)})
+        return bundle
+
+    def _write_chain(self, namespace, bundle, secret_name=CHAIN_SECRET):
+        """Write a chain bundle to its secret."""
+        try:
             secret = V1Secret(
-                metadata=V1ObjectMeta(name='ca-chain-secret'),
-                data={'ca.crt': base64.b64encode(combined_chain).decode('utf-8')}
+                metadata=V1ObjectMeta(name=secret_name, labels={MANAGED_LABEL: 'true'}),
+                data={'ca.crt': bundle}
             )
-            
+            metrics.CHAIN_WRITES.inc()
+
             try:
-                self.core_v1_api.replace_namespaced_secret('ca-chain-secret', namespace, secret)
-                logger.info("Successfully updated ca-chain-secret")
+                self.core_v1_api.replace_namespaced_secret(secret_name, namespace, secret)
             except ApiException as e:
                 if e.status == 404:
                     self.core_v1_api.create_namespaced_secret(namespace, secret)
-                    logger.info("Successfully created ca-chain-secret")
                 else:
-                    logger.error(f"Failed to update ca-chain-secret: {e}")
+                    logger.error("Failed to update %s: %s", secret_name, e)
                     raise
-                
+
         except Exception as e:
-            logger.error(f"Failed to update CA chain: {e}")
+            logger.error("Failed to update CA chain: %s", e)
             raise kopf.PermanentError(f"Failed to update CA chain: {str(e)}")
@@ -1,18 +1,71 @@
 from kubernetes.client import V1Secret, V1ObjectMeta
-from kubernetes.client.rest import ApiException
 import base64
+import hashlib
+import json
+import threading
 from config import Config
 from utils.logging import setup_logger
+from utils import metrics
 
 logger = setup_logger('certificate-service')
 
+# Field manager owning the fields the operator applies server-side
+FIELD_MANAGER = 'mtls-cert-operator'
+
 class CertificateService:
     def __init__(self, core_v1_api, custom_objects_api):
         self.core_v1_api = core_v1_api
         self.custom_objects_api = custom_objects_api
+        self._applied = {}  # (plural, namespace, name) -> hash of the last applied object
+        self._lock = threading.Lock()
+
+    def _apply(self, plural, obj):
+        """Server-side apply a cert-manager object, skipping it if it is unchanged since the last apply."""
+        name = obj['metadata']['name']
+        namespace = obj['metadata']['namespace']
+        key = (plural, namespace, name)
+        digest = _digest(obj)
+        with self._lock:
+            if self._applied.get(key) == digest:
+                return None
+        result = self.custom_objects_api.patch_namespaced_custom_object(
+            Config.CERT_MANAGER_GROUP, Config.CERT_MANAGER_VERSION,
+            namespace, plural, name, obj,
+            field_manager=FIELD_MANAGER,
+            force=True,
+            _content_type='application/apply-patch+yaml'
+        )
+        with self._lock:
+            self._applied[key] = digest
+        return result
+
+    def prime(self, plural, obj):
+        """Record an existing object as applied, so an identical apply after a restart is skipped."""
+        metadata = obj['metadata']
+        applied = {
+            'apiVersion': obj.get('apiVersion'),
+            'kind': obj.get('kind'),
+            'metadata': {'name': metadata['name'], 'namespace': metadata['namespace']},
+            'spec': obj.get('spec')
+        }
+        if metadata.get('ownerReferences'):
+            applied['metadata']['ownerReferences'] = metadata['ownerReferences']
+        with self._lock:
+            self._applied[(plural, metadata['namespace'], metadata['name'])] = _digest(applied)
 
-    def create_certificate(self, name, namespace, **kwargs):
-        """Create a cert-manager Certificate resource if it doesn't exist."""
+    def forget(self, plural, namespace, name):
+        """Drop the cached hash of an object so the next apply is sent even if unchanged."""
+        with self._lock:
+            self._applied.pop((plural, namespace, name), None)
+
+    def forget_all(self):
+        """Drop every cached hash, so each object is applied once more before it is skipped again."""
+        with self._lock:
+            self._applied.clear()
+
+    @metrics.timed('certificate_service')
+    def create_certificate(self, name, namespace, owner_references=None, **kwargs):
+        """Create or update a cert-manager Certificate resource."""
         cert = {
             'apiVersion': f'{Config.CERT_MANAGER_GROUP}/{Config.CERT_MANAGER_VERSION}',
             'kind': 'Certificate',
@@ -22,28 +75,13 @@ class CertificateService:
             },
             'spec': kwargs
         }
-        try:
-            # Try to get existing certificate
-            self.custom_objects_api.get_namespaced_custom_object(
-                Config.CERT_MANAGER_GROUP, Config.CERT_MANAGER_VERSION,
-                namespace, 'certificates', name
-            )
-            # If it exists, update it
-            return self.custom_objects_api.patch_namespaced_custom_object(
-                Config.CERT_MANAGER_GROUP, Config.CERT_MANAGER_VERSION,
-                namespace, 'certificates', name, cert
-            )
-        except ApiException as e:
-            if e.status == 404:
-                # If it doesn't exist, create it
-                return self.custom_objects_api.create_namespaced_custom_object(
-                    Config.CERT_MANAGER_GROUP, Config.CERT_MANAGER_VERSION,
-                    namespace, 'certificates', cert
-                )
-            raise
+        if owner_references:
+            cert['metadata']['ownerReferences'] = owner_references
+        return self._apply('certificates', cert)
 
-    def create_issuer(self, name, namespace, secret_name):
-        """Create a cert-manager Issuer resource if it doesn't exist."""
+    @metrics.timed('certificate_service')
+    def create_issuer(self, name, namespace, secret_name, owner_references=None):
+        """Create or update a cert-manager Issuer resource."""
         issuer = {
             'apiVersion': f'{Config.CERT_MANAGER_GROUP}/{Config.CERT_MANAGER_VERSION}',
             'kind': 'Issuer',
@@ -57,22 +95,9 @@ class CertificateService:
                 }
             }
         }
-        try:
-            # Try to get existing issuer
-            self.custom_objects_api.get_namespaced_custom_object(
-                Config.CERT_MANAGER_GROUP, Config.CERT_MANAGER_VERSION,
-                namespace, 'issuers', name
-            )
-            # If it exists, update it
-            return self.custom_objects_api.patch_namespaced_custom_object(
-                Config.CERT_MANAGER_GROUP, Config.CERT_MANAGER_VERSION,
-                namespace, 'issuers', name, issuer
-            )
-        except ApiException as e:
-            if e.status == 404:
-                # If it doesn't exist, create it
-                return self.custom_objects_api.create_namespaced_custom_object(
-                    Config.CERT_MANAGER_GROUP, Config.CERT_MANAGER_VERSION,
-                    namespace, 'issuers', issuer
-                )
-            raise
+        if owner_references:
+            issuer['metadata']['ownerReferences'] = owner_references
+        return self._apply('issuers', issuer)
+
+def _digest(obj):
+    return hashlib.sha256(json.dumps(obj, sort_keys=True).encode('utf-8')).hexdigest()
@@ -0,0 +1,83 @@
+import asyncio
+import time
+from utils.logging import setup_logger
+from utils import metrics
+
+logger = setup_logger('chain-writer')
+
+# Seconds between checks whether a held publication may go out
+HOLD_CHECK_INTERVAL = 0.5
+
+class ChainWriter:
+    """Coalesce CA chain publications per chain key behind a quiet window and a maximum delay."""
+
+    def __init__(self, publish, quiet_window, max_delay, hold=None, max_hold=600.0):
+        self.publish = publish  # callable(key), run on a worker thread
+        self.quiet_window = quiet_window
+        self.max_delay = max_delay
+        self.hold = hold  # callable(key) -> True while a bulk import is still provisioning
+        self.max_hold = max_hold
+        self._loop = None
+        self._pending = {}  # key -> [first marked, last marked, urgent]
+        self._tasks = {}  # key -> flush task
+
+    def start(self):
+        """Bind the writer to the running event loop; until then every mark publishes at once."""
+        self._loop = asyncio.get_running_loop()
+
+    def pending(self):
+        """Return the number of chains waiting for a publication."""
+        return len(self._pending)
+
+    def mark_dirty(self, key, urgent=False):
+        """Schedule a chain publication. Safe to call from any thread.
+
+        Urgent marks, such as revocations, are never held back by a bulk import.
+        """
+        if self._loop is None:
+            self.publish(key)
+            return
+        self._loop.call_soon_threadsafe(self._mark, key, urgent)
+
+    def _mark(self, key, urgent=False):
+        now = time.monotonic()
+        pending = self._pending.get(key)
+        if pending is None:
+            self._pending[key] = [now, now, urgent]
+        else:
+            pending[1] = now
+            pending[2] = pending[2] or urgent
+            metrics.CHAIN_REBUILDS_COALESCED.inc()
+        if key not in self._tasks:
+            self._tasks[key] = self._loop.create_task(self._flush_when_quiet(key))
+
+    async def _flush_when_quiet(self, key):
+        try:
+            while key in self._pending:
+                first, last, urgent = self._pending[key]
+                deadline = min(last + self.quiet_window, first + self.max_delay)
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+                if (not urgent and self.hold is not None and self.hold(key)
+                        and time.monotonic() - first < self.max_hold):
+                    # A bulk import is still provisioning; publish once when it completes
+                    await asyncio.sleep(HOLD_CHECK_INTERVAL)
+                    continue
+                # Marks arriving while we publish start a new window
+                del self._pending[key]
+                try:
+                    await asyncio.to_thread(self.publish, key)
+                except Exception as e:
+                    logger.error("Failed to publish CA chain %s, retrying: %s", key, e)
+                    await asyncio.sleep(self.max_delay)
+                    now = time.monotonic()
+                    self._pending.setdefault(key, [now, now, urgent])
+        finally:
+            del self._tasks[key]
+
+    async def flush(self, key):
+        """Publish a chain right away, absorbing any pending marks; return what the publication returns."""
+        self._pending.pop(key, None)
+        return await asyncio.to_thread(self.publish, key)
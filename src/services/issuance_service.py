@@ -0,0 +1,171 @@
+import asyncio
+import base64
+import collections
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from kubernetes.client import V1Secret, V1ObjectMeta
+from kubernetes.client.rest import ApiException
+from utils.logging import setup_logger
+from utils.secret_cache import MANAGED_LABEL
+from utils import metrics, signing
+
+logger = setup_logger('issuance-service')
+
+# cert-manager's default certificate lifetime
+DEFAULT_DURATION = 90 * 24 * 3600
+
+class IssuanceService:
+    """Issue tenant certificates in the operator instead of through cert-manager.
+
+    Keys are generated and certificates signed in a process pool, so signing
+    runs in parallel instead of behind the GIL. A few spare keys are kept per
+    key type and refilled in the background, so onboarding a tenant mostly
+    costs a signature. Secrets are written in the format cert-manager uses.
+    """
+
+    def __init__(self, core_v1_api, secret_cache, workers=None, spare_keys=16, duration=DEFAULT_DURATION):
+        self.core_v1_api = core_v1_api
+        self.secret_cache = secret_cache
+        self.workers = workers or os.cpu_count() or 1
+        self.spare_keys = spare_keys  # kept per key type; 0 generates every key on demand
+        self.duration = duration
+        self._pool = None
+        self._spares = {}  # (algorithm, size) -> deque of PEM keys
+        self._refill = None
+        self._issued = None  # set whenever an issuance finishes, to resume a refill waiting on it
+        self._issuing = 0  # issuances waiting on or running in the pool
+        self._task = None
+
+    def start(self):
+        """Start the worker processes and keep the spare keys topped up on the running event loop."""
+        # Spawn rather than fork: the operator process already runs threads
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+        self._refill = asyncio.Event()
+        self._issued = asyncio.Event()
+        if self.spare_keys > 0:
+            self._task = asyncio.get_running_loop().create_task(self._keep_spares())
+
+    def stop(self):
+        """Stop the refill and the worker processes."""
+        if self._task is not None:
+            self._task.cancel()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def want(self, key):
+        """Keep spare keys of the given (algorithm, size)."""
+        if key not in self._spares:
+            self._spares[key] = collections.deque()
+            if self._refill is not None:
+                self._refill.set()
+
+    async def _keep_spares(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._refill.wait()
+            self._refill.clear()
+            while True:
+                missing = [key for key, spares in self._spares.items() for _ in range(self.spare_keys - len(spares))]
+                if not missing:
+                    break
+                # Issuance comes first: keep a worker free for it and yield to the issuances in flight
+                free = max(1, self.workers - 1) - self._issuing
+                if free <= 0:
+                    self._issued.clear()
+                    await self._issued.wait()
+                    continue
+                batch = missing[:free]
+                try:
+                    pems = await asyncio.gather(*(loop.run_in_executor(self._pool, signing.generate_key, *key)
+                                                  for key in batch))
+                except Exception as e:
+                    logger.error("Failed to generate spare keys: %s", e)
+                    break
+                for key, pem in zip(batch, pems):
+                    self._spares[key].append(pem)
+                    metrics.SPARE_KEYS.labels(_key_type(key)).set(len(self._spares[key]))
+
+    async def issue(self, namespace, certificate_name, common_name, private_key, issuer_secret, is_ca=False,
+                    usages=(), owner_references=None, issuer_name=None, issuer_kind='Issuer', duration=None):
+        """Sign a certificate with the CA in `issuer_secret` and write it to `<certificate_name>-secret`."""
+        issuer = await asyncio.to_thread(self.secret_cache.read, issuer_secret, namespace)
+        if not issuer or 'tls.crt' not in issuer or 'tls.key' not in issuer:
+            raise ValueError(f"Issuing CA secret {issuer_secret} has no certificate and key")
+        issuer_cert = base64.b64decode(issuer['tls.crt'])
+        issuer_key = base64.b64decode(issuer['tls.key'])
+        key = (private_key['algorithm'], private_key.get('size'))
+        duration = duration or self.duration
+        self.want(key)
+
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        spares = self._spares[key]
+        self._issuing += 1
+        try:
+            if spares:
+                key_pem = spares.popleft()
+                metrics.SPARE_KEYS.labels(_key_type(key)).set(len(spares))
+                self._refill.set()
+                cert_pem = await loop.run_in_executor(
+                    self._pool, signing.issue,
+                    key_pem, common_name, is_ca, list(usages), issuer_cert, issuer_key, duration)
+            else:
+                key_pem, cert_pem = await loop.run_in_executor(
+                    self._pool, signing.generate_and_issue, *key,
+                    common_name, is_ca, list(usages), issuer_cert, issuer_key, duration)
+        finally:
+            self._issuing -= 1
+            self._issued.set()
+        metrics.ISSUE_SECONDS.labels(_key_type(key)).observe(time.perf_counter() - start)
+
+        # Like cert-manager's CA issuer: the certificate followed by its issuer's chain, and the top CA in ca.crt
+        ca = base64.b64decode(issuer['ca.crt']) if issuer.get('ca.crt') else issuer_cert
+        secret = V1Secret(
+            metadata=V1ObjectMeta(
+                name=f"{certificate_name}-secret",
+                namespace=namespace,
+                labels={MANAGED_LABEL: 'true', 'controller.cert-manager.io/fao': 'true'},
+                annotations={
+                    'cert-manager.io/certificate-name': certificate_name,
+                    'cert-manager.io/common-name': common_name,
+                    'cert-manager.io/issuer-name': issuer_name or issuer_secret,
+                    'cert-manager.io/issuer-kind': issuer_kind,
+                    'cert-manager.io/issuer-group': 'cert-manager.io',
+                    'cert-manager.io/alt-names': '',
+                    'cert-manager.io/ip-sans': '',
+                    'cert-manager.io/uri-sans': ''
+                },
+                owner_references=owner_references
+            ),
+            type='kubernetes.io/tls',
+            data={
+                'tls.crt': _b64(cert_pem + issuer_cert),
+                'tls.key': _b64(key_pem),
+                'ca.crt': _b64(ca)
+            }
+        )
+        await asyncio.to_thread(self._write, secret)
+        # Seen by the next provisioning step right away; the watch delivers the same data later
+        self.secret_cache.apply_event('MODIFIED', {
+            'metadata': {'name': secret.metadata.name, 'namespace': namespace, 'labels': secret.metadata.labels},
+            'data': secret.data
+        })
+        logger.info("Issued certificate %s in namespace %s", certificate_name, namespace)
+        return secret.data
+
+    def _write(self, secret):
+        """Create the Secret, or replace it when re-issuing."""
+        try:
+            self.core_v1_api.create_namespaced_secret(secret.metadata.namespace, secret)
+        except ApiException as e:
+            if e.status != 409:
+                raise
+            self.core_v1_api.replace_namespaced_secret(secret.metadata.name, secret.metadata.namespace, secret)
+
+def _key_type(key):
+    return f"{key[0]}-{key[1]}" if key[1] else key[0]
+
+def _b64(data):
+    return base64.b64encode(data).decode('ascii')
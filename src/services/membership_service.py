@@ -0,0 +1,116 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from kubernetes.client import V1Lease, V1LeaseSpec, V1ObjectMeta
+from kubernetes.client.rest import ApiException
+from utils.hash_ring import HashRing
+from utils.logging import setup_logger
+
+logger = setup_logger('membership-service')
+
+# Label selecting the member Leases of active operator replicas
+MEMBER_LABEL = 'mtls.invoisight.com/operator-member'
+
+class MembershipService:
+    """Split tenant namespaces between active operator replicas by consistent hashing.
+
+    Every replica renews a Lease of its own. The replicas whose Leases are
+    current form the hash ring, and each one handles the namespaces the ring
+    assigns to it. When a replica joins or leaves, only the namespaces it
+    gains or loses move.
+    """
+
+    def __init__(self, coordination_v1_api, identity, namespace, lease_duration=30, namespaces=None):
+        self.coordination_v1_api = coordination_v1_api
+        self.identity = identity
+        self.namespace = namespace  # where the member Leases live
+        self.lease_duration = lease_duration
+        self.namespaces = namespaces or set  # callable returning the namespaces to rebalance
+        self.ring = HashRing(())  # owns nothing until it has joined
+        self._listeners = []
+        self._renewed_at = None
+        self._task = None
+
+    def owns(self, namespace):
+        """Check whether this replica handles a namespace."""
+        return self.ring.owner(namespace) == self.identity
+
+    def subscribe(self, listener):
+        """Call `await listener(acquired, released)` with the namespaces that moved on every rebalance."""
+        self._listeners.append(listener)
+
+    async def join(self):
+        """Register this replica and take its share of the namespaces."""
+        await asyncio.to_thread(self._renew)
+        # Give the other replicas one renewal interval to see us before we take over namespaces
+        await asyncio.sleep(self.lease_duration / 3)
+        await self._rebalance(await asyncio.to_thread(self._live_members))
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def leave(self):
+        """Drop this replica's Lease so the others take over its namespaces right away."""
+        if self._task is not None:
+            self._task.cancel()
+        try:
+            await asyncio.to_thread(self.coordination_v1_api.delete_namespaced_lease, self.identity, self.namespace)
+        except ApiException as e:
+            if e.status != 404:
+                logger.error("Failed to delete member lease %s: %s", self.identity, e)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.lease_duration / 3)
+            try:
+                await asyncio.to_thread(self._renew)
+                await self._rebalance(await asyncio.to_thread(self._live_members))
+            except Exception as e:
+                # Connection errors too: the task must outlive them, or we'd keep our namespaces without a lease
+                logger.error("Failed to renew membership of %s: %s", self.identity, e)
+                if time.monotonic() - self._renewed_at > self.lease_duration:
+                    # The others consider us gone by now; stop handling anything until we are back
+                    await self._rebalance(())
+
+    def _renew(self):
+        now = datetime.now(timezone.utc)
+        try:
+            self.coordination_v1_api.patch_namespaced_lease(self.identity, self.namespace, {
+                'spec': {'renewTime': _micro_time(now), 'leaseDurationSeconds': int(self.lease_duration)}
+            })
+        except ApiException as e:
+            if e.status != 404:
+                raise
+            self.coordination_v1_api.create_namespaced_lease(self.namespace, V1Lease(
+                metadata=V1ObjectMeta(name=self.identity, labels={MEMBER_LABEL: 'true'}),
+                spec=V1LeaseSpec(holder_identity=self.identity, lease_duration_seconds=int(self.lease_duration),
+                                 acquire_time=now, renew_time=now)
+            ))
+        self._renewed_at = time.monotonic()
+
+    def _live_members(self):
+        """Return the identities of the replicas whose Leases have not expired."""
+        leases = self.coordination_v1_api.list_namespaced_lease(
+            self.namespace, label_selector=f"{MEMBER_LABEL}=true"
+        )
+        now = datetime.now(timezone.utc)
+        members = {self.identity}
+        for lease in leases.items:
+            spec = lease.spec
+            if spec.renew_time and (now - spec.renew_time).total_seconds() < (spec.lease_duration_seconds or 0):
+                members.add(lease.metadata.name)
+        return members
+
+    async def _rebalance(self, members):
+        members = frozenset(members)
+        if members == self.ring.members:
+            return
+        previous, self.ring = self.ring, HashRing(members)
+        namespaces = self.namespaces()
+        acquired = {ns for ns in namespaces if self.owns(ns) and previous.owner(ns) != self.identity}
+        released = {ns for ns in namespaces if not self.owns(ns) and previous.owner(ns) == self.identity}
+        logger.info("Operator replicas changed to %s: took over %s namespaces, handed over %s",
+                    sorted(members), len(acquired), len(released))
+        for listener in self._listeners:
+            await listener(acquired, released)
+
+def _micro_time(moment):
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
@@ -0,0 +1,519 @@
+import asyncio
+import base64
+from datetime import datetime, timezone
+import kopf
+from kubernetes.client.rest import ApiException
+from config import Config
+from utils.logging import setup_logger
+from utils.secret_cache import MANAGED_LABEL
+from utils.pem_index import validity
+from utils.profiles import CertificateProfiles
+from utils.retry_queue import RetryQueue
+from utils.tenant_index import BATCH_ANNOTATION
+from utils import metrics
+
+logger = setup_logger('provisioning-service')
+
+# Provisioning phases, persisted in status.phase, in the order they are completed
+PHASE_PENDING = 'Pending'
+PHASE_INTERMEDIATE_REQUESTED = 'IntermediateRequested'
+PHASE_INTERMEDIATE_READY = 'IntermediateReady'
+PHASE_ISSUER_READY = 'IssuerReady'
+PHASE_CLIENT_REQUESTED = 'ClientRequested'
+PHASE_CLIENT_READY = 'ClientReady'
+PHASE_IN_CHAIN = 'InChain'
+
+# States of tenants provisioned before status.phase was recorded; they are in their chain
+LEGACY_PROVISIONED_STATES = ('Active', 'Revoked')
+
+def is_provisioned(status):
+    """Check whether a tenant is in its chain, including tenants provisioned before status.phase existed."""
+    phase = status.get('phase')
+    return phase == PHASE_IN_CHAIN or (phase is None and status.get('state') in LEGACY_PROVISIONED_STATES)
+
+# Phases waiting on cert-manager, and the phase to step back to when retrying them
+RETRY_FROM = {
+    PHASE_INTERMEDIATE_REQUESTED: PHASE_PENDING,
+    PHASE_CLIENT_REQUESTED: PHASE_ISSUER_READY,
+}
+
+# Status fields with the expiry of the intermediate CA and client certificates
+EXPIRY_FIELDS = ('intermediateNotAfter', 'clientCertNotAfter')
+
+# Label cert-manager copies onto issued secrets so the secret watch can select them
+SECRET_TEMPLATE = {'labels': {MANAGED_LABEL: 'true'}}
+
+INTERMEDIATE_USAGES = ['digital signature', 'key encipherment', 'cert sign']
+CLIENT_USAGES = ['digital signature', 'key encipherment', 'client auth']
+
+class ProvisioningService:
+    """Drive tenants through the provisioning phases, one non-blocking step at a time."""
+
+    def __init__(self, custom_objects_api, cert_service, ca_chain_service, secret_cache, tenant_index,
+                 renewal_service=None, timeout=60, retry_base_delay=5.0, retry_max_delay=300.0,
+                 issuance_service=None, profiles=None):
+        self.custom_objects_api = custom_objects_api
+        self.profiles = profiles or CertificateProfiles()
+        self.cert_service = cert_service
+        self.issuance_service = issuance_service  # issues certificates in the operator instead of cert-manager
+        self.ca_chain_service = ca_chain_service
+        self.renewal_service = renewal_service
+        self.secret_cache = secret_cache
+        self.tenant_index = tenant_index
+        self.timeout = timeout
+        # Only failed tenants and tenants waiting on cert-manager are queued
+        self.retry_queue = RetryQueue(retry_base_delay, retry_max_delay)
+        self._locks = {}  # (namespace, tenant name) -> asyncio.Lock
+        self._retry_task = None
+
+    def start(self):
+        """Start processing the retry queue on the running event loop."""
+        self._retry_task = asyncio.get_running_loop().create_task(self.retry_queue.run(self._retry))
+
+    async def _retry(self, key):
+        namespace, tenant_name = key
+        if self.tenant_index.get(namespace, tenant_name) is None:
+            self.retry_queue.discard(key)  # Deleted meanwhile
+            return
+        await self.advance(namespace, tenant_name)
+
+    def retry_later(self, namespace, tenant_name):
+        """Queue a failed tenant for a retry after the next backoff step."""
+        self.retry_queue.backoff((namespace, tenant_name))
+
+    def _secret_ready(self, secret_name, namespace):
+        data = self.secret_cache.get(secret_name, namespace)
+        return data if data and 'tls.crt' in data else None
+
+    def _check_timeout(self, status, secret_name):
+        """Fail a phase that has been waiting on cert-manager for longer than the timeout."""
+        since = status.get('phaseTransitionTime')
+        if since and (_now() - datetime.fromisoformat(since)).total_seconds() > self.timeout:
+            raise kopf.PermanentError(f"Timeout waiting for secret {secret_name}")
+
+    def _request_intermediate(self, tenant_name, namespace, owner_references, profile):
+        intermediate_ca_name = f"{tenant_name}-intermediate-ca"
+        return self.cert_service.create_certificate(
+            name=intermediate_ca_name,
+            namespace=namespace,
+            owner_references=owner_references,
+            isCA=True,
+            commonName=intermediate_ca_name,
+            secretName=f"{intermediate_ca_name}-secret",
+            secretTemplate=SECRET_TEMPLATE,
+            issuerRef={
+                'name': 'root-ca-issuer',
+                'kind': 'ClusterIssuer',
+                'group': 'cert-manager.io'
+            },
+            usages=INTERMEDIATE_USAGES,
+            **profile
+        )
+
+    def _create_issuer(self, tenant_name, namespace, owner_references):
+        intermediate_ca_name = f"{tenant_name}-intermediate-ca"
+        self.cert_service.create_issuer(
+            name=intermediate_ca_name,
+            namespace=namespace,
+            secret_name=f"{intermediate_ca_name}-secret",
+            owner_references=owner_references
+        )
+
+    def _request_client(self, tenant_name, namespace, owner_references, profile):
+        client_cert_name = f"{tenant_name}-client-cert"
+        return self.cert_service.create_certificate(
+            name=client_cert_name,
+            namespace=namespace,
+            owner_references=owner_references,
+            commonName=tenant_name,
+            secretName=f"{client_cert_name}-secret",
+            secretTemplate=SECRET_TEMPLATE,
+            issuerRef={
+                'name': f"{tenant_name}-intermediate-ca",
+                'kind': 'Issuer',
+                'group': 'cert-manager.io'
+            },
+            usages=CLIENT_USAGES,
+            **profile
+        )
+
+    async def _issue_intermediate(self, spec, namespace, owner_references):
+        """Request a tenant's intermediate CA from cert-manager, or sign it in the operator.
+
+        Return False if cert-manager already has an identical request, which it won't issue again.
+        """
+        tenant_name = spec['name']
+        if self.issuance_service is None:
+            profile = self.profiles.certificate(spec, 'intermediate')
+            return await asyncio.to_thread(
+                self._request_intermediate, tenant_name, namespace, owner_references, profile) is not None
+        await self.issuance_service.issue(
+            namespace, f"{tenant_name}-intermediate-ca", f"{tenant_name}-intermediate-ca",
+            self.profiles.private_key(spec, 'intermediate'), 'root-ca-secret',
+            is_ca=True, usages=INTERMEDIATE_USAGES, owner_references=owner_references,
+            issuer_name='root-ca-issuer', issuer_kind='ClusterIssuer', duration=self.profiles.duration(spec)
+        )
+        return True
+
+    async def _issue_client(self, spec, namespace, owner_references):
+        """Request a tenant's client certificate from cert-manager, or sign it in the operator.
+
+        Return False if cert-manager already has an identical request, which it won't issue again.
+        """
+        tenant_name = spec['name']
+        if self.issuance_service is None:
+            profile = self.profiles.certificate(spec, 'client')
+            return await asyncio.to_thread(
+                self._request_client, tenant_name, namespace, owner_references, profile) is not None
+        await self.issuance_service.issue(
+            namespace, f"{tenant_name}-client-cert", tenant_name,
+            self.profiles.private_key(spec, 'client'), f"{tenant_name}-intermediate-ca-secret",
+            usages=CLIENT_USAGES, owner_references=owner_references,
+            issuer_name=f"{tenant_name}-intermediate-ca", duration=self.profiles.duration(spec)
+        )
+        return True
+
+    async def reissue(self, namespace, certificate_name):
+        """Re-issue a tenant certificate signed in the operator, where a renewal would ask cert-manager."""
+        tenant_name = _tenant_of(certificate_name, ('-intermediate-ca', '-client-cert'))
+        body = tenant_name and self.tenant_index.get(namespace, tenant_name)
+        if not body:
+            return
+        if certificate_name.endswith('-intermediate-ca'):
+            await self._issue_intermediate(body['spec'], namespace, _owner_references(body))
+        else:
+            await self._issue_client(body['spec'], namespace, _owner_references(body))
+
+    def chain_status(self, tenant_name, group=None):
+        """Return the status fields naming the chain secret a tenant is published in."""
+        shard = self.ca_chain_service.shard_of(tenant_name, group)
+        status = {'chainSecret': self.ca_chain_service.secret_name(shard)}
+        if shard is not None:
+            status['chainShard'] = shard
+        return status
+
+    def _track_expiry(self, namespace, certificate_name, data, spec):
+        """Track an issued certificate's expiry; return (validity, whether it was renewed) or None."""
+        pem = base64.b64decode(data['tls.crt'])
+        period = validity(pem)
+        if period is None or self.renewal_service is None:
+            return period, False
+        return period, self.renewal_service.track(namespace, certificate_name, period,
+                                                  renew_before=self.profiles.renew_before(spec))
+
+    def expiry_status(self, tenant_name, namespace, spec):
+        """Return the status fields with the expiry of a tenant's issued certificates."""
+        status = {}
+        for field, certificate_name in ((EXPIRY_FIELDS[0], f"{tenant_name}-intermediate-ca"),
+                                        (EXPIRY_FIELDS[1], f"{tenant_name}-client-cert")):
+            data = self._secret_ready(f"{certificate_name}-secret", namespace)
+            period = data and self._track_expiry(namespace, certificate_name, data, spec)[0]
+            if period:
+                status[field] = _timestamp(period[1])
+        return status
+
+    def forget_tenant(self, tenant_name, namespace):
+        """Drop everything kept about a deleted tenant."""
+        self.forget_applied(tenant_name, namespace)
+        self.retry_queue.discard((namespace, tenant_name))
+        self._locks.pop((namespace, tenant_name), None)
+        if self.renewal_service is not None:
+            self.renewal_service.forget(namespace, f"{tenant_name}-intermediate-ca")
+            self.renewal_service.forget(namespace, f"{tenant_name}-client-cert")
+
+    def forget_applied(self, tenant_name, namespace):
+        """Make the next provisioning of a tenant re-apply its cert-manager objects."""
+        self.cert_service.forget('certificates', namespace, f"{tenant_name}-intermediate-ca")
+        self.cert_service.forget('issuers', namespace, f"{tenant_name}-intermediate-ca")
+        self.cert_service.forget('certificates', namespace, f"{tenant_name}-client-cert")
+
+    async def _step(self, phase, status, body):
+        """Run the step that completes the given phase; return the next phase or None to wait."""
+        spec = body['spec']
+        namespace = body['metadata']['namespace']
+        tenant_name = spec['name']
+        owner_references = _owner_references(body)
+        intermediate_secret = f"{tenant_name}-intermediate-ca-secret"
+        client_secret = f"{tenant_name}-client-cert-secret"
+
+        if phase == PHASE_PENDING:
+            await self._issue_intermediate(spec, namespace, owner_references)
+            return PHASE_INTERMEDIATE_REQUESTED
+        if phase == PHASE_INTERMEDIATE_REQUESTED:
+            if not self._secret_ready(intermediate_secret, namespace):
+                self._check_timeout(status, intermediate_secret)
+                return None
+            return PHASE_INTERMEDIATE_READY
+        if phase == PHASE_INTERMEDIATE_READY:
+            if self.issuance_service is None:  # The operator signs with the intermediate's secret directly
+                await asyncio.to_thread(self._create_issuer, tenant_name, namespace, owner_references)
+            return PHASE_ISSUER_READY
+        if phase == PHASE_ISSUER_READY:
+            await self._issue_client(spec, namespace, owner_references)
+            return PHASE_CLIENT_REQUESTED
+        if phase == PHASE_CLIENT_REQUESTED:
+            if not self._secret_ready(client_secret, namespace):
+                self._check_timeout(status, client_secret)
+                return None
+            return PHASE_CLIENT_READY
+        if phase == PHASE_CLIENT_READY:
+            intermediate_ca_data = self._secret_ready(intermediate_secret, namespace)
+            if not intermediate_ca_data:
+                # The intermediate was deleted underneath us; request it again
+                return PHASE_PENDING
+            await asyncio.to_thread(
+                self.ca_chain_service.add_tenant,
+                namespace=namespace,
+                tenant_name=tenant_name,
+                intermediate_ca=base64.b64decode(intermediate_ca_data['tls.crt']),
+                revoked=spec.get('revoked', False),
+                group=spec.get('group'),
+                # Tenants outside a bulk import are not held back by one
+                urgent=BATCH_ANNOTATION not in (body['metadata'].get('annotations') or {})
+            )
+            return PHASE_IN_CHAIN
+        return None
+
+    async def advance(self, namespace, tenant_name, body=None):
+        """Advance a tenant from its persisted phase as far as its dependencies allow."""
+        lock = self._locks.setdefault((namespace, tenant_name), asyncio.Lock())
+        async with lock:
+            body = self.tenant_index.get(namespace, tenant_name) or body
+            if body is None:
+                return None
+            spec = body['spec']
+            status = dict(body.get('status') or {})
+            if is_provisioned(status):
+                self.retry_queue.discard((namespace, tenant_name))  # Provisioned by another route
+                return PHASE_IN_CHAIN
+            phase = status.get('phase') or PHASE_PENDING
+            if status.get('state') == 'Failed':
+                # Retrying: re-issue the request the tenant was waiting on, even if unchanged
+                phase = RETRY_FROM.get(phase, phase)
+                self.forget_applied(tenant_name, namespace)
+
+            patch = {}
+            try:
+                while True:
+                    next_phase = await self._step(phase, status, body)
+                    if next_phase is None:
+                        break
+                    logger.info("Tenant %s advanced from %s to %s", tenant_name, phase, next_phase)
+                    _observe_phase(phase, status, body)
+                    phase = next_phase
+                    patch.update({'phase': phase, 'phaseTransitionTime': _now().isoformat()})
+                    status.update(patch)
+                    if phase == PHASE_IN_CHAIN:
+                        elapsed = _since(body['metadata'].get('creationTimestamp'))
+                        if elapsed is not None:
+                            metrics.ONBOARDING_SECONDS.observe(elapsed)
+                        revoked = spec.get('revoked', False)
+                        patch.update({
+                            'intermediateCA': f"{tenant_name}-intermediate-ca",
+                            'clientCert': f"{tenant_name}-client-cert",
+                            'isRevoked': revoked,
+                            'state': 'Revoked' if revoked else 'Active',
+                            'message': 'Provisioning complete'
+                        })
+                        patch.update(self.chain_status(tenant_name, spec.get('group')))
+                        patch.update(self.expiry_status(tenant_name, namespace, spec))
+                        patch['profile'] = self.profiles.name(spec)
+                        kopf.info(body, reason='Created',
+                                  message=f'Successfully created tenant {tenant_name}')
+                        break
+                if patch and status.get('state') == 'Failed' and phase != PHASE_IN_CHAIN:
+                    patch.update({'state': 'Creating', 'message': f'Resumed provisioning at {phase}'})
+            except Exception as e:
+                logger.error("Provisioning of tenant %s failed in phase %s: %s", tenant_name, phase, e)
+                patch.update({'state': 'Failed', 'message': str(e)})
+                kopf.warn(body, reason='Failed',
+                          message=f'Failed to create tenant: {str(e)}')
+
+            key = (namespace, tenant_name)
+            if patch.get('state') == 'Failed':
+                attempt = self.retry_queue.backoff(key)
+                patch['message'] = f"{patch['message']} (retry {attempt + 1} scheduled)"
+            elif phase in RETRY_FROM:
+                # Waiting on cert-manager: the secret watch normally advances us first
+                self.retry_queue.schedule(key, self.timeout)
+            else:
+                self.retry_queue.discard(key)
+
+            if patch:
+                await asyncio.to_thread(self._patch_status, body, patch)
+            return phase
+
+    async def on_secret_ready(self, namespace, secret_name):
+        """Advance the tenant waiting on a secret that just received its certificate."""
+        tenant_name = _tenant_of(secret_name, ('-intermediate-ca-secret', '-client-cert-secret'))
+        body = tenant_name and self.tenant_index.get(namespace, tenant_name)
+        if not body:
+            return
+        status = body.get('status') or {}
+        if is_provisioned(status):
+            await self._on_reissued(body, status, namespace, tenant_name, secret_name)
+        else:
+            # The secret may be ready before the watch echoed the phase that waits on it;
+            # advance() re-reads the phase under the tenant lock and does nothing if it can't step
+            await self.advance(namespace, tenant_name)
+
+    async def _on_reissued(self, body, status, namespace, tenant_name, secret_name):
+        """Follow a renewed certificate of a provisioned tenant into the chain and its status."""
+        data = self._secret_ready(secret_name, namespace)
+        if not data:
+            return
+        certificate_name = secret_name[:-len('-secret')]
+        spec = body['spec']
+        period, renewed = self._track_expiry(namespace, certificate_name, data, spec)
+        if period is None:
+            return
+        not_after = _timestamp(period[1])
+        is_intermediate = certificate_name.endswith('-intermediate-ca')
+        field = EXPIRY_FIELDS[0] if is_intermediate else EXPIRY_FIELDS[1]
+        if not renewed and status.get(field) == not_after:
+            return
+        patch = {field: not_after}
+        if is_intermediate:
+            await asyncio.to_thread(self.ca_chain_service.refresh_intermediate, namespace, tenant_name,
+                                    base64.b64decode(data['tls.crt']))
+            # Re-issue the client certificate under the new intermediate, so the old one can be retired.
+            # A client Certificate whose profile changed is re-issued by applying it
+            if renewed and not await self._issue_client(spec, namespace, _owner_references(body)) \
+                    and self.renewal_service is not None:
+                self.renewal_service.renew_soon(namespace, f"{tenant_name}-client-cert")
+        elif renewed:
+            await asyncio.to_thread(self.ca_chain_service.retire_previous, namespace, tenant_name)
+            # The client certificate is re-issued last, so the tenant now runs on its current profile
+            patch['profile'] = self.profiles.name(spec)
+        logger.info("Certificate %s of tenant %s is valid until %s", certificate_name, tenant_name, not_after)
+        await asyncio.to_thread(self._patch_status, body, patch)
+
+    async def backfill(self, namespace, tenant_name, body):
+        """Record the phase of a tenant provisioned before status.phase existed, and track its expiry."""
+        spec = body['spec']
+        patch = {'phase': PHASE_IN_CHAIN, 'phaseTransitionTime': _now().isoformat()}
+        patch.update(self.chain_status(tenant_name, spec.get('group')))
+        patch.update(self.expiry_status(tenant_name, namespace, spec))
+        logger.info("Tenant %s was provisioned before phases were recorded, marking it %s",
+                    tenant_name, PHASE_IN_CHAIN)
+        await asyncio.to_thread(self._patch_status, body, patch)
+
+    async def migrate(self, namespace, tenant_name, body):
+        """Re-issue a provisioned tenant's certificates with its current profile, without downtime.
+
+        The new intermediate CA is published next to the old one, the client
+        certificate is re-issued under it, and only then is the old one retired.
+        """
+        spec = body['spec']
+        owner_references = _owner_references(body)
+        logger.info("Moving tenant %s to certificate profile %s", tenant_name, self.profiles.name(spec))
+        if not await self._issue_intermediate(spec, namespace, owner_references):
+            # Same intermediate CA in both profiles: only the client certificate changes
+            await self._issue_client(spec, namespace, owner_references)
+
+    async def rebalance(self, acquired, released):
+        """Follow namespaces moving between operator replicas."""
+        for namespace in released:
+            self.release_namespace(namespace)
+        for namespace in acquired:
+            await self.adopt_namespace(namespace)
+
+    def release_namespace(self, namespace):
+        """Stop working on a namespace another replica has taken over."""
+        for body in self.tenant_index.list(namespace):
+            self.retry_queue.discard((namespace, body['spec']['name']))
+        self.ca_chain_service.forget_namespace(namespace)
+
+    async def adopt_namespace(self, namespace):
+        """Take over a namespace: reload its CA chain and pick up the work its previous replica left."""
+        logger.info("Taking over namespace %s", namespace)
+        try:
+            await asyncio.to_thread(self.ca_chain_service.create_or_update_ca_chain, namespace)
+        except kopf.PermanentError as e:
+            logger.error("Failed to load the CA chain of namespace %s: %s", namespace, e)
+        for body in self.tenant_index.list(namespace):
+            spec = body['spec']
+            status = body.get('status') or {}
+            tenant_name = spec['name']
+            key = (namespace, tenant_name)
+            if status.get('state') == 'Failed':
+                self.retry_queue.backoff(key)
+            elif not is_provisioned(status):
+                self.retry_queue.schedule(key, 0)
+            elif spec.get('revoked', False) != status.get('isRevoked', False):
+                # A revocation the previous replica didn't get to
+                revoked = spec.get('revoked', False)
+                change = self.ca_chain_service.revoke_tenant if revoked else self.ca_chain_service.unrevoke_tenant
+                await asyncio.to_thread(change, namespace, tenant_name)
+                await asyncio.to_thread(self._patch_status, body,
+                                        {'isRevoked': revoked, 'state': 'Revoked' if revoked else 'Active'})
+            else:
+                self.expiry_status(tenant_name, namespace, spec)  # Resume expiry tracking
+
+    def on_certificate_changed(self, namespace, certificate_name):
+        """Retry a failed tenant right away when one of its Certificates changes."""
+        tenant_name = _tenant_of(certificate_name, ('-intermediate-ca', '-client-cert'))
+        if tenant_name:
+            self.retry_queue.trigger((namespace, tenant_name))
+
+    def on_certificate_deleted(self, namespace, certificate_name):
+        """Make sure a deleted Certificate is applied again rather than skipped as unchanged."""
+        self.cert_service.forget('certificates', namespace, certificate_name)
+
+    def _patch_status(self, body, status):
+        """Persist the phase and status fields on the Tenant and the local index."""
+        metadata = body['metadata']
+        namespace = metadata['namespace']
+        self.tenant_index.update_status(namespace, body['spec']['name'], status)
+        try:
+            self.custom_objects_api.patch_namespaced_custom_object_status(
+                Config.TENANT_GROUP, Config.TENANT_VERSION,
+                namespace, 'tenants', metadata['name'], {'status': status}
+            )
+        except ApiException as e:
+            if e.status != 404:  # Ignore if the tenant is already gone
+                logger.error("Failed to patch status of tenant %s: %s", metadata['name'], e)
+
+def _now():
+    return datetime.now(timezone.utc)
+
+def _timestamp(moment):
+    return moment.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def _since(timestamp):
+    """Return the seconds elapsed since an ISO timestamp, or None if it is unset."""
+    if not timestamp:
+        return None
+    return (_now() - datetime.fromisoformat(timestamp.replace('Z', '+00:00'))).total_seconds()
+
+def _observe_phase(phase, status, body):
+    """Record how long a tenant spent in the phase it just completed."""
+    elapsed = _since(status.get('phaseTransitionTime') or
+                     (phase == PHASE_PENDING and body['metadata'].get('creationTimestamp')))
+    if elapsed is None:
+        return
+    metrics.PHASE_SECONDS.labels(phase).observe(elapsed)
+    if phase in RETRY_FROM:
+        # Requested phases are the wait for cert-manager to issue the secret
+        metrics.WAIT_FOR_SECRET_SECONDS.observe(elapsed)
+
+def _owner_references(body):
+    """Make the Tenant the owner of its cert-manager objects, so they are garbage collected with it."""
+    metadata = body['metadata']
+    if not metadata.get('uid'):
+        return None
+    return [{
+        'apiVersion': f'{Config.TENANT_GROUP}/{Config.TENANT_VERSION}',
+        'kind': 'Tenant',
+        'name': metadata['name'],
+        'uid': metadata['uid'],
+        'controller': True,
+        'blockOwnerDeletion': False
+    }]
+
+def _tenant_of(name, suffixes):
+    """Return the tenant a dependent object belongs to, by name suffix."""
+    for suffix in suffixes:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return None
@@ -0,0 +1,151 @@
+import asyncio
+import heapq
+import time
+import zlib
+from datetime import datetime, timezone
+from kubernetes.client.rest import ApiException
+from config import Config
+from utils.logging import setup_logger
+from utils.retry_queue import RetryQueue
+from utils import metrics
+
+logger = setup_logger('renewal-service')
+
+# Share of the spread applied to each certificate, out of this many steps
+_SPREAD_STEPS = 1000
+
+class RenewalService:
+    """Track tenant certificate expiry and renew ahead of cert-manager, spread out and rate limited.
+
+    Certificates are renewed at a fraction of their lifetime, pulled earlier by
+    a per-certificate share of the spread, so a batch created together does not
+    come due together. Renewals are triggered like `cmctl renew`, by adding an
+    Issuing condition to the Certificate, at most `rate` per minute. When the
+    operator issues certificates itself, `reissue` signs the renewal instead.
+    """
+
+    def __init__(self, custom_objects_api, rate=10.0, fraction=0.6, spread=0.1, recheck=3600.0, owns=None):
+        self.custom_objects_api = custom_objects_api
+        self.owns = owns  # namespace -> whether this replica renews its certificates
+        self.rate = rate  # proactive renewals per minute; 0 only tracks expiry
+        self.fraction = fraction
+        self.spread = spread
+        self.recheck = recheck  # seconds before checking again on a renewal that didn't happen
+        self.reissue = None  # async (namespace, certificate name) -> re-issue in the operator instead of cert-manager
+        self.queue = RetryQueue()  # (namespace, certificate name) -> due renewal
+        self._validity = {}  # (namespace, certificate name) -> (not_before, not_after)
+        self._renew_before = {}  # (namespace, certificate name) -> latest renewal, in seconds before expiry
+        self._expiries = []  # (not_after timestamp, key) min-heap; stale entries are skipped
+        self._last_renewal = 0.0
+        self._task = None
+
+    def start(self):
+        """Start renewing due certificates on the running event loop."""
+        self._task = asyncio.get_running_loop().create_task(self.queue.run(self._renew, concurrency=1))
+
+    def track(self, namespace, certificate_name, validity, renew_before=None):
+        """Record a certificate's validity and schedule its renewal; return True if it changed."""
+        key = (namespace, certificate_name)
+        if renew_before:
+            self._renew_before[key] = renew_before
+        else:
+            self._renew_before.pop(key, None)
+        previous = self._validity.get(key)
+        if previous == validity:
+            return False
+        self._validity[key] = validity
+        heapq.heappush(self._expiries, (validity[1].timestamp(), key))
+        if self.rate > 0:
+            self.queue.schedule(key, max(0.0, self._renew_at(key, validity) - time.time()))
+        else:
+            self.queue.discard(key)  # A renewal requested with renew_soon() arrived
+        return previous is not None
+
+    def forget(self, namespace, certificate_name):
+        """Stop tracking a deleted certificate."""
+        key = (namespace, certificate_name)
+        self._validity.pop(key, None)
+        self._renew_before.pop(key, None)
+        self.queue.discard(key)
+
+    def renew_soon(self, namespace, certificate_name):
+        """Queue a certificate for renewal at the next free rate-limited slot.
+
+        Unlike proactive renewals, these are re-issues the operator needs, such as
+        a client certificate under a renewed intermediate CA, so they run at any rate.
+        """
+        if (namespace, certificate_name) in self._validity:
+            self.queue.schedule((namespace, certificate_name), 0)
+
+    def next_expiry(self):
+        """Return the timestamp of the earliest tracked expiry, or 0 if nothing is tracked."""
+        while self._expiries:
+            expiry, key = self._expiries[0]
+            validity = self._validity.get(key)
+            if validity is not None and validity[1].timestamp() == expiry:
+                return expiry
+            heapq.heappop(self._expiries)  # Renewed or forgotten
+        return 0
+
+    def expiring_within(self, seconds):
+        """Count tracked certificates expiring within the given number of seconds."""
+        deadline = time.time() + seconds
+        return sum(1 for _, not_after in self._validity.values() if not_after.timestamp() <= deadline)
+
+    def _renew_at(self, key, validity):
+        not_before, not_after = validity
+        lifetime = (not_after - not_before).total_seconds()
+        share = zlib.crc32(f"{key[0]}/{key[1]}".encode('utf-8')) % _SPREAD_STEPS / _SPREAD_STEPS
+        renew_at = not_before.timestamp() + lifetime * (self.fraction - self.spread * share)
+        if key in self._renew_before:
+            # Never later than the profile's renewBefore
+            renew_at = min(renew_at, not_after.timestamp() - self._renew_before[key])
+        return renew_at
+
+    async def _renew(self, key):
+        if key not in self._validity or (self.owns is not None and not self.owns(key[0])):
+            self.forget(*key)  # Deleted, or handed over to another replica
+            return
+        # Rate limit: one renewal every 60 / rate seconds
+        wait = self._last_renewal + 60.0 / self.rate - time.monotonic() if self.rate > 0 else 0
+        if wait > 0:
+            await asyncio.sleep(wait)
+        self._last_renewal = time.monotonic()
+        try:
+            if self.reissue is not None:
+                await self.reissue(*key)
+                metrics.CERTIFICATE_RENEWALS.inc()
+            else:
+                await asyncio.to_thread(self._trigger, *key)
+        except ApiException as e:
+            if e.status == 404:
+                self.forget(*key)
+                return
+            logger.error("Failed to trigger renewal of certificate %s: %s", key[1], e)
+        except ValueError as e:
+            logger.error("Failed to re-issue certificate %s: %s", key[1], e)
+        # The renewed secret reschedules the certificate; check back if it never arrives
+        if key in self.queue:
+            self.queue.schedule(key, self.recheck)
+
+    def _trigger(self, namespace, certificate_name):
+        """Ask cert-manager to re-issue a certificate now."""
+        certificate = self.custom_objects_api.get_namespaced_custom_object(
+            Config.CERT_MANAGER_GROUP, Config.CERT_MANAGER_VERSION,
+            namespace, 'certificates', certificate_name
+        )
+        conditions = [c for c in (certificate.get('status') or {}).get('conditions', [])
+                      if c.get('type') != 'Issuing']
+        conditions.append({
+            'type': 'Issuing',
+            'status': 'True',
+            'reason': 'ManuallyTriggered',
+            'message': 'Certificate re-issuance triggered ahead of expiry by the mTLS operator',
+            'lastTransitionTime': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        })
+        self.custom_objects_api.patch_namespaced_custom_object_status(
+            Config.CERT_MANAGER_GROUP, Config.CERT_MANAGER_VERSION,
+            namespace, 'certificates', certificate_name, {'status': {'conditions': conditions}}
+        )
+        metrics.CERTIFICATE_RENEWALS.inc()
+        logger.info("Triggered renewal of certificate %s in namespace %s", certificate_name, namespace)
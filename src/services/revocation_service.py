@@ -0,0 +1,99 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+import kopf
+from kubernetes.client.rest import ApiException
+from config import Config
+from utils.logging import setup_logger
+from utils import metrics
+
+logger = setup_logger('revocation-service')
+
+class RevocationService:
+    """Revoke the tenants a RevocationList selects with one CA chain write per affected chain secret.
+
+    The chain is published first, without waiting for the chain writer's quiet
+    window; the tenants' spec.revoked is set afterwards, and their revocation
+    handlers then find the chain already up to date. How long the new chain
+    took to come back through the secret watch, the same stream ingress
+    controllers read it from, is reported as the propagation time.
+    """
+
+    def __init__(self, custom_objects_api, ca_chain_service, secret_cache, tenant_index, timeout=60):
+        self.custom_objects_api = custom_objects_api
+        self.ca_chain_service = ca_chain_service
+        self.secret_cache = secret_cache
+        self.tenant_index = tenant_index
+        self.timeout = timeout  # seconds to wait for the watch to deliver the published chain
+
+    async def apply(self, namespace, spec):
+        """Revoke every tenant a RevocationList spec selects and return the list's status."""
+        names = spec.get('tenants') or []
+        selector = spec.get('selector') or {}
+        if not names and not (selector.get('matchLabels') or selector.get('matchExpressions')):
+            # An empty selector would select every tenant in the namespace
+            raise kopf.PermanentError("A RevocationList needs tenants or a non-empty selector")
+
+        start = time.monotonic()
+        selected = self.tenant_index.select(namespace, names, selector)
+        tenant_names = sorted(body['spec']['name'] for body in selected)
+        status = {'state': 'Applied', 'revokedTenants': tenant_names, 'revoked': len(tenant_names), 'chainWrites': 0}
+        missing = sorted(set(names) - set(tenant_names))
+        if missing:
+            status['message'] = f"Tenants not found: {', '.join(missing)}"
+        if not selected:
+            return status
+
+        # Cut the tenants off first, in one write per chain secret they are published in
+        shards = list(await asyncio.to_thread(self.ca_chain_service.revoke_tenants, namespace, tenant_names))
+        bundles = await asyncio.gather(*(self.ca_chain_service.writer.flush((namespace, shard)) for shard in shards))
+        published = {self.ca_chain_service.secret_name(shard): bundle
+                     for shard, bundle in zip(shards, bundles) if bundle}
+        status.update({'chainWrites': len(published), 'publishedAt': _timestamp()})
+        metrics.REVOKED_TENANTS.inc(len(selected))
+
+        # Then record the revocation on the Tenants while the watch delivers the chain
+        propagation = asyncio.ensure_future(self._propagated(namespace, published))
+        await asyncio.gather(*(asyncio.to_thread(self._mark_revoked, namespace, body) for body in selected))
+        if await propagation:
+            seconds = time.monotonic() - start
+            metrics.REVOCATION_PROPAGATION_SECONDS.observe(seconds)
+            status['propagationSeconds'] = round(seconds, 3)
+        logger.info("Revoked %s tenants in namespace %s with %s chain writes", len(selected), namespace,
+                    len(published), extra={'namespace': namespace, 'revoked': len(selected),
+                                           'chain_writes': len(published),
+                                           'propagation_seconds': status.get('propagationSeconds')})
+        return status
+
+    async def _propagated(self, namespace, published):
+        """Wait until the secret watch delivers every published bundle; return False on timeout."""
+        try:
+            await asyncio.gather(*(
+                self.secret_cache.wait_for(secret_name, namespace,
+                                           lambda data, bundle=bundle: data.get('ca.crt') == bundle, self.timeout)
+                for secret_name, bundle in published.items()
+            ))
+        except asyncio.TimeoutError:
+            logger.warning("The CA chain of namespace %s was not seen on the secret watch within %ss",
+                           namespace, self.timeout)
+            return False
+        return True
+
+    def _mark_revoked(self, namespace, body):
+        """Set a revoked tenant's spec.revoked, for its revocation handler to record in its status."""
+        tenant_name = body['spec']['name']
+        # Keeps a chain reload from the local index from publishing the tenant again meanwhile
+        self.tenant_index.update_status(namespace, tenant_name, {'isRevoked': True})
+        if body['spec'].get('revoked'):
+            return
+        try:
+            self.custom_objects_api.patch_namespaced_custom_object(
+                Config.TENANT_GROUP, Config.TENANT_VERSION,
+                namespace, 'tenants', body['metadata']['name'], {'spec': {'revoked': True}}
+            )
+        except ApiException as e:
+            if e.status != 404:  # Ignore if the tenant is already gone
+                logger.error("Failed to revoke tenant %s: %s", tenant_name, e)
+
+def _timestamp():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
@@ -0,0 +1,73 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from utils.logging import setup_logger
+
+logger = setup_logger('standby-service')
+
+class StandbyService:
+    """Notice when this replica goes from standby to active under kopf peering.
+
+    kopf pauses every replica but the one with the highest priority among the
+    live peers recorded in the ClusterKopfPeering status, and resumes one when
+    the peers above it are gone. The local stores of a paused replica miss the
+    watch events meanwhile, and the listing kopf makes on resuming does not
+    replay deletions, so listeners re-warm the stores when it becomes active.
+    """
+
+    def __init__(self, custom_objects_api, peering_name, priority, interval=10):
+        self.custom_objects_api = custom_objects_api
+        self.peering_name = peering_name
+        self.priority = priority  # this replica's kopf peering priority
+        self.interval = interval
+        self._listeners = []
+        self._paused = None  # unknown until the first check
+        self._task = None
+
+    def subscribe(self, listener):
+        """Call `await listener()` whenever this replica resumes after standing by."""
+        self._listeners.append(listener)
+
+    def start(self):
+        """Start following the peering on the running event loop."""
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        while True:
+            try:
+                paused = await asyncio.to_thread(self._standing_by)
+            except Exception as e:
+                logger.error("Failed to read operator peering %s: %s", self.peering_name, e)
+            else:
+                if self._paused and not paused:
+                    logger.info("Resuming after standing by, re-warming the local stores")
+                    for listener in self._listeners:
+                        await listener()
+                self._paused = paused
+            await asyncio.sleep(self.interval)
+
+    def _standing_by(self):
+        """Check whether kopf keeps this replica paused in favour of a live peer, by kopf's own rule."""
+        peering = self.custom_objects_api.get_cluster_custom_object(
+            'kopf.dev', 'v1', 'clusterkopfpeerings', self.peering_name
+        )
+        now = datetime.now(timezone.utc)
+        priorities = [
+            peer.get('priority', 0) for peer in (peering.get('status') or {}).values()
+            if isinstance(peer, dict) and _deadline(peer) > now
+        ]
+        # Our own entry is among them; another one with the same priority pauses both
+        return any(p > self.priority for p in priorities) or priorities.count(self.priority) > 1
+
+def _deadline(peer):
+    """Return when a peer entry expires; kopf takes one without lastseen as seen now."""
+    lastseen = peer.get('lastseen')
+    if not lastseen:
+        return datetime.now(timezone.utc) + timedelta(seconds=int(peer.get('lifetime', 60)))
+    moment = datetime.fromisoformat(lastseen.replace('Z', '+00:00'))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment + timedelta(seconds=int(peer.get('lifetime', 60)))
@@ -0,0 +1,70 @@
+import time
+from config import Config
+from utils.logging import setup_logger
+from utils.secret_cache import is_managed_secret
+
+logger = setup_logger('warm-start-service')
+
+class WarmStartService:
+    """Prime the operator's local state from one paginated LIST per resource, before any handler runs."""
+
+    def __init__(self, core_v1_api, custom_objects_api, page_size=500):
+        self.core_v1_api = core_v1_api
+        self.custom_objects_api = custom_objects_api
+        self.page_size = page_size
+
+    def load(self, tenant_index, secret_cache, cert_service, prune=False):
+        """List Tenants, Secrets, Certificates and Issuers into the local stores; return the counts.
+
+        With `prune`, stored objects the LISTs no longer return are dropped, for
+        stores that missed watch events. Objects the watches add meanwhile are kept.
+        """
+        start = time.perf_counter()
+        counts = {'tenants': 0, 'secrets': 0, 'certificates': 0, 'issuers': 0}
+        stale_tenants = tenant_index.keys() if prune else set()
+        stale_secrets = secret_cache.keys() if prune else set()
+        if prune:
+            cert_service.forget_all()
+        for tenant in self._pages(self.custom_objects_api.list_cluster_custom_object,
+                                  Config.TENANT_GROUP, Config.TENANT_VERSION, 'tenants'):
+            tenant_index.apply_event(None, tenant)
+            stale_tenants.discard((tenant['metadata']['namespace'], (tenant.get('spec') or {}).get('name')))
+            counts['tenants'] += 1
+        # Secrets are listed unfiltered, like the secret watch: root CA secrets carry no label
+        for secret in self._pages(self.core_v1_api.list_secret_for_all_namespaces):
+            metadata = secret.metadata
+            if is_managed_secret(metadata.name, metadata.labels):
+                secret_cache.apply_event(None, {
+                    'metadata': {'name': metadata.name, 'namespace': metadata.namespace,
+                                 'labels': metadata.labels},
+                    'data': secret.data
+                })
+                stale_secrets.discard((metadata.namespace, metadata.name))
+                counts['secrets'] += 1
+        for plural in ('certificates', 'issuers'):
+            for obj in self._pages(self.custom_objects_api.list_cluster_custom_object,
+                                   Config.CERT_MANAGER_GROUP, Config.CERT_MANAGER_VERSION, plural):
+                cert_service.prime(plural, obj)
+                counts[plural] += 1
+        tenant_index.remove(stale_tenants)
+        secret_cache.remove(stale_secrets)
+        if prune:
+            logger.info("Dropped %s tenants and %s secrets deleted while the local stores were not watching",
+                        len(stale_tenants), len(stale_secrets))
+        logger.info("Warm start loaded %s tenants, %s secrets, %s certificates and %s issuers in %.2fs",
+                    counts['tenants'], counts['secrets'], counts['certificates'], counts['issuers'],
+                    time.perf_counter() - start)
+        return counts
+
+    def _pages(self, list_fn, *args):
+        """Yield every item of a LIST, one page at a time."""
+        token = None
+        while True:
+            page = list_fn(*args, limit=self.page_size, _continue=token)
+            if isinstance(page, dict):
+                items, token = page.get('items', []), (page.get('metadata') or {}).get('continue')
+            else:
+                items, token = page.items, page.metadata and page.metadata._continue
+            yield from items
+            if not token:
+                return
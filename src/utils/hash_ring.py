@@ -0,0 +1,22 @@
+import bisect
+import hashlib
+
+class HashRing:
+    """Consistent hash ring: adding or removing a member only moves the keys it gains or loses."""
+
+    def __init__(self, members, vnodes=64):
+        self.members = frozenset(members)
+        # Each member owns several points on the ring so keys spread evenly
+        points = sorted((_hash(f"{member}#{i}"), member) for member in self.members for i in range(vnodes))
+        self._hashes = [h for h, _ in points]
+        self._owners = [member for _, member in points]
+
+    def owner(self, key):
+        """Return the member owning a key, or None if the ring is empty."""
+        if not self._owners:
+            return None
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._owners[index]
+
+def _hash(value):
+    return int.from_bytes(hashlib.sha1(value.encode('utf-8')).digest()[:8], 'big')
@@ -1,26 +1,108 @@
+import atexit
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
 
-# Logging configuration
-LOG_FORMAT = '[%(asctime)s] %(name)-20s [%(levelname)-8s] %(message)s'
-LOG_DATEFMT = '%Y-%m-%d %H:%M:%S,%03d'
+# Logging configuration, set through the chart's operator.logLevel
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+
+# Repetitive messages: past SAMPLE_BURST records of one message per SAMPLE_WINDOW seconds,
+# only one in SAMPLE_RATE is logged; the others are counted on the next one that is
+SAMPLE_WINDOW = 10.0
+SAMPLE_BURST = 20
+SAMPLE_RATE = 100
+
+# LogRecord attributes that are not extra fields; kopf's object loggers add the k8s_* and settings ones
+RESERVED_ATTRS = set(vars(logging.makeLogRecord({}))) | {
+    'message', 'asctime', 'taskName', 'settings', 'k8s_skip', 'k8s_ref'
+}
+
+_listener = None
+
+class JsonFormatter(logging.Formatter):
+    """Format a record as one JSON object per line, with extra fields and kopf's object reference as keys."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if getattr(record, 'k8s_ref', None):
+            entry['object'] = record.k8s_ref
+        for key, value in vars(record).items():
+            if key not in RESERVED_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class SamplingFilter(logging.Filter):
+    """Rate-limit repetitive records by message template, sampling the excess instead of logging it all.
+
+    Records are keyed by logger and unformatted message, so every "Tenant %s
+    advanced" line counts as one message. Warnings and errors always pass.
+    """
+
+    def __init__(self, window=SAMPLE_WINDOW, burst=SAMPLE_BURST, rate=SAMPLE_RATE):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self.rate = rate
+        self._counts = {}  # (logger, template) -> [window start, records seen, records dropped]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            count = self._counts.get(key)
+            if count is None or now - count[0] > self.window:
+                if len(self._counts) > 10000:
+                    self._counts.clear()  # Bound the memory of one-off messages
+                dropped = count[2] if count else 0
+                count = self._counts[key] = [now, 0, dropped]
+            count[1] += 1
+            if count[1] > self.burst and (count[1] - self.burst) % self.rate:
+                count[2] += 1
+                return False
+            dropped, count[2] = count[2], 0
+        if dropped:
+            record.suppressed = dropped
+        return True
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Same process: leave the message unformatted for the listener thread to format
+        return record
 
 def setup_logger(name):
-    logger = logging.getLogger(name)
-    logger.setLevel(logging.INFO)
-    logger.handlers = []
-    handler = logging.StreamHandler()
-    handler.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATEFMT))
-    logger.addHandler(handler)
-    logger.propagate = False
-    return logger
+    """Return a module logger; its records go through the root logger's queue."""
+    return logging.getLogger(name)
 
 def configure_logging():
-    logging.basicConfig(
-        level=logging.INFO,
-        format=LOG_FORMAT,
-        datefmt=LOG_DATEFMT
-    )
-    
-    # Configure kopf's logging format
-    for handler in logging.getLogger().handlers:
-        handler.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATEFMT)) 
\ No newline at end of file
+    """Log JSON lines from a background thread, fed by a non-blocking queue on the root logger."""
+    global _listener
+    if _listener is not None:
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter())
+    _listener = logging.handlers.QueueListener(queue.SimpleQueue(), handler)
+    queue_handler = _QueueHandler(_listener.queue)
+    if LOG_LEVEL != 'DEBUG':
+        # Debugging needs every record
+        queue_handler.addFilter(SamplingFilter())
+    # Replaces kopf's own stream handler, so kopf's records are JSON lines too
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+    _listener.start()
+    atexit.register(_listener.stop)
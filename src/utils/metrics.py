@@ -0,0 +1,210 @@
+import asyncio
+import functools
+import time
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+CHAIN_WRITES = Counter(
+    'mtls_operator_chain_writes_total',
+    'CA chain secret writes sent to the API server'
+)
+CHAIN_REBUILDS_COALESCED = Counter(
+    'mtls_operator_chain_rebuilds_coalesced_total',
+    'CA chain rebuild requests folded into an already pending rebuild'
+)
+CHAIN_WRITES_SKIPPED = Counter(
+    'mtls_operator_chain_writes_skipped_total',
+    'CA chain rebuilds whose bundle was identical to the published one'
+)
+CHAIN_REBUILD_SECONDS = Histogram(
+    'mtls_operator_chain_rebuild_seconds',
+    'Time to compute a CA chain bundle from the in-memory model'
+)
+CHAIN_BUNDLE_BYTES = Histogram(
+    'mtls_operator_chain_bundle_bytes',
+    'Size of the computed CA chain bundle',
+    buckets=(4e3, 16e3, 64e3, 128e3, 256e3, 512e3, 768e3, 1024e3)
+)
+PHASE_SECONDS = Histogram(
+    'mtls_operator_provisioning_phase_seconds',
+    'Time a tenant spent in a provisioning phase before completing it',
+    ['phase'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+)
+ONBOARDING_SECONDS = Histogram(
+    'mtls_operator_onboarding_seconds',
+    'Time from Tenant creation until its intermediate CA is in the chain',
+    buckets=(1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+)
+WAIT_FOR_SECRET_SECONDS = Histogram(
+    'mtls_operator_wait_for_secret_seconds',
+    'Time spent waiting for a Secret to receive its certificate'
+)
+API_CALLS = Counter(
+    'mtls_operator_api_calls_total',
+    'Kubernetes API calls made by the operator',
+    ['verb', 'resource']
+)
+API_CALL_SECONDS = Histogram(
+    'mtls_operator_api_call_seconds',
+    'Kubernetes API call latency',
+    ['verb', 'resource']
+)
+API_THROTTLE_SECONDS = Histogram(
+    'mtls_operator_api_throttle_seconds',
+    'Time Kubernetes API calls waited on the client-side rate limit',
+    buckets=(0, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5)
+)
+SERVICE_CALL_SECONDS = Histogram(
+    'mtls_operator_service_call_seconds',
+    'Time spent in service methods',
+    ['service', 'method']
+)
+HANDLER_SECONDS = Histogram(
+    'mtls_operator_handler_seconds',
+    'Handler execution time',
+    ['handler']
+)
+HANDLERS_IN_FLIGHT = Gauge(
+    'mtls_operator_handlers_in_flight',
+    'Handler invocations currently running',
+    ['handler']
+)
+CERTIFICATE_NEXT_EXPIRY = Gauge(
+    'mtls_operator_certificate_next_expiry_timestamp_seconds',
+    'Expiry of the tracked tenant certificate that expires first'
+)
+CERTIFICATES_EXPIRING = Gauge(
+    'mtls_operator_certificates_expiring',
+    'Tracked tenant certificates expiring within a window',
+    ['within']
+)
+CERTIFICATE_RENEWALS = Counter(
+    'mtls_operator_certificate_renewals_total',
+    'Certificate renewals triggered ahead of expiry'
+)
+ISSUE_SECONDS = Histogram(
+    'mtls_operator_issue_seconds',
+    'Time to sign a certificate in the operator, including key generation when no spare key was ready',
+    ['key'],
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+)
+SPARE_KEYS = Gauge(
+    'mtls_operator_spare_keys',
+    'Pre-generated private keys ready for in-operator issuance',
+    ['key']
+)
+STARTUP_SECONDS = Gauge(
+    'mtls_operator_startup_seconds',
+    'Time from process start until the local state was warm and handlers were released'
+)
+OPERATOR_MEMBERS = Gauge(
+    'mtls_operator_members',
+    'Active operator replicas sharing the namespaces'
+)
+OWNED_NAMESPACES = Gauge(
+    'mtls_operator_owned_namespaces',
+    'Tenant namespaces handled by this replica'
+)
+REVOCATION_PROPAGATION_SECONDS = Histogram(
+    'mtls_operator_revocation_propagation_seconds',
+    'Time from handling a RevocationList until the secret watch delivered the chain without its tenants',
+    buckets=(.05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+)
+REVOKED_TENANTS = Counter(
+    'mtls_operator_bulk_revoked_tenants_total',
+    'Tenants revoked through RevocationLists'
+)
+QUEUE_DEPTH = Gauge(
+    'mtls_operator_queue_depth',
+    'Items waiting in the operator\'s internal queues',
+    ['queue']
+)
+
+def start_metrics_server(port):
+    """Expose the metrics endpoint."""
+    start_http_server(port)
+
+def _wrap(fn, histogram, labels, gauge=None):
+    """Time a sync or async callable into a histogram, optionally tracking in-flight calls."""
+    if asyncio.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            if gauge is not None:
+                gauge.labels(*labels).inc()
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                histogram.labels(*labels).observe(time.perf_counter() - start)
+                if gauge is not None:
+                    gauge.labels(*labels).dec()
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if gauge is not None:
+            gauge.labels(*labels).inc()
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            histogram.labels(*labels).observe(time.perf_counter() - start)
+            if gauge is not None:
+                gauge.labels(*labels).dec()
+    return wrapper
+
+def timed(service):
+    """Decorate a service method to record its duration."""
+    def decorator(fn):
+        return _wrap(fn, SERVICE_CALL_SECONDS, (service, fn.__name__))
+    return decorator
+
+def handler(fn):
+    """Decorate a kopf handler to record its duration and in-flight count."""
+    return _wrap(fn, HANDLER_SECONDS, (fn.__name__,), gauge=HANDLERS_IN_FLIGHT)
+
+# Kubernetes client method prefixes and the API verbs they map to
+_VERBS = {
+    'read': 'get',
+    'list': 'list',
+    'create': 'create',
+    'replace': 'update',
+    'patch': 'patch',
+    'delete': 'delete',
+}
+
+def _describe_call(method, args, kwargs):
+    """Derive (verb, resource) from a kubernetes client method name and its arguments."""
+    verb, _, rest = method.partition('_')
+    verb = _VERBS.get(verb, verb)
+    if kwargs.get('_content_type') == 'application/apply-patch+yaml':
+        verb = 'apply'
+    if rest.endswith('custom_object') or rest.endswith('custom_object_status'):
+        # Custom object methods take (group, version, [namespace,] plural, ...)
+        plural = kwargs.get('plural') or (args[3] if 'namespaced' in rest else args[2])
+        return verb, plural + ('/status' if rest.endswith('_status') else '')
+    # Core API methods name the resource in the singular, e.g. read_namespaced_secret
+    resource = rest.replace('namespaced_', '').replace('_for_all_namespaces', '')
+    return verb, resource + 's'
+
+class InstrumentedApi:
+    """Proxy around a kubernetes API object counting and timing every call by verb and resource."""
+
+    def __init__(self, api):
+        self._api = api
+
+    def __getattr__(self, name):
+        attr = getattr(self._api, name)
+        if not callable(attr) or name.startswith('_') or name.endswith('_with_http_info'):
+            return attr
+
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            verb, resource = _describe_call(name, args, kwargs)
+            API_CALLS.labels(verb, resource).inc()
+            start = time.perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                API_CALL_SECONDS.labels(verb, resource).observe(time.perf_counter() - start)
+        return call
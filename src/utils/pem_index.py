@@ -0,0 +1,86 @@
+import base64
+import hashlib
+import re
+from collections import namedtuple
+from datetime import datetime, timezone
+from cryptography import x509
+from cryptography.hazmat.primitives import serialization
+from utils.logging import setup_logger
+
+logger = setup_logger('pem-index')
+
+PEM_BLOCK = re.compile(rb'-----BEGIN CERTIFICATE-----\s*(.+?)\s*-----END CERTIFICATE-----', re.DOTALL)
+
+# A parsed certificate: canonical PEM encoding and expiry
+Certificate = namedtuple('Certificate', ['fingerprint', 'pem', 'subject', 'not_after'])
+
+class CertificateIndex:
+    """Parsed certificates keyed by SHA-256 fingerprint, so each one is parsed only once."""
+
+    def __init__(self):
+        self._certificates = {}  # fingerprint -> Certificate
+
+    def __len__(self):
+        return len(self._certificates)
+
+    def __getitem__(self, fingerprint):
+        return self._certificates[fingerprint]
+
+    def add(self, data):
+        """Index every certificate in PEM data and return their fingerprints, in order."""
+        fingerprints = []
+        for match in PEM_BLOCK.finditer(data):
+            try:
+                der = base64.b64decode(match.group(1), validate=False)
+            except ValueError:
+                logger.warning("Skipping PEM block that is not valid base64")
+                continue
+            fingerprint = hashlib.sha256(der).hexdigest()
+            if fingerprint not in self._certificates:
+                try:
+                    cert = x509.load_der_x509_certificate(der)
+                except ValueError as e:
+                    logger.warning("Skipping unparseable certificate %s: %s", fingerprint[:16], e)
+                    continue
+                self._certificates[fingerprint] = Certificate(
+                    fingerprint=fingerprint,
+                    pem=cert.public_bytes(serialization.Encoding.PEM),
+                    subject=cert.subject.rfc4514_string(),
+                    not_after=cert.not_valid_after_utc
+                )
+            fingerprints.append(fingerprint)
+        return tuple(fingerprints)
+
+    def bundle(self, groups, exclude=(), now=None):
+        """Return one canonical PEM bundle from groups of fingerprints.
+
+        Certificates keep the order of their first appearance; duplicates,
+        expired certificates and excluded fingerprints are left out.
+        """
+        now = now or datetime.now(timezone.utc)
+        seen = set(exclude)
+        pems = []
+        for fingerprints in groups:
+            for fingerprint in fingerprints:
+                if fingerprint in seen:
+                    continue
+                seen.add(fingerprint)
+                cert = self._certificates[fingerprint]
+                if cert.not_after > now:
+                    pems.append(cert.pem)
+        return b''.join(pems)
+
+    def retain(self, fingerprints):
+        """Drop every certificate not in the given set."""
+        self._certificates = {fp: cert for fp, cert in self._certificates.items() if fp in fingerprints}
+
+def validity(data):
+    """Return (not_before, not_after) of the first certificate in PEM data, or None if there is none."""
+    match = PEM_BLOCK.search(data)
+    if match is None:
+        return None
+    try:
+        cert = x509.load_der_x509_certificate(base64.b64decode(match.group(1)))
+    except ValueError:
+        return None
+    return cert.not_valid_before_utc, cert.not_valid_after_utc
@@ -0,0 +1,87 @@
+import re
+import kopf
+
+# Built-in certificate profiles: the private keys of a tenant's intermediate CA and client
+# certificate, and optionally their cert-manager duration and renewBefore
+PROFILES = {
+    'rsa': {
+        'intermediate': {'algorithm': 'RSA', 'size': 4096},
+        'client': {'algorithm': 'RSA', 'size': 2048},
+    },
+    'ecdsa-p256': {
+        'intermediate': {'algorithm': 'ECDSA', 'size': 256},
+        'client': {'algorithm': 'ECDSA', 'size': 256},
+    },
+    'ed25519': {
+        'intermediate': {'algorithm': 'Ed25519'},
+        'client': {'algorithm': 'Ed25519'},
+    },
+}
+
+# Keys used when a tenant's spec.privateKey picks another algorithm than its profile
+KEYS_BY_ALGORITHM = {'RSA': PROFILES['rsa'], 'ECDSA': PROFILES['ecdsa-p256'], 'Ed25519': PROFILES['ed25519']}
+
+DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(h|m|s)')
+DURATION_UNITS = {'h': 3600, 'm': 60, 's': 1}
+
+def parse_duration(value):
+    """Return the seconds of a Go duration such as '2160h' or '1h30m', as cert-manager takes them."""
+    parts = DURATION_PART.findall(value)
+    if not parts or ''.join(number + unit for number, unit in parts) != value:
+        raise ValueError(f"Invalid duration {value!r}")
+    return sum(float(number) * DURATION_UNITS[unit] for number, unit in parts)
+
+class CertificateProfiles:
+    """Named certificate profiles, resolved for a Tenant from spec.profile, spec.privateKey and the default."""
+
+    def __init__(self, profiles=None, default='rsa'):
+        self.profiles = {**PROFILES, **(profiles or {})}
+        if default not in self.profiles:
+            raise ValueError(f"Default certificate profile {default} is not defined")
+        for name, profile in self.profiles.items():
+            for field in ('duration', 'renewBefore'):
+                if profile.get(field):
+                    parse_duration(profile[field])  # Fail at startup rather than per tenant
+        self.default = default
+
+    def name(self, spec):
+        """Return the name of a tenant's profile."""
+        return spec.get('profile') or self.default
+
+    def _profile(self, spec):
+        name = self.name(spec)
+        if name not in self.profiles:
+            raise kopf.PermanentError(f"Unknown certificate profile {name}")
+        return self.profiles[name]
+
+    def private_key(self, spec, role):
+        """Return the private key of a tenant's 'intermediate' or 'client' certificate."""
+        key = dict(self._profile(spec)[role])
+        requested = spec.get('privateKey')
+        if requested:
+            if requested['algorithm'] != key['algorithm']:
+                key = dict(KEYS_BY_ALGORITHM[requested['algorithm']][role])
+            if requested.get('size'):
+                key['size'] = requested['size']
+        return key
+
+    def duration(self, spec):
+        """Return the lifetime in seconds a tenant's profile asks for, or None for the issuer's default."""
+        duration = self._profile(spec).get('duration')
+        return duration and parse_duration(duration)
+
+    def renew_before(self, spec):
+        """Return how many seconds before expiry a tenant's certificates must be renewed, or None."""
+        # Only schedules renewals: a tenant moved to an unknown profile keeps renewing on the default schedule
+        renew_before = (self.profiles.get(self.name(spec)) or {}).get('renewBefore')
+        return renew_before and parse_duration(renew_before)
+
+    def certificate(self, spec, role):
+        """Return the cert-manager Certificate spec fields a tenant's profile sets for one of its certificates."""
+        profile = self._profile(spec)
+        # A new key on every issuance, so changing the algorithm re-issues with a new key
+        fields = {'privateKey': {**self.private_key(spec, role), 'rotationPolicy': 'Always'}}
+        for field in ('duration', 'renewBefore'):
+            if profile.get(field):
+                fields[field] = profile[field]
+        return fields
@@ -0,0 +1,45 @@
+import functools
+import threading
+import time
+from utils import metrics
+
+class TokenBucket:
+    """Client-side rate limit: `qps` requests per second on average, up to `burst` at once. Thread-safe."""
+
+    def __init__(self, qps, burst):
+        self.qps = qps
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take one token, blocking the calling thread until one is available; return the seconds waited."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.qps)
+            self._updated = now
+            # Reserve the token now, so concurrent callers queue up in order
+            self._tokens -= 1
+            wait = -self._tokens / self.qps if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+class RateLimitedApi:
+    """Proxy around a kubernetes API object that passes every call through a shared TokenBucket."""
+
+    def __init__(self, api, limiter):
+        self._api = api
+        self._limiter = limiter
+
+    def __getattr__(self, name):
+        attr = getattr(self._api, name)
+        if not callable(attr) or name.startswith('_'):
+            return attr
+
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            metrics.API_THROTTLE_SECONDS.observe(self._limiter.acquire())
+            return attr(*args, **kwargs)
+        return call
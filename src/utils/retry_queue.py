@@ -0,0 +1,84 @@
+import asyncio
+import heapq
+import random
+import time
+
+class RetryQueue:
+    """Indexed delay queue with exponential backoff and jitter; only queued keys cost anything."""
+
+    def __init__(self, base_delay=5.0, max_delay=300.0):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._heap = []  # (due, sequence, key); stale entries are skipped on pop
+        self._entries = {}  # key -> (due, sequence, attempt)
+        self._sequence = 0
+        self._wakeup = None
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _push(self, key, delay, attempt):
+        self._sequence += 1
+        due = time.monotonic() + delay
+        self._entries[key] = (due, self._sequence, attempt)
+        heapq.heappush(self._heap, (due, self._sequence, key))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def backoff(self, key):
+        """Queue a retry after the next exponential backoff step, with jitter."""
+        attempt = self._entries[key][2] + 1 if key in self._entries else 0
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        self._push(key, random.uniform(delay / 2, delay), attempt)
+        return attempt
+
+    def schedule(self, key, delay):
+        """Queue a check after a fixed delay, keeping the key's backoff attempt count."""
+        attempt = self._entries[key][2] if key in self._entries else -1
+        self._push(key, delay, attempt)
+
+    def trigger(self, key):
+        """Run a queued key as soon as possible, e.g. when one of its dependencies changed."""
+        if key in self._entries:
+            self._push(key, 0, self._entries[key][2])
+
+    def discard(self, key):
+        """Forget a key once it no longer needs retrying."""
+        self._entries.pop(key, None)
+
+    def _pop_due(self):
+        now = time.monotonic()
+        while self._heap:
+            due, sequence, key = self._heap[0]
+            entry = self._entries.get(key)
+            if entry is None or entry[1] != sequence:
+                heapq.heappop(self._heap)  # Superseded or discarded
+                continue
+            if due > now:
+                return None, due - now
+            heapq.heappop(self._heap)
+            return key, None
+        return None, None
+
+    async def run(self, callback, concurrency=16):
+        """Call `await callback(key)` for each key as it comes due, with bounded concurrency."""
+        self._wakeup = asyncio.Event()
+        slots = asyncio.Semaphore(concurrency)
+        running = set()
+        while True:
+            key, wait = self._pop_due()
+            if key is not None:
+                # The entry stays indexed so the callback can back off from its attempt count
+                await slots.acquire()
+                task = asyncio.get_running_loop().create_task(callback(key))
+                running.add(task)
+                task.add_done_callback(lambda t: (running.discard(t), slots.release()))
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,121 @@
+import asyncio
+import threading
+from kubernetes.client.rest import ApiException
+
+# Label put on every Secret the operator (or cert-manager on its behalf) writes
+MANAGED_LABEL = 'mtls.invoisight.com/managed'
+MANAGED_SECRET_NAMES = ('ca-chain-secret', 'root-ca-secret')
+MANAGED_SECRET_SUFFIXES = ('-intermediate-ca-secret', '-client-cert-secret')
+
+def is_managed_secret(name, labels=None):
+    """Check whether a Secret belongs to the operator, by label or by name pattern."""
+    if labels and labels.get(MANAGED_LABEL) == 'true':
+        return True
+    return name in MANAGED_SECRET_NAMES or name.endswith(MANAGED_SECRET_SUFFIXES)
+
+class SecretCache:
+    """Local store of operator-managed Secrets, fed by a watch stream."""
+
+    def __init__(self, core_v1_api=None):
+        self.core_v1_api = core_v1_api
+        self._secrets = {}  # (namespace, name) -> secret data
+        self._waiters = {}  # (namespace, name) -> [(future, condition on the data)]
+        self._reading = {}  # (namespace, name) -> [read-throughs in flight, whether an event arrived meanwhile]
+        self._lock = threading.Lock()
+
+    def apply_event(self, event_type, obj):
+        """Apply one watch event (ADDED, MODIFIED, DELETED or None for the initial listing)."""
+        metadata = obj.get('metadata', {})
+        name = metadata.get('name')
+        namespace = metadata.get('namespace')
+        if not name or not is_managed_secret(name, metadata.get('labels')):
+            return
+        key = (namespace, name)
+        waiters = []
+        with self._lock:
+            if key in self._reading:
+                self._reading[key][1] = True  # The watch is fresher than any read in flight
+            if event_type == 'DELETED':
+                self._secrets.pop(key, None)
+            else:
+                data = dict(obj.get('data') or {})
+                self._secrets[key] = data
+                pending = self._waiters.get(key, [])
+                waiters = [future for future, condition in pending if condition(data)]
+                if waiters:
+                    pending[:] = [(f, c) for f, c in pending if f not in waiters]
+        for future in waiters:
+            future.get_loop().call_soon_threadsafe(_resolve, future, data)
+
+    async def wait_for(self, name, namespace, condition, timeout):
+        """Wait until the watch delivers a Secret whose data satisfies `condition` and return its data."""
+        key = (namespace, name)
+        future = asyncio.get_running_loop().create_future()
+        with self._lock:
+            data = self._secrets.get(key)
+            if data is not None and condition(data):
+                return data
+            self._waiters.setdefault(key, []).append((future, condition))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            with self._lock:
+                pending = [(f, c) for f, c in self._waiters.get(key, []) if f is not future]
+                if pending:
+                    self._waiters[key] = pending
+                else:
+                    self._waiters.pop(key, None)
+
+    def get(self, name, namespace):
+        """Return the cached data of a Secret, or None if the watch hasn't seen it."""
+        with self._lock:
+            return self._secrets.get((namespace, name))
+
+    def names(self, namespace):
+        """Return the names of the cached Secrets in a namespace."""
+        with self._lock:
+            return [name for ns, name in self._secrets if ns == namespace]
+
+    def keys(self):
+        """Return the (namespace, name) of every cached Secret."""
+        with self._lock:
+            return set(self._secrets)
+
+    def remove(self, keys):
+        """Drop Secrets whose deletion the watch missed, such as while this replica stood by."""
+        with self._lock:
+            for key in keys:
+                self._secrets.pop(key, None)
+
+    def read(self, name, namespace):
+        """Return a Secret's data, reading through to the API server on a cache miss."""
+        data = self.get(name, namespace)
+        if data is not None or self.core_v1_api is None:
+            return data
+        key = (namespace, name)
+        with self._lock:
+            self._reading.setdefault(key, [0, False])[0] += 1
+        try:
+            secret = self.core_v1_api.read_namespaced_secret(name, namespace)
+            data = dict(secret.data or {})
+        except ApiException as e:
+            if e.status != 404:
+                raise
+            data = None
+        finally:
+            with self._lock:
+                reading = self._reading[key]
+                reading[0] -= 1
+                if not reading[0]:
+                    del self._reading[key]
+        with self._lock:
+            if reading[1]:
+                # A watch event landed meanwhile, a deletion included; it is at least as fresh
+                return self._secrets.get(key)
+            if data is None:
+                return None
+            return self._secrets.setdefault(key, data)
+
+def _resolve(future, data):
+    if not future.done():
+        future.set_result(data)
@@ -0,0 +1,77 @@
+"""Key generation and certificate signing, run in worker processes by the issuance service.
+
+Everything here is a plain function of bytes and builtins, so it can be
+pickled to a process pool. Keys and certificates are PEM-encoded the way
+cert-manager writes them: PKCS#1 for RSA, SEC1 for ECDSA, PKCS#8 for Ed25519.
+"""
+import datetime
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from cryptography.x509.oid import ExtendedKeyUsageOID, NameOID
+
+# cert-manager's ECDSA key sizes and the curves they select
+CURVES = {256: ec.SECP256R1, 384: ec.SECP384R1, 521: ec.SECP521R1}
+
+# cert-manager usages and the key usage flags they set
+KEY_USAGES = {
+    'digital signature': 'digital_signature',
+    'key encipherment': 'key_encipherment',
+    'cert sign': 'key_cert_sign',
+    'crl sign': 'crl_sign',
+}
+EXTENDED_KEY_USAGES = {
+    'client auth': ExtendedKeyUsageOID.CLIENT_AUTH,
+    'server auth': ExtendedKeyUsageOID.SERVER_AUTH,
+}
+
+def generate_key(algorithm, size=None):
+    """Generate a private key and return it PEM-encoded."""
+    if algorithm == 'RSA':
+        key = rsa.generate_private_key(public_exponent=65537, key_size=size)
+    elif algorithm == 'ECDSA':
+        key = ec.generate_private_key(CURVES[size]())
+    elif algorithm == 'Ed25519':
+        return ed25519.Ed25519PrivateKey.generate().private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    else:
+        raise ValueError(f"Unsupported key algorithm {algorithm}")
+    return key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL,
+                             serialization.NoEncryption())
+
+def issue(key_pem, common_name, is_ca, usages, issuer_cert_pem, issuer_key_pem, duration):
+    """Sign a certificate for a PEM private key with the issuer's certificate and key; return it PEM-encoded."""
+    key = serialization.load_pem_private_key(key_pem, password=None)
+    issuer_key = serialization.load_pem_private_key(issuer_key_pem, password=None)
+    issuer = x509.load_pem_x509_certificate(issuer_cert_pem)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    flags = dict.fromkeys(('digital_signature', 'content_commitment', 'key_encipherment', 'data_encipherment',
+                           'key_agreement', 'key_cert_sign', 'crl_sign', 'encipher_only', 'decipher_only'), False)
+    flags.update({KEY_USAGES[usage]: True for usage in usages if usage in KEY_USAGES})
+    builder = (x509.CertificateBuilder()
+               .subject_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)]))
+               .issuer_name(issuer.subject)
+               .public_key(key.public_key())
+               .serial_number(x509.random_serial_number())
+               .not_valid_before(now)
+               .not_valid_after(now + datetime.timedelta(seconds=duration))
+               .add_extension(x509.BasicConstraints(ca=is_ca, path_length=None), critical=True)
+               .add_extension(x509.KeyUsage(**flags), critical=True)
+               .add_extension(x509.SubjectKeyIdentifier.from_public_key(key.public_key()), critical=False)
+               .add_extension(x509.AuthorityKeyIdentifier.from_issuer_public_key(issuer_key.public_key()),
+                              critical=False))
+    extended = [EXTENDED_KEY_USAGES[usage] for usage in usages if usage in EXTENDED_KEY_USAGES]
+    if extended:
+        builder = builder.add_extension(x509.ExtendedKeyUsage(extended), critical=False)
+    if isinstance(issuer_key, ed25519.Ed25519PrivateKey):
+        algorithm = None  # Ed25519 signatures take no separate hash
+    elif isinstance(issuer_key, ec.EllipticCurvePrivateKey) and issuer_key.curve.key_size > 256:
+        algorithm = hashes.SHA384()
+    else:
+        algorithm = hashes.SHA256()
+    return builder.sign(issuer_key, algorithm).public_bytes(serialization.Encoding.PEM)
+
+def generate_and_issue(algorithm, size, common_name, is_ca, usages, issuer_cert_pem, issuer_key_pem, duration):
+    """Generate a key and sign a certificate for it in one worker round trip; return (key PEM, certificate PEM)."""
+    key_pem = generate_key(algorithm, size)
+    return key_pem, issue(key_pem, common_name, is_ca, usages, issuer_cert_pem, issuer_key_pem, duration)
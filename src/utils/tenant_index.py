@@ -0,0 +1,135 @@
+import threading
+
+# Annotations set by the bulk import CLI; the CA chain is published once per completed batch.
+# The batch size is informational: a batch is complete once all its remaining tenants have settled
+BATCH_ANNOTATION = 'mtls.invoisight.com/batch'
+BATCH_SIZE_ANNOTATION = 'mtls.invoisight.com/batch-size'
+
+# States a tenant settles in; phase InChain also counts as settled
+SETTLED_STATES = ('Failed', 'Active', 'Revoked')
+
+def _unsettled_batch(body):
+    """Return the bulk import batch of a tenant that is still provisioning, else None."""
+    batch = (body['metadata'].get('annotations') or {}).get(BATCH_ANNOTATION)
+    status = body['status']
+    if not batch or status.get('phase') == 'InChain' or status.get('state') in SETTLED_STATES:
+        return None
+    return batch
+
+def matches_selector(labels, selector):
+    """Check Kubernetes labels against a LabelSelector's matchLabels and matchExpressions."""
+    labels = labels or {}
+    for key, value in (selector.get('matchLabels') or {}).items():
+        if labels.get(key) != value:
+            return False
+    for expression in selector.get('matchExpressions') or []:
+        key, operator, values = expression['key'], expression['operator'], expression.get('values') or []
+        if operator == 'In' and labels.get(key) not in values:
+            return False
+        if operator == 'NotIn' and key in labels and labels[key] in values:
+            return False
+        if operator == 'Exists' and key not in labels:
+            return False
+        if operator == 'DoesNotExist' and key in labels:
+            return False
+    return True
+
+class TenantIndex:
+    """Local index of Tenant objects keyed by namespace and tenant name, fed by the Tenant watch."""
+
+    def __init__(self):
+        self._tenants = {}  # (namespace, spec.name) -> tenant body
+        self._unsettled = {}  # namespace -> {batch -> number of its tenants still provisioning}
+        self._lock = threading.Lock()
+
+    def _count(self, namespace, body, delta):
+        batch = body and _unsettled_batch(body)
+        if not batch:
+            return
+        batches = self._unsettled.setdefault(namespace, {})
+        batches[batch] = batches.get(batch, 0) + delta
+        if batches[batch] <= 0:
+            del batches[batch]
+        if not batches:
+            del self._unsettled[namespace]
+
+    def _replace(self, key, body):
+        """Store or remove an indexed body, keeping the batch counts in step. Called with the lock held."""
+        self._count(key[0], self._tenants.get(key), -1)
+        if body is None:
+            self._tenants.pop(key, None)
+        else:
+            self._tenants[key] = body
+            self._count(key[0], body, 1)
+
+    def apply_event(self, event_type, body):
+        """Apply one watch event (ADDED, MODIFIED, DELETED or None for the initial listing)."""
+        metadata = body.get('metadata', {})
+        spec = body.get('spec', {})
+        tenant_name = spec.get('name')
+        if not tenant_name:
+            return
+        key = (metadata.get('namespace'), tenant_name)
+        with self._lock:
+            if event_type == 'DELETED':
+                self._replace(key, None)
+            else:
+                self._replace(key, {
+                    'apiVersion': body.get('apiVersion'),
+                    'kind': body.get('kind'),
+                    'metadata': dict(metadata),
+                    'spec': dict(spec),
+                    'status': dict(body.get('status') or {}),
+                })
+
+    def get(self, namespace, tenant_name):
+        """Return the indexed Tenant body, or None if the watch hasn't seen it."""
+        with self._lock:
+            return self._tenants.get((namespace, tenant_name))
+
+    def list(self, namespace):
+        """Return all indexed Tenant bodies in a namespace."""
+        with self._lock:
+            return [body for (ns, _), body in self._tenants.items() if ns == namespace]
+
+    def select(self, namespace, names=(), selector=None):
+        """Return the indexed Tenant bodies in a namespace named in `names` or matching a label selector."""
+        names = set(names)
+        with self._lock:
+            return [body for (ns, tenant_name), body in self._tenants.items()
+                    if ns == namespace and (tenant_name in names or
+                                            selector and matches_selector(body['metadata'].get('labels'), selector))]
+
+    def keys(self):
+        """Return the (namespace, tenant name) of every indexed Tenant."""
+        with self._lock:
+            return set(self._tenants)
+
+    def remove(self, keys):
+        """Drop Tenants whose deletion the watch missed, such as while this replica stood by."""
+        with self._lock:
+            for key in keys:
+                self._replace(key, None)
+
+    def namespaces(self):
+        """Return the namespaces that contain at least one Tenant."""
+        with self._lock:
+            return {ns for ns, _ in self._tenants}
+
+    def batch_in_progress(self, namespace):
+        """Check whether a bulk import batch in the namespace still has tenants provisioning.
+
+        Only tenants that still exist count: the annotations stay on them after
+        the import, and deleted or never-applied members must not hold the chain.
+        """
+        with self._lock:
+            return namespace in self._unsettled
+
+    def update_status(self, namespace, tenant_name, status):
+        """Merge a status patch into the indexed copy ahead of the watch echoing it back."""
+        with self._lock:
+            body = self._tenants.get((namespace, tenant_name))
+            if body is not None:
+                self._count(namespace, body, -1)
+                body['status'] = {**body['status'], **status}
+                self._count(namespace, body, 1)
@@ -0,0 +1,46 @@
+"""Benchmark the bulk import/export CLI against the in-process fake API server.
+
+    python test/benchmark/bench_bulk_import.py --tenants 1000 --latency 0.005
+
+Reports import throughput per concurrency level and the API calls each
+run cost, then the calls needed to export every tenant.
+"""
+import argparse
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import bulk  # noqa: E402
+from fake_apiserver import FakeApiServer  # noqa: E402
+
+def run_import(tenant_count, concurrency, latency):
+    server = FakeApiServer(latency=latency)
+    tenants = [{'name': f'tenant-{i}', 'namespace': None, 'revoked': False} for i in range(tenant_count)]
+    results = bulk.import_tenants(server.custom_objects_api(), tenants, 'default',
+                                  concurrency=concurrency, out=io.StringIO())
+    assert not results['failed'], results['failed'][:3]
+    return server, results['elapsed']
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tenants', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.005, help='Simulated seconds per API call')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 16, 64])
+    args = parser.parse_args(argv)
+
+    print(f"Importing {args.tenants} tenants, {args.latency * 1000:.1f}ms per API call")
+    print(f"{'concurrency':>12} {'seconds':>9} {'tenants/s':>10} {'API calls':>10}")
+    server = None
+    for concurrency in args.concurrency:
+        server, elapsed = run_import(args.tenants, concurrency, args.latency)
+        print(f"{concurrency:>12} {elapsed:>9.2f} {args.tenants / elapsed:>10.1f} {sum(server.calls.values()):>10}")
+
+    server.calls.clear()
+    rows = bulk.export_tenants(server.custom_objects_api(), 'default')
+    print(f"Export of {len(rows)} tenants: {sum(server.calls.values())} API calls {dict(server.calls)}")
+
+if __name__ == '__main__':
+    main()
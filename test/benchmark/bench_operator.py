@@ -0,0 +1,256 @@
+"""Benchmark tenant onboarding and revocation through the operator's real handlers.
+
+    python test/benchmark/bench_operator.py --tenants 10 1000 10000 --latency 0.001 --issue-delay 0.05
+
+With --issuance operator the operator signs certificates itself and the
+fake cert-manager only provides the root CA.
+
+For each tenant count, creates every tenant at once against the fake API
+server and fake cert-manager, then revokes a sample of them, and reports:
+
+- onboarding throughput, and p50/p99 create latency (Tenant created until
+  its status reaches InChain)
+- seconds until the published ca-chain-secret contains every tenant
+- p50/p99 revocation latency (spec.revoked set until a published
+  ca-chain-secret no longer contains the tenant's intermediate CA)
+- API calls per tenant created and per tenant revoked
+- seconds for a RevocationList of --bulk-revocations other tenants to
+  remove them all from the published chain, and the chain writes it took
+- restart-to-ready time (a new operator instance warm and handling events),
+  time until it has settled, and the API calls the restart costs
+
+With --json the results are saved; with --baseline they are compared to
+saved results and the run fails if any regresses by more than --tolerance.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from fake_apiserver import FakeApiServer  # noqa: E402
+from fake_cert_manager import FakeCertManager  # noqa: E402
+from operator_harness import OperatorHarness, chain_pems, is_in_chain, pem_blocks, tenant_body  # noqa: E402
+
+NAMESPACE = 'bench'
+
+# Result fields compared against a baseline, and whether higher values are better
+GATED = {
+    'tenants_per_second': True,
+    'create_p99': False,
+    'calls_per_tenant': False,
+    'revoke_p99': False,
+    'calls_per_revocation': False,
+    'bulk_revoke': False,
+    'restart_settled': False,
+    'restart_calls': False,
+}
+
+def percentile(values, p):
+    ordered = sorted(values)
+    if not ordered:
+        return float('nan')
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+async def _wait(condition, timeout, what):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Timed out waiting for {what}")
+        await asyncio.sleep(0.01)
+
+async def run(tenant_count, latency, issue_delay, revocations, quiet_window, max_delay, timeout,
+              issuance='cert-manager', private_key=None, bulk_revocations=0):
+    server = FakeApiServer(latency=latency)
+    cert_manager = FakeCertManager(server, issue_delay=issue_delay)
+    cert_manager.install_root_ca(NAMESPACE)
+    harness = OperatorHarness(server, quiet_window=quiet_window, max_delay=max_delay, issuance=issuance)
+    await harness.start()
+    cert_manager.start(asyncio.get_running_loop())
+    await harness.idle()
+
+    created = {}  # tenant -> time created
+    ready = {}  # tenant -> seconds until InChain
+    chain_complete = []  # time the published chain first held every tenant
+    revoked_at = {}  # tenant -> time revoked
+    revoking = {}  # intermediate PEM -> tenant still published
+    revoke_latency = {}
+    chain_writes = []  # times the published chain changed
+
+    def observe(event_type, plural, obj):
+        now = time.monotonic()
+        name = obj['metadata']['name']
+        if plural == 'tenants' and name in created and name not in ready and is_in_chain(obj):
+            ready[name] = now - created[name]
+        elif plural == 'secrets' and name == 'ca-chain-secret' and event_type != 'DELETED':
+            chain_writes.append(now)
+            published = chain_pems(obj)
+            if not chain_complete and len(published) == tenant_count + 1:
+                chain_complete.append(now)
+            for pem, tenant in list(revoking.items()):
+                if pem not in published:
+                    revoke_latency[tenant] = now - revoked_at[tenant]
+                    del revoking[pem]
+
+    harness.subscribe(observe)
+    names = [f'tenant-{i}' for i in range(tenant_count)]
+
+    # Onboarding: create every tenant at once, as a bulk import would
+    server.calls.clear()
+    start = time.monotonic()
+    for name in names:
+        created[name] = time.monotonic()
+        server.put('tenants', tenant_body(name, NAMESPACE, private_key=private_key))
+    await _wait(lambda: len(ready) == tenant_count and chain_complete, timeout, 'onboarding')
+    onboarded = max(created[name] + ready[name] for name in names) - start
+    await harness.idle(timeout)
+    onboarding_calls = sum(server.calls.values())
+
+    # Revocation: revoke a sample of tenants at once and wait for each to leave the chain
+    sample = names[::max(1, tenant_count // revocations)][:revocations]
+    server.calls.clear()
+    for name in sample:
+        secret = server.get('secrets', NAMESPACE, f'{name}-intermediate-ca-secret')
+        revoking[pem_blocks(base64.b64decode(secret['data']['tls.crt']))[0]] = name
+        tenant = server.get('tenants', NAMESPACE, name)
+        tenant['spec']['revoked'] = True
+        revoked_at[name] = time.monotonic()
+        server.put('tenants', tenant)
+    await _wait(lambda: not revoking, timeout, 'revocations')
+    await harness.idle(timeout)
+    revocation_calls = sum(server.calls.values())
+
+    # Bulk revocation: one RevocationList for other tenants, which should leave the chain in one write
+    step = max(1, tenant_count // max(1, bulk_revocations))
+    bulk = [name for name in names[1::step] if name not in sample][:bulk_revocations]
+    bulk_seconds = bulk_writes = 0
+    if bulk:
+        for name in bulk:
+            secret = server.get('secrets', NAMESPACE, f'{name}-intermediate-ca-secret')
+            revoking[pem_blocks(base64.b64decode(secret['data']['tls.crt']))[0]] = name
+        writes_before = len(chain_writes)
+        bulk_start = time.monotonic()
+        for name in bulk:
+            revoked_at[name] = bulk_start
+        server.put('revocationlists', {
+            'apiVersion': 'mtls.invoisight.com/v1', 'kind': 'RevocationList',
+            'metadata': {'name': 'bench', 'namespace': NAMESPACE},
+            'spec': {'tenants': bulk}
+        })
+        await _wait(lambda: not revoking, timeout, 'bulk revocation')
+        bulk_seconds = time.monotonic() - bulk_start
+        await harness.idle(timeout)
+        bulk_writes = len(chain_writes) - writes_before
+        if not all(server.get('tenants', NAMESPACE, name)['status'].get('isRevoked') for name in bulk):
+            raise RuntimeError("The RevocationList left tenants unrevoked")
+
+    # Restart: replace the operator with a new instance against the same cluster state
+    errors = harness.errors
+    published = server.get('secrets', NAMESPACE, 'ca-chain-secret')['data']
+    harness.stop()
+    server.calls.clear()
+    restarted = time.monotonic()
+    harness = OperatorHarness(server, quiet_window=quiet_window, max_delay=max_delay, issuance=issuance)
+    await harness.start()
+    restart_ready = time.monotonic() - restarted
+    await harness.idle(timeout)
+    restart_settled = time.monotonic() - restarted
+    restart_calls = sum(server.calls.values())
+    harness.stop()
+    if server.get('secrets', NAMESPACE, 'ca-chain-secret')['data'] != published:
+        raise RuntimeError("The restarted operator changed the published CA chain")
+
+    errors = errors + harness.errors
+    if errors:
+        raise RuntimeError(f"{len(errors)} handler errors, e.g. {errors[:3]}")
+    return {
+        'tenants': tenant_count,
+        'tenants_per_second': tenant_count / onboarded,
+        'create_p50': percentile(ready.values(), 50),
+        'create_p99': percentile(ready.values(), 99),
+        'chain_complete': chain_complete[0] - start,
+        'calls_per_tenant': onboarding_calls / tenant_count,
+        'revoke_p50': percentile([revoke_latency[name] for name in sample], 50),
+        'revoke_p99': percentile([revoke_latency[name] for name in sample], 99),
+        'calls_per_revocation': revocation_calls / len(sample),
+        'bulk_revoke': bulk_seconds,
+        'bulk_writes': bulk_writes,
+        'restart_ready': restart_ready,
+        'restart_settled': restart_settled,
+        'restart_calls': restart_calls,
+    }
+
+def regressions(results, baseline, tolerance):
+    """Return a message for every gated result that is worse than the baseline by more than the tolerance."""
+    previous = {entry['tenants']: entry for entry in baseline}
+    messages = []
+    for result in results:
+        before = previous.get(result['tenants'])
+        if before is None:
+            continue
+        for field, higher_is_better in GATED.items():
+            if field not in before:
+                continue  # Saved before the field was measured
+            if higher_is_better and result[field] < before[field] * (1 - tolerance):
+                messages.append(f"{result['tenants']} tenants: {field} dropped from {before[field]:.3f} to {result[field]:.3f}")
+            elif not higher_is_better and result[field] > before[field] * (1 + tolerance):
+                messages.append(f"{result['tenants']} tenants: {field} rose from {before[field]:.3f} to {result[field]:.3f}")
+    return messages
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tenants', type=int, nargs='+', default=[10, 1000, 10000])
+    parser.add_argument('--latency', type=float, default=0.001, help='Simulated seconds per API call')
+    parser.add_argument('--issue-delay', type=float, default=0.05, help='Seconds cert-manager takes to issue')
+    parser.add_argument('--revocations', type=int, default=20, help='Tenants revoked per run')
+    parser.add_argument('--bulk-revocations', type=int, default=20, help='Tenants revoked by one RevocationList')
+    parser.add_argument('--issuance', choices=['cert-manager', 'operator'], default='cert-manager',
+                        help='Issue certificates through cert-manager or in the operator')
+    parser.add_argument('--private-key', choices=['RSA', 'ECDSA'], help="Tenants' spec.privateKey algorithm")
+    parser.add_argument('--quiet-window', type=float, default=0.2, help='CA chain writer quiet window')
+    parser.add_argument('--max-delay', type=float, default=1.0, help='CA chain writer maximum delay')
+    parser.add_argument('--timeout', type=float, default=900.0, help='Seconds allowed per stage')
+    parser.add_argument('--json', help='Save the results to this file')
+    parser.add_argument('--baseline', help='Fail if results regress against this saved run')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative regression')
+    parser.add_argument('--verbose', action='store_true', help='Show operator logs')
+    args = parser.parse_args(argv)
+    if not args.verbose:
+        logging.disable(logging.INFO)
+
+    print(f"{args.issuance} issuance, {args.latency * 1000:.1f}ms per API call, {args.issue_delay * 1000:.0f}ms to issue, "
+          f"chain quiet window {args.quiet_window}s, max delay {args.max_delay}s")
+    print(f"{'tenants':>8} {'tenants/s':>10} {'create p50':>11} {'create p99':>11} {'chain s':>8} "
+          f"{'calls/tenant':>13} {'revoke p50':>11} {'revoke p99':>11} {'calls/revoke':>13} "
+          f"{'bulk s':>7} {'bulk writes':>12} {'ready s':>8} {'settled s':>10} {'restart calls':>14}")
+    results = []
+    for tenant_count in args.tenants:
+        result = asyncio.run(run(tenant_count, args.latency, args.issue_delay, min(args.revocations, tenant_count),
+                                 args.quiet_window, args.max_delay, args.timeout, args.issuance,
+                                 args.private_key, min(args.bulk_revocations, tenant_count // 2)))
+        results.append(result)
+        print(f"{result['tenants']:>8} {result['tenants_per_second']:>10.1f} {result['create_p50']:>11.3f} "
+              f"{result['create_p99']:>11.3f} {result['chain_complete']:>8.2f} {result['calls_per_tenant']:>13.1f} "
+              f"{result['revoke_p50']:>11.3f} {result['revoke_p99']:>11.3f} {result['calls_per_revocation']:>13.1f} "
+              f"{result['bulk_revoke']:>7.3f} {result['bulk_writes']:>12} {result['restart_ready']:>8.2f} "
+              f"{result['restart_settled']:>10.2f} {result['restart_calls']:>14}",
+              flush=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            messages = regressions(results, json.load(f), args.tolerance)
+        for message in messages:
+            print(f"REGRESSION: {message}")
+        return 1 if messages else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
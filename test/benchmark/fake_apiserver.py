@@ -0,0 +1,200 @@
+"""In-memory stand-in for the subset of the Kubernetes API the operator and the bulk CLI use.
+
+Every call sleeps for a configurable latency and is counted by verb and
+resource, so benchmarks can report both throughput and API cost.
+"""
+import copy
+import threading
+import time
+from collections import Counter
+from kubernetes.client import ApiClient, V1ListMeta, V1ObjectMeta, V1Secret, V1SecretList
+from kubernetes.client.rest import ApiException
+
+_serializer = ApiClient()
+
+def _not_found(name):
+    return ApiException(status=404, reason=f'Not Found: {name}')
+
+def _page(items, limit=None, _continue=None, **kwargs):
+    """Cut one page out of a LIST result, the continue token being the offset of the next page."""
+    start = int(_continue or 0)
+    if not limit or start + limit >= len(items):
+        return items[start:], None
+    return items[start:start + limit], str(start + limit)
+
+def _merge(target, patch):
+    for key, value in patch.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = copy.deepcopy(value)
+
+class FakeApiServer:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()  # (verb, resource) -> count
+        self._objects = {}  # (plural, namespace, name) -> object dict
+        self._resource_version = 0
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def subscribe(self, listener):
+        """Call `listener(event_type, plural, obj)` after every change, like a watch."""
+        self._listeners.append(listener)
+
+    def _call(self, verb, resource):
+        with self._lock:
+            self.calls[(verb, resource)] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _store(self, plural, obj, event_type):
+        with self._lock:
+            self._resource_version += 1
+            obj['metadata']['resourceVersion'] = str(self._resource_version)
+            obj['metadata'].setdefault('uid', f'uid-{self._resource_version}')
+            key = (plural, obj['metadata']['namespace'], obj['metadata']['name'])
+            self._objects[key] = obj
+            snapshot = copy.deepcopy(obj)
+        for listener in self._listeners:
+            listener(event_type, plural, snapshot)
+        return copy.deepcopy(snapshot)
+
+    def _delete(self, plural, namespace, name):
+        with self._lock:
+            obj = self._objects.pop((plural, namespace, name), None)
+        if obj is None:
+            raise _not_found(name)
+        for listener in self._listeners:
+            listener('DELETED', plural, copy.deepcopy(obj))
+
+    def get(self, plural, namespace, name):
+        with self._lock:
+            obj = self._objects.get((plural, namespace, name))
+            return copy.deepcopy(obj) if obj is not None else None
+
+    def list(self, plural, namespace=None):
+        with self._lock:
+            return [copy.deepcopy(obj) for (p, ns, _), obj in self._objects.items()
+                    if p == plural and namespace in (None, ns)]
+
+    def put(self, plural, obj):
+        """Store an object directly, bypassing call accounting (used by fake controllers)."""
+        existing = self.get(plural, obj['metadata']['namespace'], obj['metadata']['name'])
+        return self._store(plural, copy.deepcopy(obj), 'MODIFIED' if existing else 'ADDED')
+
+    def core_v1_api(self):
+        return FakeCoreV1Api(self)
+
+    def custom_objects_api(self):
+        return FakeCustomObjectsApi(self)
+
+class FakeCoreV1Api:
+    def __init__(self, server):
+        self.server = server
+
+    @staticmethod
+    def _to_secret(obj):
+        metadata = obj['metadata']
+        return V1Secret(
+            metadata=V1ObjectMeta(
+                name=metadata['name'],
+                namespace=metadata['namespace'],
+                labels=metadata.get('labels'),
+                annotations=metadata.get('annotations'),
+                resource_version=metadata.get('resourceVersion'),
+                uid=metadata.get('uid')
+            ),
+            data=obj.get('data')
+        )
+
+    def read_namespaced_secret(self, name, namespace, **kwargs):
+        self.server._call('get', 'secrets')
+        obj = self.server.get('secrets', namespace, name)
+        if obj is None:
+            raise _not_found(name)
+        return self._to_secret(obj)
+
+    def list_namespaced_secret(self, namespace, **kwargs):
+        self.server._call('list', 'secrets')
+        return V1SecretList(items=[self._to_secret(o) for o in self.server.list('secrets', namespace)])
+
+    def list_secret_for_all_namespaces(self, **kwargs):
+        self.server._call('list', 'secrets')
+        items, token = _page(self.server.list('secrets'), **kwargs)
+        return V1SecretList(items=[self._to_secret(o) for o in items], metadata=V1ListMeta(_continue=token))
+
+    def create_namespaced_secret(self, namespace, body, **kwargs):
+        self.server._call('create', 'secrets')
+        obj = _serializer.sanitize_for_serialization(body)
+        obj.setdefault('metadata', {})['namespace'] = namespace
+        if self.server.get('secrets', namespace, obj['metadata']['name']) is not None:
+            raise ApiException(status=409, reason='AlreadyExists')
+        return self._to_secret(self.server._store('secrets', obj, 'ADDED'))
+
+    def replace_namespaced_secret(self, name, namespace, body, **kwargs):
+        self.server._call('update', 'secrets')
+        if self.server.get('secrets', namespace, name) is None:
+            raise _not_found(name)
+        obj = _serializer.sanitize_for_serialization(body)
+        obj.setdefault('metadata', {}).update({'name': name, 'namespace': namespace})
+        return self._to_secret(self.server._store('secrets', obj, 'MODIFIED'))
+
+    def delete_namespaced_secret(self, name, namespace, **kwargs):
+        self.server._call('delete', 'secrets')
+        self.server._delete('secrets', namespace, name)
+
+class FakeCustomObjectsApi:
+    def __init__(self, server):
+        self.server = server
+
+    def get_namespaced_custom_object(self, group, version, namespace, plural, name, **kwargs):
+        self.server._call('get', plural)
+        obj = self.server.get(plural, namespace, name)
+        if obj is None:
+            raise _not_found(name)
+        return obj
+
+    def list_namespaced_custom_object(self, group, version, namespace, plural, **kwargs):
+        self.server._call('list', plural)
+        return {'items': self.server.list(plural, namespace), 'metadata': {}}
+
+    def list_cluster_custom_object(self, group, version, plural, **kwargs):
+        self.server._call('list', plural)
+        items, token = _page(self.server.list(plural), **kwargs)
+        return {'items': items, 'metadata': {'continue': token} if token else {}}
+
+    def create_namespaced_custom_object(self, group, version, namespace, plural, body, **kwargs):
+        self.server._call('create', plural)
+        obj = copy.deepcopy(body)
+        obj['metadata']['namespace'] = namespace
+        if self.server.get(plural, namespace, obj['metadata']['name']) is not None:
+            raise ApiException(status=409, reason='AlreadyExists')
+        return self.server._store(plural, obj, 'ADDED')
+
+    def patch_namespaced_custom_object(self, group, version, namespace, plural, name, body, **kwargs):
+        # Server-side apply creates missing objects; other patch types require one
+        is_apply = kwargs.get('_content_type') == 'application/apply-patch+yaml'
+        self.server._call('apply' if is_apply else 'patch', plural)
+        obj = self.server.get(plural, namespace, name)
+        if obj is None:
+            if not is_apply:
+                raise _not_found(name)
+            obj = {'metadata': {'name': name, 'namespace': namespace}}
+            event_type = 'ADDED'
+        else:
+            event_type = 'MODIFIED'
+        _merge(obj, body)
+        return self.server._store(plural, obj, event_type)
+
+    def patch_namespaced_custom_object_status(self, group, version, namespace, plural, name, body, **kwargs):
+        self.server._call('patch', f'{plural}/status')
+        obj = self.server.get(plural, namespace, name)
+        if obj is None:
+            raise _not_found(name)
+        _merge(obj, {'status': body.get('status', {})})
+        return self.server._store(plural, obj, 'MODIFIED')
+
+    def delete_namespaced_custom_object(self, group, version, namespace, plural, name, **kwargs):
+        self.server._call('delete', plural)
+        self.server._delete(plural, namespace, name)
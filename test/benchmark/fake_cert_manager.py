@@ -0,0 +1,100 @@
+"""Stand-in for cert-manager on top of the fake API server.
+
+Watches Certificates and, after a configurable delay, writes their Secret
+with a freshly signed certificate and marks the Certificate Ready, the way
+cert-manager's issuing controller would. Setting the Issuing condition, as
+`cmctl renew` does, re-issues a certificate. Certificates are ECDSA P-256 and
+share one key, so issuing thousands of them stays cheap.
+"""
+import base64
+import datetime
+import hashlib
+import json
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+def _b64(data):
+    return base64.b64encode(data).decode('ascii')
+
+class FakeCertManager:
+    def __init__(self, server, issue_delay=0.05, duration=datetime.timedelta(days=90)):
+        self.server = server
+        self.issue_delay = issue_delay
+        self.duration = duration
+        self.issued = 0
+        self._loop = None
+        self._specs = {}  # (namespace, name) -> hash of the last issued spec
+        self._key = ec.generate_private_key(ec.SECP256R1())
+        self._key_pem = self._key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+        self._root_pem = self._sign('root-ca', is_ca=True)
+
+    def start(self, loop):
+        """Start issuing on the given event loop."""
+        self._loop = loop
+        self.server.subscribe(self._on_change)
+
+    def install_root_ca(self, namespace):
+        """Store the root CA secret the operator expects in a tenant namespace."""
+        self.server.put('secrets', {
+            'metadata': {'name': 'root-ca-secret', 'namespace': namespace},
+            'type': 'kubernetes.io/tls',
+            'data': {'tls.crt': _b64(self._root_pem), 'tls.key': _b64(self._key_pem)}
+        })
+
+    def _sign(self, common_name, is_ca=False):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+        issuer = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'root-ca')])
+        cert = (x509.CertificateBuilder()
+                .subject_name(name)
+                .issuer_name(issuer)
+                .public_key(self._key.public_key())
+                .serial_number(x509.random_serial_number())
+                .not_valid_before(now)
+                .not_valid_after(now + self.duration)
+                .add_extension(x509.BasicConstraints(ca=is_ca, path_length=None), critical=True)
+                .sign(self._key, hashes.SHA256()))
+        return cert.public_bytes(serialization.Encoding.PEM)
+
+    def _on_change(self, event_type, plural, obj):
+        if plural != 'certificates' or event_type == 'DELETED':
+            return
+        # Like cert-manager, only issue when the spec changed or a renewal was triggered,
+        # not on our own status updates
+        metadata = obj['metadata']
+        key = (metadata['namespace'], metadata['name'])
+        digest = hashlib.sha256(json.dumps(obj.get('spec'), sort_keys=True).encode('utf-8')).hexdigest()
+        conditions = (obj.get('status') or {}).get('conditions', [])
+        issuing = any(c.get('type') == 'Issuing' and c.get('status') == 'True' for c in conditions)
+        if self._specs.get(key) == digest and not issuing:
+            return
+        self._specs[key] = digest
+        self._loop.call_soon_threadsafe(self._loop.call_later, self.issue_delay, self._issue, obj)
+
+    def _issue(self, certificate):
+        metadata = certificate['metadata']
+        spec = certificate.get('spec') or {}
+        pem = self._sign(spec.get('commonName') or metadata['name'], is_ca=spec.get('isCA', False))
+        self.server.put('secrets', {
+            'metadata': {
+                'name': spec['secretName'],
+                'namespace': metadata['namespace'],
+                'labels': dict((spec.get('secretTemplate') or {}).get('labels') or {})
+            },
+            'type': 'kubernetes.io/tls',
+            # Like cert-manager's CA issuer, tls.crt carries the issuing chain after the certificate
+            'data': {'tls.crt': _b64(pem + self._root_pem), 'tls.key': _b64(self._key_pem),
+                     'ca.crt': _b64(self._root_pem)}
+        })
+        current = self.server.get('certificates', metadata['namespace'], metadata['name'])
+        if current is not None:
+            not_after = datetime.datetime.now(datetime.timezone.utc) + self.duration
+            current['status'] = {
+                'conditions': [{'type': 'Ready', 'status': 'True'}],
+                'notAfter': not_after.strftime('%Y-%m-%dT%H:%M:%SZ')
+            }
+            self.server.put('certificates', current)
+        self.issued += 1
@@ -0,0 +1,248 @@
+"""Run the operator's real services and handlers against the fake API server.
+
+The harness wires the services the way `main.configure` does and feeds the
+fake server's changes to the controller handlers the way kopf would: one
+worker per object, processing that object's events in order. kopf's own
+bookkeeping patches (finalizers, last-handled configuration) and posted
+events are counted as API calls but not applied.
+"""
+import asyncio
+import base64
+import collections
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+import kopf  # noqa: E402
+from config import Config  # noqa: E402
+from controllers import tenant_controller, secret_controller, certificate_controller, revocation_controller  # noqa: E402
+from services.certificate_service import CertificateService  # noqa: E402
+from services.ca_chain_service import CAChainService  # noqa: E402
+from services.provisioning_service import ProvisioningService, PHASE_IN_CHAIN  # noqa: E402
+from services.renewal_service import RenewalService  # noqa: E402
+from services.issuance_service import IssuanceService  # noqa: E402
+from services.revocation_service import RevocationService  # noqa: E402
+from services.warm_start_service import WarmStartService  # noqa: E402
+from utils.secret_cache import SecretCache, is_managed_secret  # noqa: E402
+from utils.tenant_index import TenantIndex  # noqa: E402
+
+PEM_HEADER = b'-----BEGIN CERTIFICATE-----'
+
+class OperatorHarness:
+    def __init__(self, server, quiet_window=Config.CHAIN_QUIET_WINDOW, max_delay=Config.CHAIN_MAX_DELAY,
+                 shards=Config.CHAIN_SHARDS, issuance=Config.ISSUANCE_MODE):
+        self.server = server
+        self.issuance = issuance
+        self.shards = shards
+        self.quiet_window = quiet_window
+        self.max_delay = max_delay
+        self.errors = []
+        self._loop = None
+        self._queues = {}  # (plural, namespace, name) -> pending events for that object's worker
+        self._tasks = set()
+        self._revoked = {}  # (namespace, name) -> last handled spec.revoked, like kopf's last-handled state
+        self._listeners = []
+        self._posting = {}  # kopf's event posting functions, replaced while the harness runs
+
+    async def start(self):
+        """Wire the services and controllers and start dispatching watch events."""
+        self._loop = asyncio.get_running_loop()
+
+        # kopf.info() and kopf.warn() post through a queue only kopf's reactor sets up. Count each
+        # as the event kopf would create instead; main posts from the INFO level up, so all of them
+        for name in ('info', 'warn'):
+            self._posting[name] = getattr(kopf, name)
+            setattr(kopf, name, self._post_event)
+
+        core_v1_api = self.server.core_v1_api()
+        custom_objects_api = self.server.custom_objects_api()
+
+        self.secret_cache = SecretCache(core_v1_api)
+        self.tenant_index = TenantIndex()
+        cert_service = CertificateService(core_v1_api, custom_objects_api)
+        self.ca_chain_service = CAChainService(
+            core_v1_api, custom_objects_api, self.secret_cache,
+            quiet_window=self.quiet_window, max_delay=self.max_delay,
+            hold=self.tenant_index.batch_in_progress, max_hold=Config.BATCH_MAX_HOLD, shards=self.shards,
+            tenants=self.tenant_index.list
+        )
+        self.ca_chain_service.writer.start()
+        self.renewal_service = RenewalService(custom_objects_api, rate=Config.RENEWAL_RATE,
+                                              fraction=Config.RENEWAL_FRACTION)
+        self.renewal_service.start()
+        self.issuance_service = None
+        if self.issuance == 'operator':
+            self.issuance_service = IssuanceService(core_v1_api, self.secret_cache, workers=Config.ISSUANCE_WORKERS,
+                                                    spare_keys=Config.SPARE_KEYS)
+            self.issuance_service.start()
+        self.provisioning_service = ProvisioningService(
+            custom_objects_api, cert_service, self.ca_chain_service, self.secret_cache, self.tenant_index,
+            self.renewal_service,
+            retry_base_delay=Config.RETRY_BASE_DELAY, retry_max_delay=Config.RETRY_MAX_DELAY,
+            issuance_service=self.issuance_service
+        )
+        self.provisioning_service.start()
+        if self.issuance_service is not None:
+            self.renewal_service.reissue = self.provisioning_service.reissue
+
+        tenant_controller.init_controller(core_v1_api, custom_objects_api, self.ca_chain_service,
+                                          self.provisioning_service, self.tenant_index)
+        secret_controller.init_controller(self.secret_cache, self.provisioning_service, self.ca_chain_service)
+        certificate_controller.init_controller(self.provisioning_service)
+        revocation_controller.init_controller(
+            RevocationService(custom_objects_api, self.ca_chain_service, self.secret_cache, self.tenant_index))
+
+        # Warm the local stores before any handler runs, like main.configure
+        warm_start = WarmStartService(core_v1_api, custom_objects_api, page_size=Config.LIST_PAGE_SIZE)
+        await asyncio.to_thread(warm_start.load, self.tenant_index, self.secret_cache, cert_service)
+
+        # Then replay what already exists, like the watches' initial listing
+        for plural in ('tenants', 'secrets'):
+            for obj in self.server.list(plural):
+                self._enqueue(None, plural, obj)
+        self.server.subscribe(self._on_change)
+
+    def stop(self):
+        """Stop handling events and cancel the services' background tasks, like an operator shutdown."""
+        self.server._listeners.remove(self._on_change)
+        tasks = [self.provisioning_service._retry_task, self.renewal_service._task,
+                 *self.ca_chain_service.writer._tasks.values(), *self._tasks]
+        for task in tasks:
+            if task is not None:
+                task.cancel()
+        if self.issuance_service is not None:
+            self.issuance_service.stop()
+        for name, post in self._posting.items():
+            setattr(kopf, name, post)
+
+    def subscribe(self, listener):
+        """Call `listener(event_type, plural, obj)` on the event loop after every change."""
+        self._listeners.append(listener)
+
+    def _spawn(self, coro):
+        task = self._loop.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _post_event(self, body, *, reason, message=''):
+        self._spawn(self._kopf_call('create', 'events'))
+
+    async def _kopf_call(self, verb, resource):
+        """Account for an API call kopf itself would make."""
+        await asyncio.to_thread(self.server._call, verb, resource)
+
+    def _on_change(self, event_type, plural, obj):
+        self._loop.call_soon_threadsafe(self._enqueue, event_type, plural, obj)
+
+    def _enqueue(self, event_type, plural, obj):
+        for listener in self._listeners:
+            listener(event_type, plural, obj)
+        metadata = obj['metadata']
+        key = (plural, metadata['namespace'], metadata['name'])
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = collections.deque()
+            self._spawn(self._worker(key, queue))
+        queue.append((event_type, obj))
+
+    async def _worker(self, key, queue):
+        try:
+            while queue:
+                event_type, obj = queue.popleft()
+                try:
+                    await self._dispatch(event_type, key[0], obj)
+                except Exception as e:
+                    self.errors.append(f"{key}: {e!r}")
+        finally:
+            del self._queues[key]
+
+    async def _dispatch(self, event_type, plural, obj):
+        event = {'type': event_type, 'object': obj}
+        metadata = obj['metadata']
+        if plural == 'secrets':
+            if is_managed_secret(metadata['name'], metadata.get('labels')):
+                await secret_controller.track_secret(event=event, body=obj, meta=metadata)
+        elif plural == 'certificates':
+            if certificate_controller._is_tenant_certificate(metadata['name']):
+                await certificate_controller.track_certificate(event=event, meta=metadata)
+        elif plural == 'tenants':
+            await self._dispatch_tenant(event, obj)
+        elif plural == 'revocationlists' and event_type == 'ADDED':
+            patch = kopf.Patch()
+            await revocation_controller.apply_revocation_list(spec=obj['spec'], meta=metadata, body=obj, patch=patch)
+            await asyncio.to_thread(
+                self.server.custom_objects_api().patch_namespaced_custom_object_status,
+                Config.TENANT_GROUP, Config.TENANT_VERSION,
+                metadata['namespace'], 'revocationlists', metadata['name'], {'status': dict(patch.get('status', {}))}
+            )
+
+    async def _dispatch_tenant(self, event, body):
+        await tenant_controller.track_tenant(event=event, body=body)
+        metadata = body['metadata']
+        spec = body['spec']
+        status = body.get('status') or {}
+        key = (metadata['namespace'], metadata['name'])
+        if event['type'] == 'DELETED':
+            self._revoked.pop(key, None)
+            await tenant_controller.delete_tenant(spec=spec, meta=metadata, body=body)
+            await self._kopf_call('patch', 'tenants')  # Finalizer removal
+        elif key not in self._revoked:
+            self._revoked[key] = spec.get('revoked', False)
+            if event['type'] is None and (status.get('phase') or status.get('state')):
+                await tenant_controller.resume_tenant(spec=spec, meta=metadata, status=status, body=body)
+                return
+            await self._kopf_call('patch', 'tenants')  # Finalizer
+            await tenant_controller.create_tenant(spec=spec, meta=metadata, body=body)
+            await self._kopf_call('patch', 'tenants')  # Last-handled configuration
+        elif self._revoked[key] != spec.get('revoked', False):
+            old, new = self._revoked[key], spec.get('revoked', False)
+            self._revoked[key] = new
+            patch = kopf.Patch()
+            await tenant_controller.handle_revocation_request(
+                spec=spec, status=status, old=old, new=new, patch=patch, meta=metadata, body=body
+            )
+            # kopf sends the handler's status patch together with its own bookkeeping
+            await asyncio.to_thread(
+                self.server.custom_objects_api().patch_namespaced_custom_object_status,
+                Config.TENANT_GROUP, Config.TENANT_VERSION,
+                metadata['namespace'], 'tenants', metadata['name'], {'status': dict(patch.get('status', {}))}
+            )
+
+    async def idle(self, timeout=60.0):
+        """Wait until no watch events are being handled and no chain publication is pending."""
+        deadline = time.monotonic() + timeout
+        writer = self.ca_chain_service.writer
+        while time.monotonic() < deadline:
+            if not self._queues and not writer.pending() and not writer._tasks:
+                return True
+            await asyncio.sleep(0.01)
+        return False
+
+def tenant_body(name, namespace, revoked=False, private_key=None):
+    """Return a Tenant as a client would create it."""
+    body = {
+        'apiVersion': f'{Config.TENANT_GROUP}/{Config.TENANT_VERSION}',
+        'kind': 'Tenant',
+        'metadata': {'name': name, 'namespace': namespace, 'creationTimestamp': _timestamp()},
+        'spec': {'name': name, 'revoked': revoked}
+    }
+    if private_key:
+        body['spec']['privateKey'] = {'algorithm': private_key}
+    return body
+
+def pem_blocks(pem):
+    """Split PEM data into its certificate blocks, without trailing newlines."""
+    return [PEM_HEADER + block.rstrip(b'\n') for block in pem.split(PEM_HEADER)[1:]]
+
+def chain_pems(secret):
+    """Return the certificate blocks published in a ca-chain-secret."""
+    return set(pem_blocks(base64.b64decode((secret.get('data') or {}).get('ca.crt', ''))))
+
+def is_in_chain(tenant):
+    return (tenant.get('status') or {}).get('phase') == PHASE_IN_CHAIN
+
+def _timestamp():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
@@ -0,0 +1,122 @@
+"""ChainWriter coalescing, holds and flushes.
+
+    python -m pytest test/unit
+"""
+import asyncio
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+from services import chain_writer  # noqa: E402
+from services.chain_writer import ChainWriter  # noqa: E402
+
+KEY = ('tenants', None)
+
+class Publisher:
+    """Records publications, optionally failing the first ones."""
+
+    def __init__(self, failures=0):
+        self.published = []
+        self.failures = failures
+
+    def __call__(self, key):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError('API server unavailable')
+        self.published.append(key)
+        return f"bundle-{len(self.published)}"
+
+class ChainWriterTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(chain_writer, 'HOLD_CHECK_INTERVAL', 0.01)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_marks_within_the_quiet_window_coalesce(self):
+        async def scenario():
+            publish = Publisher()
+            writer = ChainWriter(publish, quiet_window=0.05, max_delay=1.0)
+            writer.start()
+            for _ in range(10):
+                writer.mark_dirty(KEY)
+                writer.mark_dirty(('other', None))
+                await asyncio.sleep(0.01)
+            self.assertEqual(publish.published, [])
+            self.assertEqual(writer.pending(), 2)
+            await asyncio.sleep(0.15)
+            self.assertEqual(sorted(publish.published, key=str), sorted([KEY, ('other', None)], key=str))
+            self.assertEqual(writer.pending(), 0)
+        asyncio.run(scenario())
+
+    def test_max_delay_bounds_a_busy_chain(self):
+        async def scenario():
+            publish = Publisher()
+            writer = ChainWriter(publish, quiet_window=0.05, max_delay=0.1)
+            writer.start()
+            for _ in range(25):
+                writer.mark_dirty(KEY)
+                await asyncio.sleep(0.01)
+            self.assertGreaterEqual(len(publish.published), 1)
+        asyncio.run(scenario())
+
+    def test_hold_defers_until_released(self):
+        async def scenario():
+            publish = Publisher()
+            held = {'value': True}
+            writer = ChainWriter(publish, quiet_window=0.01, max_delay=0.01, hold=lambda key: held['value'])
+            writer.start()
+            writer.mark_dirty(KEY)
+            await asyncio.sleep(0.1)
+            self.assertEqual(publish.published, [])
+            held['value'] = False
+            await asyncio.sleep(0.05)
+            self.assertEqual(publish.published, [KEY])
+        asyncio.run(scenario())
+
+    def test_urgent_marks_and_max_hold_are_not_held(self):
+        async def scenario():
+            publish = Publisher()
+            writer = ChainWriter(publish, quiet_window=0.01, max_delay=0.01, hold=lambda key: True, max_hold=0.1)
+            writer.start()
+            writer.mark_dirty(KEY, urgent=True)
+            await asyncio.sleep(0.05)
+            self.assertEqual(publish.published, [KEY])
+            writer.mark_dirty(KEY)
+            await asyncio.sleep(0.05)
+            self.assertEqual(publish.published, [KEY])
+            await asyncio.sleep(0.1)
+            self.assertEqual(publish.published, [KEY, KEY])
+        asyncio.run(scenario())
+
+    def test_flush_publishes_at_once_and_absorbs_pending_marks(self):
+        async def scenario():
+            publish = Publisher()
+            writer = ChainWriter(publish, quiet_window=0.05, max_delay=1.0)
+            writer.start()
+            writer.mark_dirty(KEY)
+            await asyncio.sleep(0)
+            self.assertEqual(await writer.flush(KEY), 'bundle-1')
+            await asyncio.sleep(0.1)
+            self.assertEqual(publish.published, [KEY])
+        asyncio.run(scenario())
+
+    def test_failed_publication_is_retried(self):
+        async def scenario():
+            publish = Publisher(failures=1)
+            writer = ChainWriter(publish, quiet_window=0.01, max_delay=0.02)
+            writer.start()
+            writer.mark_dirty(KEY)
+            await asyncio.sleep(0.1)
+            self.assertEqual(publish.published, [KEY])
+        asyncio.run(scenario())
+
+    def test_unstarted_writer_publishes_right_away(self):
+        publish = Publisher()
+        ChainWriter(publish, quiet_window=1.0, max_delay=1.0).mark_dirty(KEY)
+        self.assertEqual(publish.published, [KEY])
+
+if __name__ == '__main__':
+    unittest.main()
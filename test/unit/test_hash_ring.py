@@ -0,0 +1,44 @@
+"""HashRing ownership, and how little moves when members change.
+
+    python -m pytest test/unit
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+from utils.hash_ring import HashRing  # noqa: E402
+
+NAMESPACES = [f"tenants-{i}" for i in range(1000)]
+
+def owners(ring):
+    return {ns: ring.owner(ns) for ns in NAMESPACES}
+
+class HashRingTest(unittest.TestCase):
+    def test_empty_ring_owns_nothing(self):
+        self.assertIsNone(HashRing(()).owner('tenants'))
+
+    def test_ownership_is_stable_and_spread(self):
+        ring = HashRing(['a', 'b', 'c'])
+        self.assertEqual(owners(ring), owners(HashRing(['c', 'a', 'b'])))
+        counts = {member: list(owners(ring).values()).count(member) for member in ring.members}
+        for count in counts.values():
+            self.assertGreater(count, len(NAMESPACES) / 3 / 2)
+
+    def test_joining_member_only_takes_namespaces(self):
+        before = owners(HashRing(['a', 'b', 'c']))
+        after = owners(HashRing(['a', 'b', 'c', 'd']))
+        moved = [ns for ns in NAMESPACES if before[ns] != after[ns]]
+        self.assertTrue(moved)
+        self.assertTrue(all(after[ns] == 'd' for ns in moved))
+        self.assertLess(len(moved), len(NAMESPACES) / 2)
+
+    def test_leaving_member_only_hands_over_its_namespaces(self):
+        before = owners(HashRing(['a', 'b', 'c']))
+        after = owners(HashRing(['a', 'c']))
+        moved = [ns for ns in NAMESPACES if before[ns] != after[ns]]
+        self.assertEqual(sorted(moved), sorted(ns for ns in NAMESPACES if before[ns] == 'b'))
+
+if __name__ == '__main__':
+    unittest.main()
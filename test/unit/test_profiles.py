@@ -0,0 +1,32 @@
+"""Duration parsing and profile validation.
+
+    python -m pytest test/unit
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+from utils.profiles import CertificateProfiles, parse_duration  # noqa: E402
+
+class ParseDurationTest(unittest.TestCase):
+    def test_go_durations(self):
+        self.assertEqual(parse_duration('2160h'), 2160 * 3600)
+        self.assertEqual(parse_duration('1h30m'), 5400)
+        self.assertEqual(parse_duration('90s'), 90)
+        self.assertEqual(parse_duration('1.5h'), 5400)
+
+    def test_invalid_durations(self):
+        for value in ('', '10', '10d', '1h 30m', 'h', '-1h', '1h30'):
+            with self.assertRaises(ValueError, msg=value):
+                parse_duration(value)
+
+    def test_profiles_with_invalid_durations_fail_at_startup(self):
+        with self.assertRaises(ValueError):
+            CertificateProfiles({'short': {'duration': '30 days'}})
+        with self.assertRaises(ValueError):
+            CertificateProfiles(default='missing')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+"""RetryQueue backoff, scheduling and discarding.
+
+    python -m pytest test/unit
+"""
+import asyncio
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+from utils.retry_queue import RetryQueue  # noqa: E402
+
+def delay_of(queue, key):
+    """Return how far ahead a queued key is due."""
+    return queue._entries[key][0] - time.monotonic()
+
+class RetryQueueTest(unittest.TestCase):
+    def test_backoff_doubles_with_jitter_up_to_the_maximum(self):
+        queue = RetryQueue(base_delay=1.0, max_delay=8.0)
+        for attempt, ceiling in enumerate([1, 2, 4, 8, 8, 8]):
+            self.assertEqual(queue.backoff('tenant'), attempt)
+            delay = delay_of(queue, 'tenant')
+            self.assertGreaterEqual(delay, ceiling / 2 - 0.1)
+            self.assertLessEqual(delay, ceiling)
+        self.assertEqual(len(queue), 1)
+
+    def test_schedule_keeps_the_attempt_count(self):
+        queue = RetryQueue(base_delay=1.0, max_delay=100.0)
+        queue.backoff('tenant')
+        queue.backoff('tenant')
+        queue.schedule('tenant', 60)
+        self.assertEqual(queue.backoff('tenant'), 2)
+
+    def test_discard_forgets_the_key_and_its_attempts(self):
+        queue = RetryQueue()
+        queue.backoff('tenant')
+        queue.backoff('tenant')
+        queue.discard('tenant')
+        self.assertNotIn('tenant', queue)
+        self.assertEqual(len(queue), 0)
+        self.assertEqual(queue.backoff('tenant'), 0)
+
+    def test_trigger_only_brings_queued_keys_forward(self):
+        queue = RetryQueue()
+        queue.trigger('unknown')
+        self.assertNotIn('unknown', queue)
+        queue.schedule('tenant', 60)
+        queue.trigger('tenant')
+        self.assertLessEqual(delay_of(queue, 'tenant'), 0)
+
+    def test_run_calls_due_keys_in_order_and_skips_discarded_ones(self):
+        async def scenario():
+            queue = RetryQueue()
+            called = []
+            async def callback(key):
+                called.append(key)
+                queue.discard(key)
+            queue.schedule('second', 0.02)
+            queue.schedule('first', 0.01)
+            queue.schedule('discarded', 0.01)
+            queue.discard('discarded')
+            queue.schedule('later', 60)
+            task = asyncio.ensure_future(queue.run(callback))
+            await asyncio.sleep(0.1)
+            queue.trigger('later')  # Wakes the queue up before the due time
+            await asyncio.sleep(0.05)
+            task.cancel()
+            self.assertEqual(called, ['first', 'second', 'later'])
+            self.assertEqual(len(queue), 0)
+        asyncio.run(scenario())
+
+if __name__ == '__main__':
+    unittest.main()
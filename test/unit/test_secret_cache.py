@@ -0,0 +1,209 @@
+"""SecretCache driven by a fake Secret watch stream.
+
+    python -m pytest test/unit
+"""
+import asyncio
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+from kubernetes.client import V1ObjectMeta, V1Secret  # noqa: E402
+from kubernetes.client.rest import ApiException  # noqa: E402
+from controllers import secret_controller  # noqa: E402
+from services.ca_chain_service import CAChainService  # noqa: E402
+from utils.secret_cache import MANAGED_LABEL, SecretCache  # noqa: E402
+
+NAMESPACE = 'tenants'
+
+def secret_event(event_type, name, data=None, labels=None):
+    """Return a watch event for a Secret, as kopf delivers it; None is the initial listing."""
+    return {'type': event_type,
+            'object': {'metadata': {'name': name, 'namespace': NAMESPACE, 'labels': labels}, 'data': data}}
+
+class FakeWatch:
+    """A Secret watch stream whose events are pushed by the test."""
+
+    def __init__(self):
+        self._events = asyncio.Queue()
+
+    def push(self, event):
+        self._events.put_nowait(event)
+
+    def close(self):
+        self._events.put_nowait(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        event = await self._events.get()
+        if event is None:
+            raise StopAsyncIteration
+        return event
+
+async def pump(stream):
+    """Feed every watch event to the secret controller, one after the other like kopf's worker."""
+    async for event in stream:
+        body = event['object']
+        await secret_controller.track_secret(event=event, body=body, meta=body['metadata'])
+
+class FakeProvisioningService:
+    def __init__(self):
+        self.ready = []
+
+    async def on_secret_ready(self, namespace, secret_name):
+        self.ready.append(secret_name)
+
+class FakeChainService:
+    is_chain_secret = staticmethod(CAChainService.is_chain_secret)
+    shard_of_secret = staticmethod(CAChainService.shard_of_secret)
+
+    def __init__(self):
+        self.dirty = []
+
+    def mark_dirty(self, namespace, shard=None):
+        self.dirty.append(shard)
+
+class FakeCoreV1Api:
+    """Answers secret reads from a dict, counting them; `during_read` runs while a read is in flight."""
+
+    def __init__(self, secrets=None, during_read=None):
+        self.secrets = secrets or {}  # name -> data
+        self.during_read = during_read
+        self.reads = 0
+
+    def read_namespaced_secret(self, name, namespace):
+        self.reads += 1
+        if self.during_read is not None:
+            self.during_read()
+        if name not in self.secrets:
+            raise ApiException(status=404, reason='Not Found')
+        return V1Secret(metadata=V1ObjectMeta(name=name, namespace=namespace), data=self.secrets[name])
+
+class SecretCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = SecretCache()
+        self.provisioning = FakeProvisioningService()
+        self.chain = FakeChainService()
+        secret_controller.init_controller(self.cache, self.provisioning, self.chain)
+
+    def tearDown(self):
+        secret_controller.init_controller(None, None, None)
+
+    def run_watch(self, scenario):
+        """Run `await scenario(watch)` while the watch stream feeds the cache."""
+        async def main():
+            watch = FakeWatch()
+            feeding = asyncio.ensure_future(pump(watch))
+            try:
+                await scenario(watch)
+            finally:
+                watch.close()
+                await feeding
+        asyncio.run(main())
+
+    def test_events_update_the_cache(self):
+        async def scenario(watch):
+            name = 'a-intermediate-ca-secret'
+            watch.push(secret_event(None, name, {'tls.crt': 'v1'}))
+            await asyncio.sleep(0.01)
+            self.assertEqual(self.cache.get(name, NAMESPACE), {'tls.crt': 'v1'})
+
+            watch.push(secret_event('MODIFIED', name, {'tls.crt': 'v2'}))
+            await asyncio.sleep(0.01)
+            self.assertEqual(self.cache.get(name, NAMESPACE), {'tls.crt': 'v2'})
+            self.assertEqual(self.provisioning.ready, [name, name])
+
+            watch.push(secret_event('DELETED', name))
+            await asyncio.sleep(0.01)
+            self.assertIsNone(self.cache.get(name, NAMESPACE))
+        self.run_watch(scenario)
+
+    def test_only_managed_secrets_are_cached(self):
+        self.cache.apply_event('ADDED', secret_event(None, 'unrelated', {'password': 'x'})['object'])
+        self.cache.apply_event('ADDED', secret_event(None, 'labelled', {'ca.crt': 'x'},
+                                                     labels={MANAGED_LABEL: 'true'})['object'])
+        self.assertIsNone(self.cache.get('unrelated', NAMESPACE))
+        self.assertEqual(self.cache.get('labelled', NAMESPACE), {'ca.crt': 'x'})
+
+    def test_deleted_chain_secret_is_republished(self):
+        async def scenario(watch):
+            watch.push(secret_event('ADDED', 'ca-chain-secret-1', {'ca.crt': 'chain'}))
+            watch.push(secret_event('DELETED', 'ca-chain-secret-1'))
+            watch.push(secret_event('DELETED', 'ca-chain-secret-tenant-client-cert-secret'))
+            await asyncio.sleep(0.01)
+            self.assertEqual(self.chain.dirty, ['1'])
+        self.run_watch(scenario)
+
+    def test_read_goes_through_to_the_api_on_a_miss_only(self):
+        api = FakeCoreV1Api({'root-ca-secret': {'tls.crt': 'root'}})
+        cache = SecretCache(api)
+        self.assertEqual(cache.read('root-ca-secret', NAMESPACE), {'tls.crt': 'root'})
+        self.assertEqual(cache.read('root-ca-secret', NAMESPACE), {'tls.crt': 'root'})
+        self.assertEqual(api.reads, 1)
+
+        self.assertIsNone(cache.read('ca-chain-secret', NAMESPACE))
+        cache.apply_event('ADDED', secret_event('ADDED', 'ca-chain-secret', {'ca.crt': 'chain'})['object'])
+        self.assertEqual(cache.read('ca-chain-secret', NAMESPACE), {'ca.crt': 'chain'})
+        self.assertEqual(api.reads, 2)
+
+    def test_deletion_during_a_read_is_not_undone(self):
+        name = 'a-client-cert-secret'
+        api = FakeCoreV1Api({name: {'tls.crt': 'old'}})
+        cache = SecretCache(api)
+        # The watch delivers the deletion while the read-through is waiting on the API server
+        api.during_read = lambda: cache.apply_event('DELETED', secret_event('DELETED', name)['object'])
+        self.assertIsNone(cache.read(name, NAMESPACE))
+        self.assertIsNone(cache.get(name, NAMESPACE))
+        self.assertEqual(cache._reading, {})
+
+    def test_update_during_a_read_wins(self):
+        name = 'a-client-cert-secret'
+        api = FakeCoreV1Api({name: {'tls.crt': 'old'}})
+        cache = SecretCache(api)
+        api.during_read = lambda: cache.apply_event('MODIFIED', secret_event('MODIFIED', name,
+                                                                             {'tls.crt': 'new'})['object'])
+        self.assertEqual(cache.read(name, NAMESPACE), {'tls.crt': 'new'})
+
+    def test_waiter_is_resolved_by_the_watch(self):
+        async def scenario(watch):
+            name = 'a-client-cert-secret'
+            waiter = asyncio.ensure_future(
+                self.cache.wait_for(name, NAMESPACE, lambda data: 'tls.crt' in data, 5))
+            watch.push(secret_event('ADDED', name, {}))  # Created before cert-manager issued it
+            await asyncio.sleep(0.01)
+            self.assertFalse(waiter.done())
+            watch.push(secret_event('MODIFIED', name, {'tls.crt': 'cert'}))
+            self.assertEqual(await waiter, {'tls.crt': 'cert'})
+            self.assertEqual(self.cache._waiters, {})
+        self.run_watch(scenario)
+
+    def test_waiter_is_resolved_from_another_thread(self):
+        async def scenario():
+            cache = SecretCache()
+            waiter = asyncio.ensure_future(
+                cache.wait_for('ca-chain-secret', NAMESPACE, lambda data: data.get('ca.crt') == 'new', 5))
+            await asyncio.sleep(0)
+            event = secret_event('MODIFIED', 'ca-chain-secret', {'ca.crt': 'new'})['object']
+            thread = threading.Thread(target=cache.apply_event, args=('MODIFIED', event))
+            thread.start()
+            self.assertEqual(await waiter, {'ca.crt': 'new'})
+            thread.join()
+        asyncio.run(scenario())
+
+    def test_waiter_returns_cached_data_and_times_out(self):
+        async def scenario():
+            cache = SecretCache()
+            cache.apply_event('ADDED', secret_event('ADDED', 'ca-chain-secret', {'ca.crt': 'chain'})['object'])
+            data = await cache.wait_for('ca-chain-secret', NAMESPACE, lambda data: data.get('ca.crt') == 'chain', 5)
+            self.assertEqual(data, {'ca.crt': 'chain'})
+            with self.assertRaises(asyncio.TimeoutError):
+                await cache.wait_for('ca-chain-secret', NAMESPACE, lambda data: data.get('ca.crt') == 'new', 0.01)
+            self.assertEqual(cache._waiters, {})
+        asyncio.run(scenario())
+
+if __name__ == '__main__':
+    unittest.main()
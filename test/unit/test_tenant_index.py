@@ -0,0 +1,73 @@
+"""TenantIndex selection and bulk import batch tracking.
+
+    python -m pytest test/unit
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+from utils.tenant_index import BATCH_ANNOTATION, TenantIndex, matches_selector  # noqa: E402
+
+NAMESPACE = 'tenants'
+
+def tenant(name, batch=None, labels=None, **status):
+    annotations = {BATCH_ANNOTATION: batch} if batch else {}
+    return {'metadata': {'name': name, 'namespace': NAMESPACE, 'labels': labels, 'annotations': annotations},
+            'spec': {'name': name}, 'status': status}
+
+class MatchesSelectorTest(unittest.TestCase):
+    def test_match_labels_and_expressions(self):
+        labels = {'tier': 'gold', 'region': 'eu'}
+        self.assertTrue(matches_selector(labels, {'matchLabels': {'tier': 'gold'}}))
+        self.assertFalse(matches_selector(labels, {'matchLabels': {'tier': 'silver'}}))
+        self.assertTrue(matches_selector(labels, {'matchExpressions': [
+            {'key': 'region', 'operator': 'In', 'values': ['eu', 'us']},
+            {'key': 'tier', 'operator': 'NotIn', 'values': ['silver']},
+            {'key': 'region', 'operator': 'Exists'},
+            {'key': 'legacy', 'operator': 'DoesNotExist'},
+        ]}))
+        self.assertFalse(matches_selector(labels, {'matchExpressions': [
+            {'key': 'region', 'operator': 'In', 'values': ['us']}]}))
+        self.assertFalse(matches_selector(None, {'matchExpressions': [{'key': 'tier', 'operator': 'Exists'}]}))
+
+    def test_select_by_name_or_selector(self):
+        index = TenantIndex()
+        index.apply_event(None, tenant('a', labels={'tier': 'gold'}))
+        index.apply_event(None, tenant('b'))
+        index.apply_event(None, tenant('c', labels={'tier': 'silver'}))
+        selected = index.select(NAMESPACE, ['b'], {'matchLabels': {'tier': 'gold'}})
+        self.assertEqual(sorted(body['spec']['name'] for body in selected), ['a', 'b'])
+
+class BatchTest(unittest.TestCase):
+    def test_batch_is_in_progress_until_its_tenants_settle(self):
+        index = TenantIndex()
+        index.apply_event(None, tenant('a', batch='x'))
+        index.apply_event(None, tenant('b', batch='x'))
+        index.apply_event(None, tenant('c'))
+        self.assertTrue(index.batch_in_progress(NAMESPACE))
+        self.assertFalse(index.batch_in_progress('other'))
+
+        index.update_status(NAMESPACE, 'a', {'phase': 'InChain'})
+        self.assertTrue(index.batch_in_progress(NAMESPACE))
+        index.apply_event('MODIFIED', tenant('b', batch='x', state='Failed'))
+        self.assertFalse(index.batch_in_progress(NAMESPACE))
+
+        # A retried tenant provisions again
+        index.update_status(NAMESPACE, 'b', {'state': 'Creating'})
+        self.assertTrue(index.batch_in_progress(NAMESPACE))
+
+    def test_deleted_and_removed_tenants_release_the_batch(self):
+        index = TenantIndex()
+        index.apply_event(None, tenant('a', batch='x', phase='InChain'))
+        index.apply_event(None, tenant('b', batch='x'))
+        index.apply_event(None, tenant('c', batch='y'))
+        index.apply_event('DELETED', tenant('b', batch='x'))
+        self.assertTrue(index.batch_in_progress(NAMESPACE))
+        index.remove({(NAMESPACE, 'c')})
+        self.assertFalse(index.batch_in_progress(NAMESPACE))
+        self.assertEqual(index.keys(), {(NAMESPACE, 'a')})
+
+if __name__ == '__main__':
+    unittest.main()